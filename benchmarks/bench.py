@@ -0,0 +1,240 @@
+'''
+Benchmarks of the solver stages and of full runs.
+
+Times each stage separately (system construction, melt_activity_calculation
+with and without addF2O3, vapor_pressure_calculation and vaporise), full
+vaporisation runs of BSE and Komatiite at several temperatures and vaporised
+fractions, and a short main_temp_var sweep. Every benchmark records its wall
+time (best of --repeat, ten times as many for the stages), iteration counts
+and peak memory (tracemalloc, in a separate untimed run) to a JSON file, and
+is compared against a baseline JSON file to flag regressions. Timings depend on the machine, so save a
+baseline (--save-baseline) on the machine the comparisons are made on.
+
+    python benchmarks/bench.py [--quick] [--baseline FILE] [--save-baseline]
+'''
+# Standard libraries
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,_root)
+
+# Local modules
+from library.melt_vapor_system import system
+from library.melt_activity import melt_activity
+from library.vapor_pressure import vapor_pressure
+from library.vaporiser import vaporisation, vaporise
+import main_temp_var
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_inputs = {'BSE' : 'input/BSE.dat', 'Komatiite' : 'input/Komatiite.dat'}
+
+def _measure(setup,run,repeat):
+    '''
+    Best wall time of run(*setup()) over repeat calls (setup untimed), the
+    value run returns (iteration counts) and its peak traced memory
+    '''
+    best = np.inf
+    for _ in range(repeat):
+        args = setup()
+        t0 = time.perf_counter()
+        its = run(*args)
+        best = min(best,time.perf_counter() - t0)
+
+    args = setup()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'time' : best, 'iterations' : its, 'peak_memory' : peak}
+
+'''
+Stages, each timed on the state that the vaporisation loop passes to it
+'''
+def _state(cfg,comp,T,upto):
+    ''' System, melt and vapor after the stages before upto '''
+    sim = system(_inputs[comp],T)
+    melt = melt_activity(sim,backend=cfg['backend'])
+    vapor = vapor_pressure(sim,backend=cfg['backend'])
+    stages = ['melt','vapor','melt_F2O3','vapor_F2O3','vaporise']
+    for stage in stages[:stages.index(upto)]:
+        if stage.startswith('melt'):
+            melt.melt_activity_calculation(sim,addF2O3=stage == 'melt_F2O3',\
+                                           method=cfg['meltSolver'])
+        else:
+            vapor.vapor_pressure_calculation(sim,method=cfg['vaporSolver'])
+    return sim, melt, vapor
+
+def _system(comp,T):
+    system(_inputs[comp],T)
+
+def _vaporise(sim,melt,vapor):
+    vaporise(sim,vapor)
+
+def stage_benchmarks(cfg,comps,temps,repeat):
+    results = {}
+    for comp in comps:
+        for T in temps:
+            name = f'{comp}-{T}'
+
+            results[f'stage/system/{name}'] = _measure(\
+                lambda: (comp,T),_system,repeat)
+
+            for upto, addF2O3 in [('melt',False),('melt_F2O3',True)]:
+                results[f'stage/{upto}/{name}'] = _measure(\
+                    lambda: _state(cfg,comp,T,upto),\
+                    lambda sim, melt, vapor: melt.melt_activity_calculation(\
+                        sim,addF2O3=addF2O3,method=cfg['meltSolver']),repeat)
+
+            for upto in ['vapor','vapor_F2O3']:
+                results[f'stage/{upto}/{name}'] = _measure(\
+                    lambda: _state(cfg,comp,T,upto),\
+                    lambda sim, melt, vapor: vapor.vapor_pressure_calculation(\
+                        sim,method=cfg['vaporSolver'],\
+                        addF2O3=upto == 'vapor_F2O3'),repeat)
+
+            results[f'stage/vaporise/{name}'] = _measure(\
+                lambda: _state(cfg,comp,T,'vaporise'),_vaporise,repeat)
+    return results
+
+'''
+End-to-end runs
+'''
+def _full_run(cfg,comp,T,V):
+    sim = system(_inputs[comp],T)
+    melt = melt_activity(sim,backend=cfg['backend'])
+    vapor = vapor_pressure(sim,backend=cfg['backend'])
+    its = {'steps' : 0, 'melt' : 0, 'vapor' : 0}
+    for snapshot in vaporisation(sim,melt,vapor,V,cfg['meltSolver'],\
+                                 cfg['vaporSolver']):
+        its['steps'] = snapshot['step']
+        its['melt'] += snapshot['meltIterations']
+        its['vapor'] += snapshot['vaporIterations']
+    return its
+
+def _sweep(temps,V,comp):
+    its = {'melt' : 0, 'vapor' : 0}
+    for t in temps:
+        _, (meltIt, vaporIt) = main_temp_var.calc(t,V,_inputs[comp])
+        its['melt'] += meltIt
+        its['vapor'] += vaporIt
+    return its
+
+def run_benchmarks(cfg,comps,temps,fracs,sweep,repeat):
+    results = {}
+    for comp in comps:
+        for T in temps:
+            for V in fracs:
+                results[f'run/{comp}-{T}-{V}'] = _measure(\
+                    lambda: (),lambda: _full_run(cfg,comp,T,V),repeat)
+
+    main_temp_var.magpy_cfg.meltSolver = cfg['meltSolver']
+    main_temp_var.magpy_cfg.vaporSolver = cfg['vaporSolver']
+    main_temp_var.magpy_cfg.backend = cfg['backend']
+    main_temp_var.magpy_cfg.vaporStep = 'fixed'
+    temps = list(range(*sweep))
+    results[f'sweep/BSE-{temps[0]}-{temps[-1]}'] = _measure(\
+        lambda: (),lambda: _sweep(temps,0,'BSE'),repeat)
+    return results
+
+'''
+Baseline comparison
+'''
+def compare(results,baseline,tol):
+    '''
+    Regressions of results against baseline: benchmarks that got slower or
+    used more memory by more than a fraction tol, or whose iteration counts
+    changed. Returns a list of messages.
+    '''
+    flags = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for key in ['time','peak_memory']:
+            if res[key] > (1 + tol) * base[key]:
+                flags.append(f'{name}: {key} {res[key]:.4g} vs {base[key]:.4g} '
+                             f'(x{res[key]/base[key]:.2f})')
+        if res['iterations'] != base['iterations']:
+            flags.append(f'{name}: iterations {res["iterations"]} vs '
+                         f'{base["iterations"]}')
+    return flags
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the solver '
+                                     'stages and of full runs')
+    parser.add_argument('--quick',action='store_true',
+                        help='one composition, temperature and repeat')
+    parser.add_argument('--repeat',type=int,default=3,
+                        help='timed repeats per benchmark (best is kept)')
+    parser.add_argument('--melt-solver',default='fixed_point')
+    parser.add_argument('--vapor-solver',default='fixed_point')
+    parser.add_argument('--backend',default='numpy')
+    parser.add_argument('--out',default=os.path.join(_here,'results.json'),
+                        help='JSON file for the results')
+    parser.add_argument('--baseline',default=os.path.join(_here,'baseline.json'),
+                        help='JSON file of the baseline results')
+    parser.add_argument('--save-baseline',action='store_true',
+                        help='store the results as the baseline')
+    parser.add_argument('--tolerance',type=float,default=0.25,
+                        help='relative slowdown flagged as a regression')
+    args = parser.parse_args(argv)
+
+    os.chdir(_root)
+    cfg = {'meltSolver' : args.melt_solver, 'vaporSolver' : args.vapor_solver,\
+           'backend' : args.backend}
+    if args.quick:
+        comps, temps, fracs, sweep, repeat = ['BSE'], [2500], [0.1], \
+                                             (2000,2010,5), 1
+    else:
+        comps, temps, fracs, sweep, repeat = ['BSE','Komatiite'], \
+            [1800,2500,3000], [0.1,0.3], (2000,2050,5), args.repeat
+
+    # The stages take milliseconds, so they are repeated more often
+    results = stage_benchmarks(cfg,comps,temps,10*repeat)
+    results.update(run_benchmarks(cfg,comps,temps,fracs,sweep,repeat))
+
+    for name, res in results.items():
+        print(f'{name:<32} {res["time"]*1e3:10.3f} ms {res["peak_memory"]/1024:9.1f} kB'
+              f'  {res["iterations"]}')
+
+    summary = {'meta' : {'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+                         'python' : platform.python_version(),
+                         'numpy' : np.__version__,
+                         'machine' : platform.platform(),
+                         'quick' : args.quick, 'config' : cfg},
+               'benchmarks' : results}
+    with open(args.out,'w') as file:
+        json.dump(summary,file,indent=1)
+    print(f'Results written to {args.out}')
+
+    if args.save_baseline:
+        with open(args.baseline,'w') as file:
+            json.dump(summary,file,indent=1)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline {args.baseline} to compare with')
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['meta']['config'] != cfg:
+        print(f'Baseline was run with {baseline["meta"]["config"]}')
+    flags = compare(results,baseline['benchmarks'],args.tolerance)
+    for flag in flags:
+        print('REGRESSION',flag)
+    print(f'{len(flags)} regressions against {args.baseline}')
+    return 1 if flags else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
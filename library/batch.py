@@ -0,0 +1,369 @@
+# Standard libraries
+import re
+import copy
+from types import SimpleNamespace
+import numpy as np
+
+from library.vaporiser import _pressure_weights
+
+class batch_system():
+    '''
+    A batch of melt_vapor systems that are solved together. Every quantity
+    of system is kept as an array with one entry per member along the first
+    axis, so that the equilibrium and vaporisation loops below run over all
+    members at once. Members that have converged are masked out of the loops.
+
+    The batch is built from a system and temperatures, and optionally the
+    compositions of the members (weight % of the oxides, one row per member
+    ordered as sim._oxideNames), else every member has the composition of
+    sim. T and comp are broadcast against each other. melt_activity(batch)
+    and vapor_pressure(batch) then hold their constants as arrays over the
+    members.
+
+    Members whose equilibrium fails (non finite values, or more than 
+    maxIter iterations) are flagged in failed and dropped from the loops.
+    '''
+
+    def __init__(self,sim,T,comp=None):
+
+        self.T = np.atleast_1d(np.asarray(T,dtype=float))
+        if comp is not None:
+            comp = np.atleast_2d(np.asarray(comp,dtype=float))
+            n = max(self.T.size,comp.shape[0])
+            self.T = np.broadcast_to(self.T,(n,)).copy()
+            comp = np.broadcast_to(comp,(n,len(sim._oxideNames)))
+        self.size = n = self.T.size
+
+        self._avog = sim._avog
+        self._oxideNames = sim._oxideNames
+        self._metalNames = sim._metalNames
+        self._gasNames = sim._gasNames
+        self._presGasNames = sim._presGasNames
+        self._presLiqNames = sim._presLiqNames
+        self._metal2oxide = sim._metal2oxide
+        self._mwOxides = sim._mwOxides
+        self._elNames = sim._elNames
+
+        def members(values):
+            return np.tile(np.asarray(values,dtype=float),(n,1))
+
+        # Abundances (elements ordered as _elNames)
+        if comp is None:
+            self.abEl = members(sim._abEl)
+            self.fAbAtom = members(sim._fAbAtom)
+            self.fAbOx = members(sim._fAbOx)
+            self.abETot = np.full(n,float(sim.abETot))
+            self.mass = np.full(n,float(sim.mass))
+        else:
+            self.abEl, self.fAbAtom, self.fAbOx, self.abETot, self.mass = \
+                abundances(sim,comp)
+
+        # Melt (oxides ordered as _oxideNames)
+        self.gamma = members(sim._gamma)
+        self.act_ox = members(sim._act_ox)
+
+        # Vapor (gases ordered as _presGasNames, liquid species as 
+        # _presLiqNames and elements as _elNames followed by O)
+        self.presGas = members(sim._presGas)
+        self.presLiq = members(sim._presLiq)
+        self.adjFact = {gas : np.ones(n) for gas in self._gasNames}
+        self.n_el = np.zeros((n,len(self._elNames) + 1))
+        self.totPres = np.zeros(n)
+        self.gasMoleFrac = {}
+        self.massFrac = np.zeros(n)
+        self.vap = np.zeros(n)
+
+        # Counters
+        self.failed = np.zeros(n,dtype=bool)
+        self.steps = np.zeros(n,dtype=int)
+        self.meltIterations = np.zeros(n,dtype=int)
+        self.vaporIterations = np.zeros(n,dtype=int)
+
+        # Element of each metal oxide and weight of each element in the melt
+        self._oxEl = np.array([self._elNames.index(metal) if metal != 'Fe3' \
+                               else -1 for metal in self._metalNames])
+        self._halfOx = sim._halfOx
+        self._abFloor = sim._abFloor
+        self._wEl = sim._wEl
+
+    def oxide_fractions(self,idx,addF2O3):
+        '''
+        Mole fractions of the oxides of members idx, with the Fe2O3 entry
+        estimated from the gas chemistry as in melt_activity_calculation
+        '''
+        fAb = np.zeros((idx.size,len(self._oxideNames)))
+        metal = self._oxEl >= 0
+        fAb[:,metal] = self.fAbOx[np.ix_(idx,self._oxEl[metal])]
+        if addF2O3:
+            fAb[:,self._metalNames.index('Fe3')] = \
+                self.presLiq[idx,self._presLiqNames.index('Fe2O3')]
+        return fAb
+
+def abundances(sim,comp):
+    '''
+    The abundances of system for the compositions comp (weight % of the
+    oxides ordered as sim._oxideNames, one row per composition): abEl, 
+    fAbAtom, fAbOx (elements ordered as sim._elNames), abETot and the mass
+    of the melt. Abundances are normalised to Si = 1e6 (Avogadro's number 
+    per mole without Si).
+    '''
+    mw = np.array([sim._mwOxides[ox] for ox in sim._oxideNames])
+    molOx = comp / mw
+
+    # Metal atoms of each element per oxide
+    atoms = np.zeros((len(sim._oxideNames),len(sim._elNames)))
+    for i, ox in enumerate(sim._oxideNames):
+        metal, count = re.match(r'([A-Z][a-z]?)(\d*)',ox).groups()
+        atoms[i,sim._elNames.index(metal)] = int(count or 1)
+
+    # An empty composition gets NaN abundances (and fails in the solvers)
+    iSi = sim._oxideNames.index('SiO2')
+    with np.errstate(divide='ignore',invalid='ignore'):
+        scale = np.where(molOx[:,iSi] != 0,1e6/molOx[:,iSi],sim._avog)
+        abEl = (molOx @ atoms) * scale[:,None]
+
+        abETot = abEl.sum(axis=1)
+        abETot_ox = abEl @ sim._halfOx
+        fAbOx = sim._halfOx * abEl / abETot_ox[:,None]
+        fAbAtom = abEl / abETot[:,None]
+    return abEl, fAbAtom, fAbOx, abETot, abEl @ sim._wEl
+
+def _take(obj,idx,n):
+    ''' Shallow copy of obj with its per-member arrays restricted to idx '''
+    sub = copy.copy(obj)
+    for key, val in vars(obj).items():
+        if isinstance(val,np.ndarray) and val.shape[:1] == (n,):
+            setattr(sub,key,val[idx])
+    return sub
+
+def _put(dst,src,idx,n):
+    ''' Writes the per-member arrays of dict src into dict dst at idx '''
+    for key, val in src.items():
+        if key not in dst:
+            dst[key] = np.zeros(n)
+        dst[key][idx] = val
+
+def _columns(batch,idx):
+    '''
+    The state of members idx with one column per member, as the vapor 
+    pressure methods expect it (see vapor_pressure._unpack)
+    '''
+    return SimpleNamespace(T=batch.T[idx],_gasNames=batch._gasNames,\
+                           _oxideNames=batch._oxideNames,\
+                           _presLiqNames=batch._presLiqNames,\
+                           _presGas=batch.presGas[idx].T.copy(),\
+                           _presLiq=batch.presLiq[idx].T.copy(),\
+                           _act_ox=batch.act_ox[idx].T.copy())
+
+def melt_activity_batch(batch,melt,idx,addF2O3=False,maxIter=int(1e8)):
+    '''
+    melt_activity.fixed_point_gamma for the members idx of the batch. All
+    members iterate together with the same damping schedule, and those that
+    have converged or failed are dropped from the iteration.
+    Returns the number of iterations of each member.
+    '''
+    fAb = batch.oxide_fractions(idx,addF2O3)
+    gamma = batch.gamma[idx]
+    logK = melt._logK[idx]
+    act = np.zeros_like(gamma)
+    iters = np.zeros(idx.size,dtype=int)
+
+    work = np.arange(idx.size)
+    iit = 0
+    while work.size:
+
+        actW = fAb[work] * gamma[work]
+        melt.activities_melt_pseudo(actW,logK[work])
+        gamma_new = melt.recompute_gamma(actW,addF2O3)
+
+        # Compute ratio of newly computed activity and previous activity
+        ratio = gamma_new != 0
+        ratio[:,melt._iFe2O3] &= gamma_new[:,melt._iFeO] != 0
+        fGam = np.divide(gamma_new,gamma[work],out=np.ones_like(gamma_new),\
+                         where=ratio)
+
+        done = np.all(np.abs(np.log10(fGam)) < 1e-5,axis=1)
+        failed = ~done & ((iit + 1 >= maxIter) | \
+                          ~np.all(np.isfinite(gamma_new),axis=1))
+        act[work[done]] = actW[done]
+        iters[work[done]] = iit
+        iters[work[failed]] = iit + 1
+        batch.failed[idx[work[failed]]] = True
+        keep = ~(done | failed)
+        work, gamma_new = work[keep], gamma_new[keep]
+
+        if iit > 500:
+            gamma[work] = (gamma_new * gamma[work]**4)**(1/5)
+        elif iit > 30:
+            gamma[work] = (gamma_new * gamma[work]**2)**(1/3)
+        else:
+            gamma[work] = (gamma_new * gamma[work])**(1/2)
+
+        iit += 1 # updating counter
+
+    batch.gamma[idx] = gamma
+    batch.act_ox[idx] = act
+    batch.meltIterations[idx] += iters
+
+    return iters
+
+def vapor_pressure_batch(batch,vapor,idx,maxIter=int(1e8)):
+    '''
+    vapor_pressure.fixed_point_pressures for the members idx of the batch.
+    Members whose adjustment factors have all converged (or that failed) 
+    are written back to the batch and dropped from the iteration.
+    Returns the number of passes of each member.
+    '''
+    n = batch.size
+    iters = np.zeros(n,dtype=int)
+
+    work = idx
+    sub = _take(vapor,work,n)
+    sub.adjFact = {gas : batch.adjFact[gas][work] for gas in batch._gasNames}
+    mem = _columns(batch,work)
+    iit = 0
+    while work.size:
+
+        # Adjust gas pressure according to adjustment factor
+        mem._presGas[:len(batch._gasNames)] *= list(sub.adjFact.values())
+        sub.melt_pressure_calculation(mem)
+        sub.number_density(mem)
+        sub.recompute_adjFact_array(mem)
+        iit += 1
+
+        done = np.all([(1-vapor.dif_range < fact) & (fact < 1+vapor.dif_range)\
+                       | (fact == 0) for fact in sub.adjFact.values()],axis=0)
+        failed = ~done & ((iit >= maxIter) | \
+                          ~np.all(np.isfinite(mem._presGas),axis=0))
+        out = done | failed
+        if out.any():
+            fin = work[out]
+            batch.presGas[fin] = mem._presGas[:,out].T
+            batch.presLiq[fin] = mem._presLiq[:,out].T
+            batch.n_el[fin] = sub._n_el[:,out].T
+            _put(batch.adjFact,{k : v[out] for k, v in sub.adjFact.items()},fin,n)
+            iters[fin] = iit
+            batch.failed[work[failed]] = True
+
+            keep = ~out
+            work = work[keep]
+            adjFact = {k : v[keep] for k, v in sub.adjFact.items()}
+            sub = _take(vapor,work,n)
+            sub.adjFact = adjFact
+            mem.T = mem.T[keep]
+            mem._presGas = mem._presGas[:,keep]
+            mem._presLiq = mem._presLiq[:,keep]
+            mem._act_ox = mem._act_ox[:,keep]
+
+    batch.vaporIterations[idx] += iters[idx]
+
+    return iters[idx]
+
+def vaporise_batch(batch,idx,V=None):
+    '''
+    vaporiser.vaporise for the members idx of the batch: removes 5% of the
+    most volatile element of each member, or less for the members whose 
+    step would take them past the vaporised fraction V (if given), so that
+    they end exactly at V. Returns the vaporised fractions.
+    '''
+    P = batch.presGas[idx]
+
+    # Total gas pressure, summed over the gases of each element
+    totPres = P @ _pressure_weights(batch._presGasNames,batch._elNames)
+    batch.totPres[idx] = totPres
+
+    # Gas mole fraction (P/Ptot)
+    _put(batch.gasMoleFrac,dict(zip(batch._presGasNames,(P/totPres[:,None]).T)),\
+         idx,batch.size)
+
+    # Total mole fractions of each element in the gas
+    n_el = batch.n_el[idx]
+    n_frac = n_el[:,:-1] / n_el.sum(axis=1)[:,None]
+
+    fAbAtom = batch.fAbAtom[idx]
+    abEl = batch.abEl[idx]
+    present = fAbAtom > 1e-20
+
+    # Calculating vaporisation fractions using the most volatile element
+    with np.errstate(divide='ignore',invalid='ignore'):
+        volatilities = np.where(present,n_frac/fAbAtom,0)
+        volatilities1 = np.where(present,n_frac/abEl,0)
+    vapoFrac = 0.05/volatilities.max(axis=1)
+    vapoFrac1 = 0.05/volatilities1.max(axis=1)
+
+    # Shortening the steps that cross V. The vaporised fraction is linear in
+    # the step (but for the abundances zeroed below _abFloor), so the step
+    # that ends at V is found directly instead of by vaporiser.limit_step
+    if V is not None:
+        left = (V - 1)*batch.abETot[idx] + abEl.sum(axis=1)
+        scale = np.minimum(1,left/(vapoFrac1*n_frac.sum(axis=1)))
+        vapoFrac = scale * vapoFrac
+        vapoFrac1 = scale * vapoFrac1
+
+    # Calculate new abundances for each element
+    fAbAtom = fAbAtom - vapoFrac[:,None] * n_frac
+    abEl = abEl - vapoFrac1[:,None] * n_frac
+
+    # Ensuring that no abundance values are negative
+    empty = abEl <= batch._abFloor
+    abEl[empty] = 0
+    fAbAtom[empty] = 0
+
+    # Fraction of vaporised magma and weight percent vaporized (the
+    # shortened steps end at V, to rounding)
+    vap = 1 - abEl.sum(axis=1)/batch.abETot[idx]
+    if V is not None:
+        vap = np.where(scale < 1,np.maximum(vap,V),vap)
+    massVapo = abEl @ batch._wEl
+    batch.massFrac[idx] = (batch.mass[idx] - massVapo)/batch.mass[idx]
+
+    # Renormalize the abundances
+    fAbAtom_tot = fAbAtom.sum(axis=1)
+    fAbOx_tot = (batch._halfOx * fAbAtom).sum(axis=1)
+    batch.fAbOx[idx] = batch._halfOx * fAbAtom / fAbOx_tot[:,None]
+    batch.fAbAtom[idx] = fAbAtom / fAbAtom_tot[:,None]
+    batch.abEl[idx] = abEl
+    batch.vap[idx] = vap
+
+    return vap
+
+def equilibrium_batch(batch,melt,vapor,idx,maxIter=int(1e8)):
+    '''
+    vaporiser.equilibrium for the members idx of the batch: the oxide
+    activities and partial pressures, repeated with F2O3 added. Returns the
+    members of idx that have not failed.
+    '''
+    for addF2O3 in [False,True]:
+        melt_activity_batch(batch,melt,idx,addF2O3,maxIter)
+        idx = idx[~batch.failed[idx]]
+        vapor_pressure_batch(batch,vapor,idx,maxIter)
+        idx = idx[~batch.failed[idx]]
+    return idx
+
+def vaporise_all(batch,melt,vapor,V,maxSteps=1e5,maxIter=int(1e8)):
+    '''
+    Runs the vaporisation loop of main.py for every member of the batch in
+    lockstep, until each member has vaporised a fraction V (or reached
+    maxSteps steps). The last step of each member ends exactly at V, as in
+    vaporiser.vaporisation, but the steps are not shortened at the 
+    exhaustion of an element and no exhaustion events are recorded: an 
+    element leaves the melt when its abundance falls below the floor. 
+    Members that fail (see batch_system) are masked out after the stage in
+    which they failed.
+    '''
+    running = np.arange(batch.size)
+    while running.size:
+
+        # Calculating activities and partial pressures
+        running = equilibrium_batch(batch,melt,vapor,running,maxIter)
+
+        # Remove vapor
+        vaporise_batch(batch,running,V)
+        batch.steps[running] += 1
+        batch.failed[running] |= ~np.isfinite(batch.vap[running])
+
+        running = running[(batch.vap[running] < V) & \
+                          (batch.steps[running] <= maxSteps) & \
+                          ~batch.failed[running]]
+
+    return batch.vap
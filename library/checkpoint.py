@@ -0,0 +1,99 @@
+# Standard libraries
+import os
+import json
+import numpy as np
+
+from library.vaporiser import _state, _restore
+
+'''
+Checkpoints of a vaporisation run: the composition and equilibrium of the
+system (the state arrays, and the adjustment factors, number densities,
+pseudospecies activities, Broyden Jacobians and pruned pseudospecies of the
+solvers that seed the next step) and the counters of the loop, in one 
+binary .npz file (no pickle).
+A run resumed from a checkpoint continues with the same results as the run
+that wrote it.
+'''
+
+def save(fname,sim,melt,vapor,loop,step=None,sink=None):
+    '''
+    Writes the checkpoint of sim, melt and vapor to fname, replacing the
+    previous one only once it is complete. loop holds the counters of the
+    vaporisation loop (JSON types: step, vap, iteration counts, events,
+    ...), step the adaptive_step and sink the csv_sink of the run if any.
+    '''
+    state = _state(sim,melt,vapor)
+    arrays = {name : state[name] for name in sim._stateNames}
+    arrays.update(n_el=state['n_el'],act_pseudo=state['act_pseudo'],\
+                  adjFact=np.array(list(state['adjFact'].values()),dtype=float),\
+                  gasMoleFrac=np.array(list(state['gasMoleFrac'].values()),\
+                                       dtype=float))
+
+    meta = {'T' : float(sim.T), 'comp' : sim.comp_init, 'loop' : loop, \
+            'totPres' : float(state['totPres']), \
+            'massFrac' : float(state['massFrac']), \
+            'gasNames' : list(state['gasMoleFrac']), 'jacGases' : None}
+    if vapor._jacGases is not None:
+        meta['jacGases'] = list(vapor._jacGases)
+        arrays['jac'] = vapor._jac
+    if vapor._jacGlobalKeys is not None and vapor._jacGlobal is not None:
+        meta['jacGlobalKeys'] = [list(keys) for keys in vapor._jacGlobalKeys]
+        arrays['jacGlobal'] = vapor._jacGlobal
+    if melt.prune is not None:
+        meta['prune'] = {'pruned' : [int(j) for j in melt._pruned], \
+                         'calls' : melt._calls, 'error' : melt.pruneError}
+    if step is not None:
+        meta['step'] = {key : getattr(step,key) for key in \
+                        ['frac','accepted','rejected']}
+    if sink is not None:
+        sink.flush()
+        meta['sink'], sinkArrays = sink.state()
+        arrays.update({'sink_' + key : val for key, val in sinkArrays.items()})
+    arrays['meta'] = np.array(json.dumps(meta,default=lambda val: val.item()))
+
+    tmp = fname + '.tmp'
+    with open(tmp,'wb') as file:
+        np.savez(file,**arrays)
+    os.replace(tmp,fname)
+
+def load(fname,sim,melt,vapor,step=None):
+    '''
+    Restores the state of sim, melt and vapor (and step) from the checkpoint
+    fname, which must be of the same temperature and composition. Returns
+    the loop counters and the state of the csv_sink (or None).
+    '''
+    with np.load(fname) as data:
+        arrays = {key : data[key] for key in data.files}
+    meta = json.loads(arrays.pop('meta').item())
+    if meta['T'] != sim.T or meta['comp'] != sim.comp_init:
+        raise ValueError(f'Checkpoint {fname} is of another temperature or '
+                         'composition')
+
+    state = {name : arrays[name] for name in sim._stateNames}
+    state.update(n_el=arrays['n_el'],act_pseudo=arrays['act_pseudo'],\
+                 adjFact=dict(zip(sim._gasNames,arrays['adjFact'].tolist())),\
+                 gasMoleFrac=dict(zip(meta['gasNames'],\
+                                      arrays['gasMoleFrac'].tolist())),\
+                 totPres=meta['totPres'],massFrac=meta['massFrac'])
+    _restore(sim,melt,vapor,state)
+    if meta['jacGases'] is not None:
+        vapor._jac, vapor._jacGases = arrays['jac'], tuple(meta['jacGases'])
+    if 'jacGlobalKeys' in meta:
+        vapor._jacGlobal = arrays['jacGlobal']
+        vapor._jacGlobalKeys = tuple(tuple(keys) for keys in \
+                                     meta['jacGlobalKeys'])
+
+    if 'prune' in meta:
+        melt._calls = meta['prune']['calls']
+        melt.pruneError = meta['prune']['error']
+        melt.select_active(melt._gone,meta['prune']['pruned'])
+        melt.set_pseudo_activities(state['act_pseudo'])
+
+    if step is not None and 'step' in meta:
+        vars(step).update(meta['step'])
+
+    sink = None
+    if 'sink' in meta:
+        sink = meta['sink'], {key[5:] : val for key, val in arrays.items() \
+                              if key.startswith('sink_')}
+    return meta['loop'], sink
@@ -0,0 +1,173 @@
+# Standard libraries
+from collections.abc import Mapping
+import numpy as np
+
+from library.melt_vapor_system import system
+from library.melt_activity import melt_activity
+from library.vapor_pressure import vapor_pressure
+from library.vaporiser import equilibrium, _pressure_weights
+from library.batch import batch_system, equilibrium_batch
+
+'''
+In-process interface to the melt-vapor equilibrium for coupling to another
+code (e.g. VULCAN): a solver object called with temperatures and melt
+compositions that returns the gas mole fractions and total pressures as
+arrays, without input files, magpy_cfg, text output or progress bars.
+
+    solver = equilibrium_solver()
+    x, totPres = solver.solve(2500,{'SiO2' : 45.97, 'MgO' : 36.66, ...})
+    x['SiO'] -> x[solver.gasNames.index('SiO')]
+    X, totPres = solver.solve_batch([2000,2500,3000],comps)
+'''
+
+def weights(comp):
+    '''
+    Weight % of the oxides, ordered as system._oxideNames, of the melt
+    compositions comp: a mapping {oxide : weight %} (missing oxides are 0,
+    the values may be arrays with one entry per composition), a sequence of
+    such mappings, or an array with the oxides along the last axis.
+    Raises ValueError for unknown oxides, negative or non-finite weights and
+    compositions of total 0 (system normalises the weights by their total).
+    '''
+    names = system._oxideNames
+    if isinstance(comp,Mapping):
+        unknown = [ox for ox in comp if ox not in names]
+        if unknown:
+            raise ValueError(f'Unknown oxides: {unknown}')
+        wt = np.stack(np.broadcast_arrays(*[np.asarray(comp.get(ox,0.),\
+                      dtype=float) for ox in names]),axis=-1)
+    elif len(comp) and isinstance(comp[0],Mapping):
+        return np.array([weights(c) for c in comp])
+    else:
+        wt = np.asarray(comp,dtype=float)
+        if wt.shape[-1:] != (len(names),):
+            raise ValueError(f'Compositions must give the weight % of {names}')
+
+    bad = ~np.isfinite(wt)
+    if bad.any():
+        raise ValueError('Non-finite weight % of '
+                         f'{sorted({names[i] for i in np.nonzero(bad)[-1]})}')
+    bad = wt < 0
+    if bad.any():
+        raise ValueError('Negative weight % of '
+                         f'{sorted({names[i] for i in np.nonzero(bad)[-1]})}')
+    zero = wt.sum(axis=-1) == 0
+    if zero.any():
+        raise ValueError('Total weight % 0 for the compositions '
+                         f'{np.argwhere(zero).tolist()}' if zero.ndim else \
+                         'Total weight % 0 for the composition')
+    return wt
+
+class equilibrium_solver():
+    '''
+    Melt-vapor equilibrium of a melt of given temperature and composition
+    (vaporiser.equilibrium, no vaporisation), as arrays of the gas mole
+    fractions (ordered as gasNames) and total pressure (the sum of the gas
+    pressures over the elements, as system.totPres).
+
+    solve is one equilibrium with the options below, warm started from the
+    previous solve if the melt has the same elements (the melt_activity and
+    vapor_pressure objects are kept while T does not change). solve_batch
+    solves many (T, composition) at once with the fixed point solvers (see
+    batch.py).
+
+    meltSolver, vaporSolver, coupled: see vaporiser.equilibrium
+    backend, prune, pruneEvery: see melt_activity and vapor_pressure
+    warm: start each solve from the previous equilibrium (False: from the
+    initial values of system, as main.py)
+    '''
+    gasNames = system._presGasNames
+    oxideNames = system._oxideNames
+
+    def __init__(self,meltSolver='fixed_point',vaporSolver='fixed_point',\
+                 coupled=False,backend='numpy',prune=None,pruneEvery=50,\
+                 warm=True):
+        self.meltSolver = meltSolver
+        self.vaporSolver = vaporSolver
+        self.coupled = coupled
+        self.backend = backend
+        self.prune = prune
+        self.pruneEvery = pruneEvery
+        self.warm = warm
+        self.sim = None # System, melt_activity and vapor_pressure of the
+        self.melt = None # last solve
+        self.vapor = None
+        self._weights = _pressure_weights(system._presGasNames,\
+                                          system._elNames)
+
+    def _solvers(self,sim):
+        ''' melt_activity and vapor_pressure of sim '''
+        return melt_activity(sim,backend=self.backend,prune=self.prune,\
+                             pruneEvery=self.pruneEvery), \
+               vapor_pressure(sim,backend=self.backend)
+
+    def _equilibrium(self,sim):
+        ''' Solves sim, from the last equilibrium if warm '''
+        last = self.sim
+        if not self.warm or last is None or \
+           not np.array_equal(last._abEl == 0,sim._abEl == 0):
+            melt, vapor = self._solvers(sim)
+        else:
+            for name in ['act_ox','gamma','presLiq','presGas']:
+                getattr(sim,'_' + name)[:] = getattr(last,'_' + name)
+            if sim.T == last.T:
+                melt, vapor = self.melt, self.vapor
+            else:
+                melt, vapor = self._solvers(sim)
+        equilibrium(sim,melt,vapor,self.meltSolver,self.vaporSolver,\
+                    self.coupled)
+        return melt, vapor
+
+    def solve(self,T,comp,x=None,totPres=None):
+        '''
+        Equilibrium of the melt of composition comp (see weights) at T.
+        Returns the gas mole fractions and the total pressure, written into
+        x (an array of len(gasNames)) and totPres (an array of size 1) if
+        given. Raises RuntimeError if no equilibrium is found.
+        '''
+        sim = system(dict(zip(self.oxideNames,weights(comp).tolist())),T)
+        try:
+            melt, vapor = self._equilibrium(sim)
+            found = np.all(np.isfinite(sim._presGas))
+        except RuntimeError:
+            found = False
+        if not found and self.sim is not None:
+            # Again from the initial values
+            self.sim = None
+            sim = system(sim.comp_init,T)
+            melt, vapor = self._equilibrium(sim)
+            found = np.all(np.isfinite(sim._presGas))
+        if not found:
+            self.sim = None
+            raise RuntimeError(f'No melt-vapor equilibrium found at T = {T}')
+        self.sim, self.melt, self.vapor = sim, melt, vapor
+
+        P = sim._presGas
+        total = float(self._weights @ P)
+        x = np.divide(P,total,out=x)
+        if totPres is not None:
+            totPres[...] = total
+        return x, total
+
+    def solve_batch(self,T,comp,x=None,totPres=None,maxIter=10000):
+        '''
+        Equilibria of the melts of compositions comp (see weights, one per
+        row) at the temperatures T, broadcast against each other. Returns
+        the gas mole fractions (one row per melt) and total pressures,
+        written into x and totPres if given. Melts whose equilibrium fails
+        (see batch_system, with maxIter iterations at most) are NaN.
+        '''
+        wt = np.atleast_2d(weights(comp))
+        T = np.atleast_1d(np.asarray(T,dtype=float))
+        # The names and weights of the template are shared by every member,
+        # its composition is not used
+        sim = system(dict(zip(self.oxideNames,wt[0].tolist())),T[0])
+        batch = batch_system(sim,T,wt)
+        equilibrium_batch(batch,melt_activity(batch),vapor_pressure(batch),\
+                          np.arange(batch.size),maxIter)
+
+        P = batch.presGas
+        P[batch.failed] = np.nan
+        total = np.matmul(P,self._weights,out=totPres)
+        x = np.divide(P,total[:,None],out=x)
+        return x, total
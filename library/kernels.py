@@ -0,0 +1,273 @@
+# Standard libraries
+import warnings
+import numpy as np
+
+'''
+Compiled kernels for the inner equilibrium loops (backend 'numba').
+
+The fixed point iterations of melt_activity and vapor_pressure run here as
+scalar loops on flat arrays, compiled with Numba in nopython mode and cached
+on disk (in __pycache__), so that only the first run compiles them. The
+arithmetic is that of melt_activity.fixed_point_gamma and
+vapor_pressure.pressure_pass and must be kept in step with them; the results
+agree with the numpy backend to rounding.
+
+Numba is optional: without it the numba backend falls back to numpy (see
+resolve), the kernels below then still run as plain (slow) Python.
+'''
+try:
+    import numba
+except ImportError:
+    numba = None
+
+backends = 'numpy', 'numba'
+
+def resolve(backend):
+    ''' The backend to use for the requested one (see module docstring) '''
+    if backend not in backends:
+        raise ValueError(f'Unknown backend: {backend}')
+    if backend == 'numba' and numba is None:
+        warnings.warn('numba is not installed, using the numpy backend')
+        return 'numpy'
+    return backend
+
+def _jit(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+'''
+###### Melt activities ######
+'''
+@_jit
+def activities_melt_pseudo(act,logK,stoich,contains,pseudo):
+    ''' melt_activity.activities_melt_pseudo into pseudo '''
+    nOx = act.size
+    for j in range(logK.size):
+        logAct = logK[j]
+        for i in range(nOx):
+            if contains[j,i]:
+                if act[i] == 0:
+                    logAct = -np.inf
+                    break
+                logAct += stoich[j,i] * np.log(act[i])
+        pseudo[j] = np.exp(logAct)
+
+@_jit
+def recompute_gamma(act,pseudo,massBal,oxBal,iFeO,iFe2O3,addF2O3,gamma_new):
+    ''' melt_activity.recompute_gamma into gamma_new '''
+    nOx = act.size
+    for i in range(nOx):
+        if act[i] == 0:
+            gamma_new[i] = 0.
+            continue
+        denom = 0.
+        for k in range(nOx):
+            denom += oxBal[i,k] * act[k]
+        for j in range(pseudo.size):
+            denom += pseudo[j] * massBal[j,i]
+        gamma_new[i] = act[i] / denom
+
+    if not addF2O3:
+        gamma_new[iFe2O3] = 1.
+    elif act[iFeO] == 0:
+        gamma_new[iFe2O3] = 0.
+
+@_jit
+def melt_fixed_point(fAb,gamma,logK,stoich,contains,massBal,oxBal,iFeO,\
+                     iFe2O3,addF2O3,maxIter):
+    '''
+    melt_activity.fixed_point_gamma. Returns the activities, activity
+    coefficients and pseudospecies activities, and the number of iterations
+    (maxIter if it did not converge).
+    '''
+    nOx = fAb.size
+    gamma = gamma.copy()
+    act = np.empty(nOx)
+    gamma_new = np.empty(nOx)
+    pseudo = np.empty(logK.size)
+
+    iit = 0
+    while iit < maxIter:
+
+        for i in range(nOx):
+            act[i] = fAb[i] * gamma[i]
+        activities_melt_pseudo(act,logK,stoich,contains,pseudo)
+        recompute_gamma(act,pseudo,massBal,oxBal,iFeO,iFe2O3,addF2O3,gamma_new)
+
+        # Converged if every gamma (with a ratio) changed by < 1e-5 in log10
+        converged = True
+        for i in range(nOx):
+            if gamma_new[i] == 0 or (i == iFe2O3 and gamma_new[iFeO] == 0):
+                continue
+            if not abs(np.log10(gamma_new[i]/gamma[i])) < 1e-5:
+                converged = False
+                break
+        if converged:
+            break
+
+        for i in range(nOx):
+            if iit > 500:
+                gamma[i] = (gamma_new[i] * gamma[i]**4)**(1/5)
+            elif iit > 30:
+                gamma[i] = (gamma_new[i] * gamma[i]**2)**(1/3)
+            else:
+                gamma[i] = (gamma_new[i] * gamma[i])**(1/2)
+        iit += 1
+
+    return act, gamma, pseudo, iit
+
+'''
+###### Vapor pressures ######
+Key pressures, adjustment factors (ordered as system._gasNames), liquid
+pressures and activities are in the order of system, the constants and the
+plan (ops, pows, nodes) those of vapor_pressure._plan (or of the plan of its
+active set, with the constants of the species left out taken as 0).
+'''
+@_jit
+def melt_pressure_calculation(P,L,K,ops,pows,nodes,nGas,nIon):
+    '''
+    vapor_pressure.melt_pressure_calculation: evaluates the nodes of the
+    reactions.pressure_plan, then the neutral gases, the cations and the
+    liquid species
+    '''
+    nKey = P.size - nGas - nIon - 1
+    x = np.empty(nKey + pows.size)
+    x[:nKey] = P[:nKey]
+    for n in range(pows.size):
+        a = x[ops[n,1]]
+        if ops[n,0] == 0:
+            x[nKey+n] = a * x[ops[n,2]]
+        elif ops[n,0] == 1:
+            x[nKey+n] = a**pows[n]
+        else:
+            x[nKey+n] = 1 / a
+
+    for j in range(nodes.size):
+        val = K[j] * x[nodes[j]] if nodes[j] >= 0 else K[j]
+        if j < nGas:
+            P[nKey+j] = val
+        elif j < nGas + nIon:
+            P[nKey+j+1] = val
+        else:
+            L[j-nGas-nIon] = val
+
+    # Ions, P(e-) = sqrt(sum of the cations)
+    cations = 0.
+    for j in range(nIon):
+        cations += P[nKey+nGas+1+j]
+    EnE = np.sqrt(cations)
+    P[nKey+nGas] = EnE
+    for j in range(nIon):
+        P[nKey+nGas+1+j] = P[nKey+nGas+1+j] / EnE if EnE != 0 else 0.
+
+@_jit
+def number_density(P,gasAtoms,oxideO,nConv,n_el):
+    '''
+    vapor_pressure.number_density into n_el, returns the ratio of the O in
+    the oxide gases to all the O
+    '''
+    for e in range(gasAtoms.shape[0]):
+        n = 0.
+        for j in range(P.size):
+            n += gasAtoms[e,j] * P[j]
+        n_el[e] = n * nConv
+    oxO = 0.
+    for e in range(oxideO.size):
+        oxO += oxideO[e] * n_el[e]
+    return oxO / n_el[-1]
+
+@_jit
+def _adjust(act,liq):
+    ''' Adjustment factor act/liq (see recompute_adjFact) '''
+    if liq != 0 and act != 0:
+        return (act / liq)**0.5
+    elif act == 0:
+        return 0.
+    return 1.
+
+@_jit
+def recompute_adjFact(L,act,ratio,adj):
+    ''' vapor_pressure.recompute_adjFact into adj '''
+    SiO2, MgO, Al2O3, TiO2, Fe2O3, FeO, CaO, Na2O, K2O = act[0], act[1], \
+        act[2], act[3], act[4], act[5], act[6], act[7], act[8]
+    SiO2L, MgOL, Al2O3L, TiO2L, Fe2O3L, FeOL, CaOL, Na2OL, K2OL = L[0], L[1],\
+        L[2], L[3], L[4], L[5], L[6], L[7], L[8]
+
+    # SiO
+    if SiO2L != 0 and SiO2 != 0:
+        adj[0] = 1 / (ratio * (SiO2L / SiO2)**0.5)
+    elif SiO2 == 0:
+        adj[0] = 0.
+    else:
+        adj[0] = 1.
+
+    # MgO
+    if MgOL != 0:
+        adj[2] = MgO / MgOL
+
+    # Fe
+    if FeOL != 0 or Fe2O3L != 0:
+        adj[3] = (FeO + Fe2O3) / (FeOL + Fe2O3L)
+    elif FeO == 0:
+        adj[3] = 0.
+    else:
+        adj[3] = 1.
+
+    # Ca, Al, Ti, Na, K
+    adj[4] = _adjust(CaO,CaOL)
+    adj[5] = _adjust(Al2O3,Al2O3L)
+    adj[6] = _adjust(TiO2,TiO2L)
+    adj[7] = _adjust(Na2O,Na2OL)
+    adj[8] = _adjust(K2O,K2OL)
+
+    # O2, governed by the most abundant volatile metal oxide
+    if SiO2L != 0 and SiO2 != 0:
+        adj[1] = ratio * SiO2 / SiO2L
+    elif MgO != 0:
+        adj[1] = ratio * MgO / MgOL
+    elif FeO != 0:
+        adj[1] = ratio * (FeO + Fe2O3) / (FeOL + Fe2O3L)
+    elif CaO != 0:
+        adj[1] = ratio * CaO / CaOL
+    elif Al2O3 != 0:
+        adj[1] = ratio * Al2O3 / Al2O3L
+    elif TiO2 != 0:
+        adj[1] = ratio * TiO2 / TiO2L
+    elif Na2O != 0:
+        adj[1] = ratio * Na2O / Na2OL
+    elif K2O != 0:
+        adj[1] = ratio * K2O / K2OL
+    else:
+        adj[1] = 1.
+
+@_jit
+def vapor_fixed_point(P,L,act,K,ops,pows,nodes,nGas,nIon,adj,gasAtoms,oxideO,\
+                      nConv,difRange,maxIter):
+    '''
+    vapor_pressure.fixed_point_pressures on P, L and adj. Returns the number
+    of passes (maxIter if it did not converge), the number densities of the
+    elements and the oxide O ratio of the last pass.
+    '''
+    n_el = np.zeros(gasAtoms.shape[0])
+    ratio = 0.
+    iit = 0
+    while iit < maxIter:
+
+        # One pressure pass (vapor_pressure.pressure_pass)
+        for i in range(adj.size):
+            P[i] *= adj[i]
+        melt_pressure_calculation(P,L,K,ops,pows,nodes,nGas,nIon)
+        ratio = number_density(P,gasAtoms,oxideO,nConv,n_el)
+        recompute_adjFact(L,act,ratio,adj)
+        iit += 1
+
+        converged = True
+        for i in range(adj.size):
+            if not (1-difRange < adj[i] < 1+difRange or adj[i] == 0):
+                converged = False
+                break
+        if converged:
+            break
+
+    return iit, n_el, ratio
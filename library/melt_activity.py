@@ -1,418 +1,254 @@
+import functools
 import numpy as np
 
-class melt_activity():
-    '''
-    Calculates the activity of the oxides in the melt for a given composition
-    and temperature using IMCC.
-    '''
-    def __init__(self,sim):
-        
-        '''
-        The equilibrium constants for each of the relevant oxide pseudospecies
-        is calculated below for the given temperature. The log10K values from
-        which the A and B values are derived are given in the comments. See 
-        Fegley et al. (1987) and Shaefer and Fegley (2004) for the source of 
-        these values. 
-        '''
-
-        self.name_pseudo = {} # Names of oxide pseudospecies
-        self.K_pseudo = {} # Equilibrium constant for oxide pseudospecies
-        self.act_pseudo = {}
-        '''
-        MgO(liq) + SiO2(liq) = MgSiO3(liq)
-        log10K(MgSiO3) = - 23.67 + 102856/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['MG1'] = 'MgSiO3'
-        self.K_pseudo['MG1'] = 10**( 0.42 + 2329/sim.T)
-
-        '''
-        2MgO(liq) + SiO2(liq) = Mg2SiO4(liq)
-        log10K(Mg2SiO4) = - 34.08 + 141582/T
-        -2log10K(MgO)   =  18.10 - 67242/T
-         -log10K(SiO2)  =  15.04 - 66906/T
-        '''
-        self.name_pseudo['MG2'] = 'Mg2SiO4'
-        self.K_pseudo['MG2'] = 10**(- 0.94 + 7434/sim.T)
-
-        '''
-        MgO(liq) + Al2O3(liq) = MgAl2O4(liq)
-        log10K(MgAl2O4) = - 31.55 + 142219/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -log10K(Al2O3) = 23.68 - 108134/T
-        '''
-        self.name_pseudo['MG3'] = 'MgAl2O4'
-        self.K_pseudo['MG3'] = 10**(1.18 + 464/sim.T)
-
-        '''
-        MgO(liq) + TiO2(liq) = MgTiO3(liq)
-        log10K(MgTiO3) = - 22.54 + 103180/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -log10K(TiO2) = 13.36 - 66313/T
-        '''
-        self.name_pseudo['MG4'] = 'MgTiO3'
-        self.K_pseudo['MG4'] = 10**(- 0.13 + 3246/sim.T)
-
-        '''
-        MgO(liq) + 2TiO2(liq) = MgTi2O5(liq)
-        log10K(MgTi2O5) = - 35.26 + 169092/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -2log10(TiO2) = 26.72 - 132626/T
-        '''
-        self.name_pseudo['MG5'] = 'MgTi2O5'
-        self.K_pseudo['MG5'] = 10**(0.51 + 2845/sim.T)
-
-        '''
-        2MgO(liq) + TiO2(liq) = Mg2TiO4(liq)
-        log10K(Mg2TiO4) = - 30.79 + 137367/T
-        -2log10K(MgO) = 18.10 - 67242/T
-        -log10K(TiO2) = 13.36 - 66313/T
-        '''
-        self.name_pseudo['MG6'] = 'Mg2TiO4'
-        self.K_pseudo['MG6'] = 10**(0.67 + 3812/sim.T)
-
-        '''
-        2MgO(liq) + 2Al2O3(liq) + 5SiO2(liq) = Mg2Al4Si5O18(liq)
-        log10K(Mg2Al4Si5O18) = - 132.38 + 618040/T
-        -2log10K(MgO) = 18.10 - 67242/T
-        -2log10K(Al2O3) = 47.36 - 216268/T
-        -5log10K(SiO2) = 75.20 - 334530/T
-        '''
-        self.name_pseudo['MG7'] = 'Mg2Al4Si5O18'
-        self.K_pseudo['MG7'] = 10**7.48
-
-        '''
-        3Al2O3(liq) + 2SiO2(liq) = Al6Si2O13(liq)
-        log10K(Al6Si2O13) = - 104.06 + 467589/T
-        -3log10K(Al2O3) = 71.04 - 324402/T
-        -2log10K(SiO2) = 30.08 - 133812/T
-        '''
-        self.name_pseudo['AL1'] = 'Al6Si2O13'
-        self.K_pseudo['AL1'] = 10**(- 2.94 + 9375/sim.T)
-
-        '''
-        CaO(liq) + Al2O3(liq) = CaAl2O4(liq)
-        log10K(CaAl2O4) = - 33.93 + 154384/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(Al2O3) = 23.68 - 108134/T
-        '''
-        self.name_pseudo['CA1'] = 'CaAl2O4'
-        self.K_pseudo['CA1'] = 10**(- 1.89 + 10060/sim.T)
-
-        '''
-        CaO(liq) + 2Al2O3(liq) = CaAl4O7(liq)
-        log10K(CaAl4O7) = - 56.31 + 262171/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -2log10K(Al2O3) = 47.36 - 216268/T
-        '''
-        self.name_pseudo['CA2'] = 'CaAl4O7'
-        self.K_pseudo['CA2'] = 10**(- 0.59 + 9713/sim.T)
-
-        '''
-        12CaO(liq) + 7Al2O3(liq) = Ca12Al14O33(liq)
-        log10K(Ca12Al14O33) = - 272.38 + 1263457/T
-        -12log10K(CaO) = 100.32 - 434280/T
-        -7log10K(Al2O3) = 165.76 - 756938/T
-        '''
-        self.name_pseudo['CA3'] = 'Ca12Al14O33'
-        self.K_pseudo['CA3'] = 10**(-6.30 + 72239/sim.T)
-
-        '''
-        CaO(liq) + SiO2(liq) = CaSiO3(liq)
-        log10K(CaSiO3) = - 22.86 + 108664/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['CA4'] = 'CaSiO3'
-        self.K_pseudo['CA4'] = 10**(0.54 + 5568/sim.T)
-
-        '''
-        CaO(liq) + Al2O3(liq) + 2SiO2(liq) = CaAl2Si2O8(liq)
-        log10K(CaAl2Si2O8) = - 59.49 + 283462/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(Al2O3) = 23.68 - 108134/T
-        -2log10(SiO2) = 30.08 - 133812/T
-        '''
-        self.name_pseudo['CA5'] = 'CaAl2Si2O8'
-        self.K_pseudo['CA5'] = 10**(2.63 + 5326/sim.T)
-
-        '''
-        CaO(liq) + MgO(liq) + 2SiO2(liq) = CaMgSi2O6(liq)
-        log10K(CaMgSi2O6) = -46.03 + 212108/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -2log10K(SiO2) = 30.08 - 133812/T
-        '''
-        self.name_pseudo['CA6'] = 'CaMgSi2O6'
-        self.K_pseudo['CA6'] = 10**(1.46 + 8485/sim.T)
-
-        '''
-        2CaO(liq) + MgO(liq) + 2SiO2(liq) = Ca2MgSi2O7(liq)
-        log10K(Ca2MgSi2O7) = - 55.22 + 255140/T
-        -2log10K(CaO) = 16.72 - 72380/T
-        -log10K(MgO) = 9.05 - 33621/T
-        -2log10K(SiO2) = 30.08 - 133812/T
-        '''
-        self.name_pseudo['CA7'] = 'Ca2MgSi2O7'
-        self.K_pseudo['CA7'] = 10**(0.63 + 15327/sim.T)
-
-        '''
-        2CaO(liq) + Al2O3(liq) + SiO2(liq) = Ca2Al2SiO7(liq)
-        log10K(Ca2Al2SiO7) = - 53.43 + 258130/T
-        -2log10K(CaO) = 16.72 - 72380/T
-        -log10K(Al2O3) = 23.68 - 108134/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['CA8'] = 'Ca2Al2SiO7'
-        self.K_pseudo['CA8'] = 10**(2.01 + 10710/sim.T)
-
-        '''
-        CaO(liq) + TiO2(liq) = CaTiO3(liq)
-        log10K(CaTiO3) = - 21.80 + 109558/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(TiO2) = 13.36 - 66313/T
-        '''
-        self.name_pseudo['CA9'] = 'CaTiO3'
-        self.K_pseudo['CA9'] = 10**(- 0.08 + 7055/sim.T)
-
-        '''
-        2CaO(liq) + SiO2(liq) = Ca2SiO4(liq)
-        log10K(Ca2SiO4) = - 31.13 + 147702/T
-        -2log10K(CaO) = 16.72 - 72380/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['CA10'] = 'Ca2SiO4'
-        self.K_pseudo['CA10'] = 10**(0.63 + 8416/sim.T)
-
-        '''
-        CaO(liq) + TiO2(liq) + SiO2(liq) = CaTiSiO5(liq)
-        log10K(CaTiSiO5) = - 36.94 + 179480/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -log10K(TiO2) = 13.36 - 66313/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['CA11'] = 'CaTiSiO5'
-        self.K_pseudo['CA11'] = 10**(- 0.18 + 10071/sim.T)
-
-        '''
-        CaO(liq) + 6Al2O3(liq) = CaAl12O19(liq)
-        log10K(CaAl12O19) = -154.23 + 707606/T
-        -log10K(CaO) = 8.36 - 36190/T
-        -6log10K(Al2O3) = 142.08 - 648804/T
-        '''
-        self.name_pseudo['CA12'] = 'CaAl12O19'
-        self.K_pseudo['CA12'] = 10**(- 3.79 + 22612/sim.T)
-
-        '''
-        FeO(liq) + TiO2(liq) = FeTiO3(liq)
-        log10K(FeTiO3) = - 22.14 + 100392/T
-        -log10K(FeO) = 8.27 - 30510/T
-        -log10K(TiO2) = 13.36 - 66313/T
-        '''
-        self.name_pseudo['FE1'] = 'FeTiO3'
-        self.K_pseudo['FE1'] = 10**(- 0.51 + 3569/sim.T)
-        # print('YOO',self.K_pseudo['FE1'])
-
-        '''
-        2FeO(liq) + SiO2(liq) = Fe2SiO4(liq)
-        log10K(Fe2SiO4) = - 32.21 + 131029/T
-        -2log10K(FeO) = 16.54 - 61020/T
-        -log10K(SiO2) = 15.04 - 66906/T
-        '''
-        self.name_pseudo['FE2'] = 'Fe2SiO4'
-        self.K_pseudo['FE2'] = 10**(- 0.63 + 3103/sim.T)
-
-        '''
-        FeO(liq) + Al2O3(liq) = FeAl2O4(liq)
-        log10K(FeAl2O4) = - 33.71 + 144336/T
-        -log10K(FeO) = 8.27 - 30510/T
-        -log10K(Al2O3) = 23.68 - 108134/T
-        '''
-        self.name_pseudo['FE3'] = 'FeAl2O4'
-        self.K_pseudo['FE3'] = 10**(- 1.76 + 5692/sim.T)
-
-        '''
-        FeO (liq) + Fe2O3 (liq) = Fe3O4 (liq)
-        Fe3O4 data from Barin 1995
-        '''
-        self.name_pseudo['FE4'] = 'Fe3O4'
-        self.K_pseudo['FE4'] = 10**(-4.385894544e-1 + 4.3038155175436e3/sim.T\
-                                   -3.1050205223386055e6/sim.T**2.0)
-
-        '''
-        Na2O(liq) + SiO2(liq) = Na2SiO3(liq)
-        '''
-        self.name_pseudo['NA1'] = 'Na2SiO3'
-        self.K_pseudo['NA1'] = 10**(- 1.33 + 13870/sim.T)
-
-        '''
-        Na2O(liq) + 2SiO2(liq) = Na2Si2O5(liq)
-        '''
-        self.name_pseudo['NA2'] = 'Na2Si2O5'
-        self.K_pseudo['NA2'] = 10**(- 1.39 + 15350/sim.T)
-
-        ''' 
-        0.5 Na2O(liq) + 0.5 Al2O3(liq) + SiO2(liq) = NaAlSiO4(liq)
-        '''
-        self.name_pseudo['NA3'] = 'NaAlSiO4'
-        self.K_pseudo['NA3'] = 10**(0.65 + 6997/sim.T)
-
-        '''
-        0.5 Na2O(liq) + 0.5 Al2O3(liq) + 3SiO2(liq) = NaAlSi3O8(liq)
-        '''
-        self.name_pseudo['NA4'] = 'NaAlSi3O8'
-        self.K_pseudo['NA4'] = 10**(1.29 + 8788/sim.T)
-
-        '''
-        0.5 Na2O(liq) + 0.5 Al2O3(liq) = NaAlO2(liq)
-        '''
-        self.name_pseudo['NA5'] = 'NaAlO2'
-        self.K_pseudo['NA5'] = 10**(0.55 + 3058/sim.T)
-
-        '''
-        Na2O(liq) + TiO2(liq) = Na2TiO3(liq)
-        '''
-        self.name_pseudo['NA6'] = 'Na2TiO3'
-        self.K_pseudo['NA6'] = 10**(- 1.38 + 15445/sim.T)
-
-        '''
-        0.5 Na2O(liq) + 0.5 Al2O3(liq) + 2SiO2(liq) = NAAlSi2O6(liq)
-        '''
-        self.name_pseudo['NA7'] = 'NaAlSi2O6'
-        self.K_pseudo['NA7'] = 10**(- 1.02 + 9607/sim.T)
-
-        '''
-        K2O(liq) + SiO2(liq) = K2SiO3(liq)
-        '''
-        self.name_pseudo['K1'] = 'K2SiO3'
-        self.K_pseudo['K1'] = 10**(0.2692 + 12735/sim.T)
+from library import kernels
+from library import reactions
+from library import solvers
 
-        '''
-        K2O(liq) + 2SiO2(liq) = K2Si2O5(liq)
-        '''
-        self.name_pseudo['K2'] = 'K2Si2O5'
-        self.K_pseudo['K2'] = 10**(0.3462 + 14685/sim.T)
+@functools.lru_cache()
+def _imcc_matrices(oxideNames,pseudoNames):
+    ''' 
+    The (read only) matrices of the IMCC equations for the given ordering of
+    the oxides and pseudospecies (see melt_activity.__init__)
+    '''
+    iFeO = oxideNames.index('FeO')
+    iFe2O3 = oxideNames.index('Fe2O3')
 
-        '''
-        0.5 K2O(liq) + 0.5 Al2O3(liq) + SiO2(liq) = KAlSiO4(liq)
-        '''
-        self.name_pseudo['K3'] = 'KAlSiO4'
-        self.K_pseudo['K3'] = 10**(0.97 + 8675/sim.T)
+    def matrix(table):
+        matrix = np.zeros((len(pseudoNames),len(oxideNames)))
+        for j, spec in enumerate(pseudoNames):
+            for ox, nu in table[spec].items():
+                matrix[j,oxideNames.index(ox)] = nu
+        return matrix
 
-        '''
-        0.5 K2O(liq) + 0.5 Al2O3(liq) + 3SiO2(liq) = KAlSi3O8(liq)
-        '''
-        self.name_pseudo['K4'] = 'KAlSi3O8'
-        self.K_pseudo['K4'] = 10**(1.11 + 11229/sim.T)
+    stoich = matrix(reactions.stoichPseudo)
+    contains = stoich != 0
+    massBal = matrix(reactions.massBalPseudo)
 
-        '''
-        0.5 K2O(liq) + 0.5 Al2O3(liq) = KAlO2(liq)
-        '''
-        self.name_pseudo['K5'] = 'KAlO2'
-        self.K_pseudo['K5'] = 10**(0.72 + 4679/sim.T)
+    oxBal = np.eye(len(oxideNames))
+    oxBal[iFeO,iFe2O3] = 2
 
-        '''
-        0.5 K2O(liq) + 0.5 Al2O3(liq) + 2SiO2(liq) = KAlSi2O6(liq)
-        '''
-        self.name_pseudo['K6'] = 'KAlSi2O6'
-        self.K_pseudo['K6'] = 10**(1.53 + 10125/sim.T)
+    for matrix in stoich, contains, massBal, oxBal:
+        matrix.flags.writeable = False
+    return stoich, contains, massBal, oxBal
 
-        '''
-        K2O(liq) + 4SiO2 (liq) = K2Si4O9 (liq)
-        '''
-        self.name_pseudo['K7'] = 'K2Si4O9'
-        self.K_pseudo['K7'] = 10**(-0.9648 + 17572/sim.T)
+@functools.lru_cache(maxsize=16) # the last active sets
+def _active_matrices(oxideNames,pseudoNames,gone,pruned=()):
+    '''
+    The indices of the pseudospecies made only of oxides still in the melt
+    (gone marks the others), less those pruned, and their rows of the IMCC 
+    matrices (read only)
+    '''
+    stoich, contains, massBal, _ = _imcc_matrices(oxideNames,pseudoNames)
+    keep = ~contains[:,list(gone)].any(axis=1)
+    keep[list(pruned)] = False
+    active = np.flatnonzero(keep)
+    rows = stoich[active], contains[active], massBal[active]
+    for matrix in rows:
+        matrix.flags.writeable = False
+    return (active,) + rows
 
+class melt_activity():
+    '''
+    Calculates the activity of the oxides in the melt for a given composition
+    and temperature using IMCC.
+    '''
+    def __init__(self,sim,backend='numpy',anderson=None,prune=None,\
+                 pruneEvery=50):
+        
         '''
-        0.5K2O(liq) + CaO(liq) + 0.5Al2O3(liq) + 2SiO2(liq)=KCaAlSi2O7(liq)
-        '''
-        self.name_pseudo['K8'] = 'KCaAlSi2O7'
-        self.K_pseudo['K8'] = 10**(4.2983 + 17037/sim.T)
+        backend: 'numpy' or 'numba' (fixed point iteration compiled, see 
+        kernels.py)
+        anderson: options of solvers.anderson for the 'anderson' solver
+        prune, pruneEvery: fast chemistry, the pseudospecies whose share in
+        the mass balance of their oxides is below prune are left out, 
+        checked every pruneEvery calculations (see prune_pseudo; None: all
+        the pseudospecies are evaluated)
 
-    def activities_melt_pseudo(self,actOx):
+        The equilibrium constants for each of the relevant oxide pseudospecies
+        are evaluated for the given temperature from data/melt_reactions.csv
+        (see reactions.py), where the log10K values from which the A and B 
+        values are derived are given in the comments. See Fegley et al. 
+        (1987) and Shaefer and Fegley (2004) for the source of these values. 
+        '''
+
+        # Names of oxide pseudospecies (their formulas)
+        self.name_pseudo = dict(reactions.pseudoFormulas)
+        # Equilibrium constant for oxide pseudospecies
+        self.K_pseudo = reactions.KPseudo(sim.T)
+
+        '''
+        Matrix form of the IMCC equations
+        - _stoich[j,i] is the number of moles of oxide i (ordered as 
+          sim._oxideNames) in one mole of pseudospecies j, so that
+          log(A_pseudo) = _stoich . log(A_oxides) + log(K_pseudo)
+        - _massBal[j,i] is the weight of pseudospecies j in the mass balance 
+          (gamma) of oxide i and _oxBal[i,k] the weight of pure oxide k in it
+        '''
+        self._oxideNames = sim._oxideNames
+        self._pseudoNames = tuple(self.name_pseudo)
+        self._iFeO = self._oxideNames.index('FeO')
+        self._iFe2O3 = self._oxideNames.index('Fe2O3')
+
+        self._stoich, self._contains, self._massBal, self._oxBal = \
+            _imcc_matrices(self._oxideNames,self._pseudoNames)
+
+        # sim.T may be an array of temperatures (see batch.py), log(K_pseudo) 
+        # then has the temperatures along the first axis
+        self._logK = np.log(10) * reactions.KPseudo.log10(sim.T)
+        self._act_pseudo = np.zeros(np.shape(self._logK))
+
+        # Active set (see select_active): all the pseudospecies
+        self._logKAll = self._logK
+        self._active = np.arange(len(self._pseudoNames))
+        self._gone = (False,) * len(self._oxideNames)
+        self._goneMask = np.zeros(len(self._oxideNames),dtype=bool)
+        self._pruned = ()
+
+        # Fast chemistry (see prune_pseudo)
+        self.prune = prune
+        self.pruneEvery = pruneEvery
+        self.pruneError = 0. # Largest error of the pruning found
+        self._calls = 0
+        self.backend = kernels.resolve(backend)
+        self.stats = None # Optional stats.solver_stats collector
+        self._tried = 0 # Iterations of the last failed solver
+        # Starts with the damping of the first fixed_point_gamma iterations
+        self.anderson = solvers.anderson(**{'damping' : 0.5,**(anderson or {})})
+
+    @property
+    def act_pseudo(self):
+        ''' Activities of the pseudospecies by name (read only) '''
+        return dict(zip(self._pseudoNames,self.pseudo_activities().tolist()))
+
+    def pseudo_activities(self,act_ox=None):
+        '''
+        Activities of all the pseudospecies (0 for the inactive ones). Given
+        the oxide activities of the solution (sim._act_ox), those of the
+        pruned pseudospecies (see prune_pseudo) are evaluated from them, so 
+        that only the pseudospecies of oxides that have left the melt are 0.
+        '''
+        if len(self._active) == len(self._pseudoNames):
+            return self._act_pseudo.copy()
+        act_pseudo = np.zeros(len(self._pseudoNames))
+        act_pseudo[self._active] = self._act_pseudo
+        if act_ox is not None and self._pruned:
+            pruned = list(self._pruned)
+            stoich, contains, _, _ = _imcc_matrices(self._oxideNames,\
+                                                    self._pseudoNames)
+            absent = act_ox == 0
+            logAct = np.log(np.where(absent,1.,act_ox))
+            act = np.exp(stoich[pruned] @ logAct + self._logKAll[pruned])
+            act[contains[pruned] @ absent] = 0
+            act_pseudo[pruned] = act
+        return act_pseudo
+
+    def set_pseudo_activities(self,act_pseudo):
+        ''' Sets the activities of all the pseudospecies (of the active ones) '''
+        self._act_pseudo = act_pseudo[self._active]
+
+    def select_active(self,gone,pruned=None):
+        '''
+        Active set of the IMCC equations: gone marks the oxides (ordered as
+        sim._oxideNames) whose element has left the melt. The pseudospecies
+        containing them have zero activity and are left out of
+        activities_melt_pseudo, recompute_gamma and the solvers: the 
+        matrices, log(K_pseudo) and _act_pseudo are restricted to the active
+        pseudospecies (_active), which gives the same activities as the full
+        set for less work as the melt simplifies.
+
+        pruned: indices of pseudospecies left out as well (fast chemistry,
+        those of the last prune_pseudo by default). Their activities count
+        as 0.
+        '''
+        # Called before every calculation: nothing is built unless the 
+        # active set changes
+        if pruned is None and (gone == self._goneMask).all():
+            return
+        gone = tuple(bool(ox) for ox in gone)
+        pruned = self._pruned if pruned is None else tuple(pruned)
+        if gone == self._gone and pruned == self._pruned:
+            return
+        self._goneMask = np.array(gone)
+        act_pseudo = self.pseudo_activities()
+        self._gone = gone
+        self._pruned = pruned
+        self._active, self._stoich, self._contains, self._massBal = \
+            _active_matrices(self._oxideNames,self._pseudoNames,gone,pruned)
+        self._logK = self._logKAll[...,self._active]
+        self._act_pseudo = act_pseudo[self._active]
+
+    def prune_pseudo(self,fAb,gamma,addF2O3):
+        '''
+        Fast chemistry (if self.prune is set): every pruneEvery calls, 
+        starting with the first, evaluates all the pseudospecies at the 
+        solution act = fAb * gamma of the active ones. 
+
+        The error of the pruning is the largest |log10(gamma_new/gamma)| 
+        between one full iteration and one iteration of the active ones 
+        (recompute_gamma from the same activities, 0 without pruning), the 
+        largest one found is kept in pruneError. The share of each 
+        pseudospecies is its largest share in the mass balance of its 
+        oxides,
+
+            share_j = max_i _massBal_ji A_pseudo_j / SUM_i
+
+        (SUM_i as in recompute_gamma) and those below self.prune are left
+        out until the next check. Pseudospecies of oxides of zero activity
+        (Fe2O3 without addF2O3) are not judged.
+        Returns the error, or None if there was no check.
+        '''
+        if self.prune is None:
+            return None
+        self._calls += 1
+        if (self._calls - 1) % self.pruneEvery:
+            return None
+        if self.stats is not None:
+            start = self.stats.clock()
+
+        act = fAb * gamma
+        self.activities_melt_pseudo(act)
+        gamma_active = self.recompute_gamma(act,addF2O3)
+        self.select_active(self._gone,())
+        pseudo = self.activities_melt_pseudo(act)
+        error = float(self.gamma_change(self.recompute_gamma(act,addF2O3),\
+                                        gamma_active).max())
+        self.pruneError = max(self.pruneError,error)
+
+        denom = act @ self._oxBal.T + pseudo @ self._massBal
+        with np.errstate(divide='ignore',invalid='ignore'):
+            share = np.nan_to_num(pseudo[:,None] * self._massBal / denom)\
+                    .max(axis=1)
+        judged = ~(self._contains @ (act == 0))
+        self.select_active(self._gone,\
+                           self._active[judged & (share < self.prune)])
+
+        if self.stats is not None:
+            self.stats.record('prune','full',len(self._pruned),error,\
+                              self.stats.clock() - start)
+        return error
+
+    def activities_melt_pseudo(self,act_ox,logK=None):
         '''
         Calculates the activities for the complex species in the melt 
-        (see activities_melt for relevant equations)
-        '''
-        self.act_pseudo['MG1'] = self.K_pseudo['MG1'] * actOx['MgO'] * actOx['SiO2']
+        (see activities_melt for relevant equations) from the array of oxide
+        activities (ordered as sim._oxideNames):
 
-        self.act_pseudo['MG2'] = self.K_pseudo['MG2'] * actOx['MgO']**2 * actOx['SiO2']
-        
-        self.act_pseudo['MG3'] = self.K_pseudo['MG3'] * actOx['MgO'] * actOx['Al2O3']
-        
-        self.act_pseudo['MG4'] = self.K_pseudo['MG4'] * actOx['MgO'] * actOx['TiO2']
-        
-        self.act_pseudo['MG5'] = self.K_pseudo['MG5'] * actOx['MgO'] * actOx['TiO2']**2
-        
-        self.act_pseudo['MG6'] = self.K_pseudo['MG6'] * actOx['MgO']**2 * actOx['TiO2']
-        
-        self.act_pseudo['MG7'] = self.K_pseudo['MG7'] * actOx['MgO']**2 * actOx['Al2O3']**2 * actOx['SiO2']**5
-        
-        self.act_pseudo['AL1'] = self.K_pseudo['AL1'] * actOx['Al2O3']**3 * actOx['SiO2']**2
-        
-        self.act_pseudo['CA1'] = self.K_pseudo['CA1'] * actOx['CaO'] * actOx['Al2O3']
-        
-        self.act_pseudo['CA2'] = self.K_pseudo['CA2'] * actOx['CaO'] * actOx['Al2O3']**2
-        
-        self.act_pseudo['CA3'] = self.K_pseudo['CA3'] * actOx['CaO']**12 * actOx['Al2O3']**7
-        
-        self.act_pseudo['CA4'] = self.K_pseudo['CA4'] * actOx['CaO'] * actOx['SiO2']
-        
-        self.act_pseudo['CA5'] = self.K_pseudo['CA5'] * actOx['CaO'] * actOx['Al2O3'] * actOx['SiO2']**2
-        
-        self.act_pseudo['CA6'] = self.K_pseudo['CA6'] * actOx['CaO'] * actOx['MgO'] * actOx['SiO2']**2
-        
-        self.act_pseudo['CA7'] = self.K_pseudo['CA7'] * actOx['CaO']**2 * actOx['MgO'] * actOx['SiO2']**2
-        
-        self.act_pseudo['CA8'] = self.K_pseudo['CA8'] * actOx['CaO']**2 * actOx['Al2O3'] * actOx['SiO2']
-        
-        self.act_pseudo['CA9'] = self.K_pseudo['CA9'] * actOx['CaO'] * actOx['TiO2']
-        
-        self.act_pseudo['CA10'] = self.K_pseudo['CA10'] * actOx['CaO']**2 * actOx['SiO2']
-        
-        self.act_pseudo['CA11'] = self.K_pseudo['CA11'] * actOx['CaO'] * actOx['TiO2'] * actOx['SiO2']
-        
-        self.act_pseudo['CA12'] = self.K_pseudo['CA12'] * actOx['CaO'] * actOx['Al2O3']**6
+            A_pseudo = exp(_stoich . log(A_oxides) + log(K_pseudo))
 
-        self.act_pseudo['FE1'] = self.K_pseudo['FE1'] * actOx['FeO'] * actOx['TiO2']
-          
-        self.act_pseudo['FE2'] = self.K_pseudo['FE2'] * actOx['FeO']**2 * actOx['SiO2']
-        
-        self.act_pseudo['FE3'] = self.K_pseudo['FE3'] * actOx['FeO'] * actOx['Al2O3']
-        
-        self.act_pseudo['FE4'] = self.K_pseudo['FE4'] * actOx['FeO'] * actOx['Fe2O3']
-                
-        self.act_pseudo['NA1'] = self.K_pseudo['NA1'] * actOx['Na2O'] * actOx['SiO2']
-        
-        self.act_pseudo['NA2'] = self.K_pseudo['NA2'] * actOx['Na2O'] * actOx['SiO2']**2
-        
-        self.act_pseudo['NA3'] = self.K_pseudo['NA3'] * np.sqrt(actOx['Na2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']
-        
-        self.act_pseudo['NA4'] = self.K_pseudo['NA4'] * np.sqrt(actOx['Na2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']**3
-        
-        self.act_pseudo['NA5'] = self.K_pseudo['NA5'] * np.sqrt(actOx['Na2O']) * np.sqrt(actOx['Al2O3'])
-        
-        self.act_pseudo['NA6'] = self.K_pseudo['NA6'] * actOx['Na2O'] * actOx['TiO2']
-        
-        self.act_pseudo['NA7'] = self.K_pseudo['NA7'] * np.sqrt(actOx['Na2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']**2
-        
-        self.act_pseudo['K1'] = self.K_pseudo['K1'] * actOx['K2O'] * actOx['SiO2']
-        
-        self.act_pseudo['K2'] = self.K_pseudo['K2'] * actOx['K2O'] * actOx['SiO2']**2
-        
-        self.act_pseudo['K3'] = self.K_pseudo['K3'] * np.sqrt(actOx['K2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']
-        
-        self.act_pseudo['K4'] = self.K_pseudo['K4'] * np.sqrt(actOx['K2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']**3
-        
-        self.act_pseudo['K5'] = self.K_pseudo['K5'] * np.sqrt(actOx['K2O']) * np.sqrt(actOx['Al2O3'])
-        
-        self.act_pseudo['K6'] = self.K_pseudo['K6'] * np.sqrt(actOx['K2O']) * np.sqrt(actOx['Al2O3']) * actOx['SiO2']**2
-        
-        self.act_pseudo['K7'] = self.K_pseudo['K7'] * actOx['K2O'] * (actOx['SiO2']**4)
-        
-        self.act_pseudo['K8'] = self.K_pseudo['K8'] * np.sqrt(actOx['K2O']) * np.sqrt(actOx['Al2O3']) * actOx['CaO'] * actOx['SiO2']**2
+        A pseudospecies containing an oxide of zero activity has zero activity.
+        act_ox may hold several systems along its first axis, with logK the 
+        matching rows of self._logK.
+        '''
+        if logK is None:
+            logK = self._logK
+        absent = act_ox == 0
+        logAct = np.log(np.where(absent,1.,act_ox))
+        self._act_pseudo = np.exp(logAct @ self._stoich.T + logK)
+        if absent.any():
+            self._act_pseudo[absent @ self._contains.T] = 0
 
+        return self._act_pseudo
 
     def recompute_gamma(self,act_ox,addF2O3):
         ''' 
@@ -422,200 +258,331 @@ class melt_activity():
         gamma['Element'] = 
 
         Activity(pure oxide) / SUM activities of all complex melt species containing the oxide
+
+        All nine sums are evaluated at once as _massBal^T . A_pseudo.
         
         Variables:
-            - actOx: is required to calculate gamma for all elements
-            - gamma: original value being passed on 
-            - comp: necessary for calculating gamma['Fe2O3']
-            - fAbMolecule: necessary for calculating gamma['Fe2O3']
+            - act_ox: array of oxide activities (ordered as sim._oxideNames)
+            - addF2O3: whether Fe2O3 takes part in the equilibrium
         '''
-        gamma_new = {} 
-
-        #### gamma SiO2 ####
-        if act_ox['SiO2'] != 0:
-            gamma_new['SiO2'] = act_ox['SiO2'] / (act_ox['SiO2'] + \
-                                self.act_pseudo['MG1'] + self.act_pseudo['MG2'] + \
-                                self.act_pseudo['CA4'] + self.act_pseudo['CA8'] + \
-                                self.act_pseudo['CA10']+ self.act_pseudo['CA11']+ \
-                                self.act_pseudo['FE2'] + self.act_pseudo['NA1'] + \
-                                self.act_pseudo['NA3'] + self.act_pseudo['K1']  + \
-                                self.act_pseudo['K3']  + \
-                                2 * (self.act_pseudo['AL1'] + self.act_pseudo['CA5'] + \
-                                     self.act_pseudo['CA6'] + self.act_pseudo['CA7'] + \
-                                     self.act_pseudo['NA2'] + self.act_pseudo['K2']  + \
-                                     self.act_pseudo['K6']  + self.act_pseudo['K7']  + \
-                                     self.act_pseudo['K8']) + \
-                                3 * (self.act_pseudo['NA4'] + self.act_pseudo['K4']) + \
-                                4 * (self.act_pseudo['K7']) + \
-                                5 * (self.act_pseudo['MG7'])
-                                )
-        else:
-            gamma_new['SiO2'] = 0
-
-        #### gamma MgO ####
-        if act_ox['MgO'] != 0:
-            gamma_new['MgO'] = act_ox['MgO'] / (act_ox['MgO'] + \
-                               self.act_pseudo['MG1'] + self.act_pseudo['MG3'] + \
-                               self.act_pseudo['MG4'] + self.act_pseudo['MG5'] + \
-                               self.act_pseudo['CA6'] + self.act_pseudo['CA7'] + \
-                               2 * (self.act_pseudo['MG2'] + self.act_pseudo['MG6'] + \
-                                    self.act_pseudo['MG7'])
-                                 )
-        else:
-            gamma_new['MgO'] = 0
-        
-        #### gamma FeO #### 
-        if act_ox['FeO'] != 0:
-            gamma_new['FeO'] = act_ox['FeO'] / (act_ox['FeO'] + \
-                                         self.act_pseudo['FE1'] + self.act_pseudo['FE3'] +\
-                                         2 * (self.act_pseudo['FE2'] + act_ox['Fe2O3']) + \
-                                         3 * (self.act_pseudo['FE4'])
-                                         )
-        else:
-            gamma_new['FeO'] = 0
+        denom = act_ox @ self._oxBal.T + self._act_pseudo @ self._massBal
+        gamma_new = np.divide(act_ox,denom,out=np.zeros_like(act_ox),\
+                              where=act_ox != 0)
 
         #### gamma Fe3 ####
         # gamma['Fe3'] is an adjustment factor, not a true activity coefficient because
         # the mole fraction of Fe2O3 in the melt is not known.
         if not addF2O3:
-            gamma_new['Fe2O3'] = 1
-        
-        elif addF2O3 and act_ox['Fe2O3'] != 0 and act_ox['FeO'] != 0:
-            gamma_new['Fe2O3'] = act_ox['Fe2O3'] / (act_ox['Fe2O3'] + self.act_pseudo['FE4'])
-        
+            gamma_new[...,self._iFe2O3] = 1
         else:
-            gamma_new['Fe2O3'] = 0
-        
-        #### gamma Ca ####
-        if act_ox['CaO'] != 0:
-            gamma_new['CaO'] = act_ox['CaO'] / (act_ox['CaO'] + \
-                                         self.act_pseudo['CA1'] + self.act_pseudo['CA2'] + \
-                                         self.act_pseudo['CA4'] + self.act_pseudo['CA5'] + \
-                                         self.act_pseudo['CA6'] + self.act_pseudo['CA9'] + \
-                                         self.act_pseudo['CA11']+ self.act_pseudo['CA12']+ \
-                                         self.act_pseudo['K8']  + \
-                                         2 * (self.act_pseudo['CA7'] + self.act_pseudo['CA8'] + \
-                                              self.act_pseudo['CA10']) + \
-                                         12 * (self.act_pseudo['CA3'])
-                                         )
-        else:
-            gamma_new['CaO'] = 0
-        
-        #### gamma Al ####
-        if act_ox['Al2O3'] != 0:
-            gamma_new['Al2O3'] = act_ox['Al2O3'] / (act_ox['Al2O3'] + \
-                                            self.act_pseudo['MG3'] + self.act_pseudo['CA1'] + \
-                                            self.act_pseudo['CA5'] + self.act_pseudo['CA8'] + \
-                                            self.act_pseudo['FE3'] + \
-                                            2 * (self.act_pseudo['CA2'] + self.act_pseudo['MG7']) + \
-                                            3 * (self.act_pseudo['AL1'])  + \
-                                            6 * (self.act_pseudo['CA12']) + \
-                                            7 * (self.act_pseudo['CA3'])  + \
-                                            0.5 * (self.act_pseudo['NA3'] + self.act_pseudo['NA4'] + \
-                                                   self.act_pseudo['NA5'] + self.act_pseudo['NA7'] + \
-                                                   self.act_pseudo['K3']  + self.act_pseudo['K4']  + \
-                                                   self.act_pseudo['K5']  + self.act_pseudo['K6']  + \
-                                                   self.act_pseudo['K8'])
-                                            )
-        else: 
-            gamma_new['Al2O3'] = 0
-        
-        #### gamma Ti ####
-        if act_ox['TiO2'] != 0:
-            gamma_new['TiO2'] = act_ox['TiO2'] / (act_ox['TiO2'] + \
-                                           self.act_pseudo['MG4'] + self.act_pseudo['MG6'] + \
-                                           self.act_pseudo['CA9'] + self.act_pseudo['CA11']+ \
-                                           self.act_pseudo['FE1'] + self.act_pseudo['NA6'] + \
-                                           2 * (self.act_pseudo['MG5'])
-                                           )
-        else:
-            gamma_new['TiO2'] = 0
-        
-        #### gamma Na2 ####
-        if act_ox['Na2O'] != 0:
-            gamma_new['Na2O'] = act_ox['Na2O'] / (act_ox['Na2O'] + \
-                                          self.act_pseudo['NA1'] + self.act_pseudo['NA2'] + \
-                                          self.act_pseudo['NA6'] + \
-                                          0.5 * (self.act_pseudo['NA3'] + self.act_pseudo['NA4'] + \
-                                                 self.act_pseudo['NA5'] + self.act_pseudo['NA7'])
-                                          )
-        else:
-            gamma_new['Na2O'] = 0
-        
-        #### gamma ###
-        if act_ox['K2O'] != 0:
-            gamma_new['K2O'] = act_ox['K2O'] / (act_ox['K2O'] + \
-                                        self.act_pseudo['K1'] + self.act_pseudo['K2'] + \
-                                        self.act_pseudo['K7'] + \
-                                        0.5 * (self.act_pseudo['K8'] + self.act_pseudo['K3'] + \
-                                               self.act_pseudo['K4'] + self.act_pseudo['K5'] + \
-                                               self.act_pseudo['K6'])
-                                        )
-        else:
-            gamma_new['K2O'] = 0
+            gamma_new[...,self._iFe2O3] = np.where(act_ox[...,self._iFeO] != 0,\
+                                              gamma_new[...,self._iFe2O3],0)
 
         return gamma_new
 
-    def melt_activity_calculation(self,sim,addF2O3=False):
+    def gamma_change(self,gamma_new,gamma):
+        '''
+        |log10(gamma_new/gamma)| of the activity coefficients with a ratio
+        (0 for the others): the convergence measure of fixed_point_gamma
+        '''
+        # Compute ratio of newly computed activity and previous activity
+        fGam = np.ones_like(gamma)
+        ratio = gamma_new != 0
+        if gamma_new[self._iFeO] == 0:
+            ratio[self._iFe2O3] = False
+        fGam[ratio] = gamma_new[ratio]/gamma[ratio]
+        return np.abs(np.log10(fGam))
+
+    def residual(self,fAb,gamma,addF2O3):
+        ''' Largest gamma_change of one more fixed point iteration from gamma '''
+        act_pseudo = self._act_pseudo
+        act = fAb * gamma
+        self.activities_melt_pseudo(act)
+        residual = self.gamma_change(self.recompute_gamma(act,addF2O3),gamma)
+        self._act_pseudo = act_pseudo
+        return residual.max()
+
+    def fixed_point_gamma(self,fAb,gamma,addF2O3):
+        '''
+        Damped geometric averaging of gamma and gamma_new until all the 
+        activity coefficients change by less than 1e-5 in log10.
+        Returns the activities, activity coefficients and number of iterations.
+        '''
+        if self.backend == 'numba':
+            act, gamma, self._act_pseudo, iit = kernels.melt_fixed_point(fAb,\
+                gamma,self._logK,self._stoich,self._contains,self._massBal,\
+                self._oxBal,self._iFeO,self._iFe2O3,addF2O3,int(1e8))
+            if iit >= 1e8:
+                raise RuntimeError('Max recursion limit reached while calculating activities.')
+            return act, gamma, iit
 
         iit = 0
         while iit < 1e8: 
 
-            for metal in sim._metalNames:
-                if metal != 'Fe3':
-                    sim.act_ox[sim._metal2oxide[metal]] = sim.fAbOx[metal]\
-                                        * sim.gamma[sim._metal2oxide[metal]]
-                else:
-                # Activity of Fe2O3 is estimated using gas chemistry, 
-                # then all acitivities are recomputed
-                    if addF2O3:
-                        sim.act_ox['Fe2O3'] = sim.presLiq['Fe2O3']\
-                                              * sim.gamma['Fe2O3']
-                    else:
-                        sim.act_ox['Fe2O3'] = 0
+            act = fAb * gamma
             
             # Compute activities of pseudo species 
-            self.activities_melt_pseudo(sim.act_ox)
+            self.activities_melt_pseudo(act)
 
             # Recompute gamma with the updated activity values for the oxides
-            gamma_new = self.recompute_gamma(sim.act_ox,addF2O3)
-
-            # Compute ratio of newly computed activity and previous activity
-            fGam = {}
-            for oxide in sim.gamma: 
-                if gamma_new[oxide] == 0 or \
-                   (oxide == 'Fe2O3' and gamma_new['FeO'] == 0):
-                    fGam[oxide] = 1
-                else:
-                    fGam[oxide] = gamma_new[oxide]/sim.gamma[oxide]
-
-            # Could also be written in list comprenhension format, check numba:
-            # self.fGam = {oxide : 1 if gamma_new[oxide] == 0 or\
-            #            (oxide == 'Fe2O3' and gamma_new['FeO'] == 0) else\
-            #            gamma_new[oxide]/sim.gamma[oxide]\
-            #            for oxide in self.gama}
-            
+            gamma_new = self.recompute_gamma(act,addF2O3)
+
             ''' 
-            If self.gamRat[elements] ~1, the code has arrived at a solution for all the 
+            If gamma_new/gamma ~1, the code has arrived at a solution for all the 
             activities, and moves on to the gas chemistry. 
             If this is not the case, then the activity coefficients are adjusted and 
             the activities are recomputed until a solution is foudn. 
             ''' 
 
-            if all(rat < 1e-5 for rat in np.abs(np.log10(list(fGam.values())))):
+            if np.all(self.gamma_change(gamma_new,gamma) < 1e-5):
                 break
 
-
-            for element in gamma_new:
-                if iit > 500:
-                    sim.gamma[element] = (gamma_new[element] * sim.gamma[element]**4)**(1/5)
-                elif iit > 30:
-                    sim.gamma[element] = (gamma_new[element] * sim.gamma[element]**2)**(1/3)
-                else:
-                    sim.gamma[element] = (gamma_new[element] * sim.gamma[element])**(1/2)
+            if iit > 500:
+                gamma = (gamma_new * gamma**4)**(1/5)
+            elif iit > 30:
+                gamma = (gamma_new * gamma**2)**(1/3)
+            else:
+                gamma = (gamma_new * gamma)**(1/2)
             
             iit += 1 # updating counter
             
             if iit >= 1e8: 
                 raise RuntimeError('Max recursion limit reached while calculating activities.')
 
+        return act, gamma, iit
+
+    def _failed(self,iterations):
+        ''' Keeps the iterations of a failed solver (see _tried) '''
+        self._tried = iterations
+        return None
+
+    def newton_gamma(self,fAb,gamma,addF2O3,maxIter=100,maxStep=10.):
+        '''
+        Damped Newton iteration on log(gamma) for the IMCC mass balance of 
+        the oxides present in the melt:
+
+            R_i = log(SUM_i / F_i) = 0
+
+        where SUM_i is the denominator of recompute_gamma and F_i the oxide
+        mole fraction (so that -R_i = log(gamma_new_i/gamma_i)). The Jacobian 
+        is analytic,
+
+            dR_i/dlog(gamma_k) = (_oxBal_ik A_k 
+                    + SUM_j _massBal_ji A_pseudo_j _stoich_jk) / SUM_i
+
+        and a capped step with backtracking line search on |R| keeps the 
+        iteration safe far from the solution (e.g. starting from gamma = 1). Convergence
+        uses the same 1e-5 (log10) tolerance as fixed_point_gamma. 
+        Returns the activities, activity coefficients and number of iterations,
+        or None if the iteration fails.
+        '''
+        # Oxides taking part in the equilibrium
+        on = fAb != 0
+        if fAb[self._iFeO] == 0:
+            on[self._iFe2O3] = False
+        logF = np.log(fAb[on])
+        tol = 1e-5 * np.log(10)
+
+        gamma = np.where(on,gamma,0)
+        if not addF2O3:
+            gamma[self._iFe2O3] = 1
+        x = np.log(np.where(gamma[on] > 0,gamma[on],1))
+
+        def residual(x):
+            gamma[on] = np.exp(x)
+            act = fAb * gamma
+            pseudo = self.activities_melt_pseudo(act)
+            denom = (act @ self._oxBal.T + pseudo @ self._massBal)[on]
+            return np.log(denom) - logF, act, pseudo, denom
+
+        with np.errstate(over='ignore',divide='ignore',invalid='ignore'):
+            R, act, pseudo, denom = residual(x)
+            norm = np.abs(R).max()
+            for iit in range(maxIter):
+                if not np.isfinite(norm):
+                    return self._failed(iit)
+                if norm < tol:
+                    return act, gamma, iit
+
+                jac = (self._oxBal[np.ix_(on,on)] * act[on] + \
+                       (self._massBal[:,on].T * pseudo) @ self._stoich[:,on])\
+                      / denom[:,None]
+                try:
+                    dx = np.linalg.solve(jac,-R)
+                except np.linalg.LinAlgError:
+                    return self._failed(iit)
+
+                # Limit the change of any gamma to a factor e**maxStep per
+                # iteration, then backtrack on |R|
+                step = min(1.,maxStep/np.abs(dx).max())
+                while True:
+                    R, act, pseudo, denom = residual(x + step * dx)
+                    normNew = np.abs(R).max()
+                    if normNew < (1 - 1e-4 * step) * norm or step < 1e-3:
+                        break
+                    step /= 2
+                x = x + step * dx
+                norm = normNew
+
+        return self._failed(maxIter)
+
+    def log_fixed_point_gamma(self,fAb,gamma,addF2O3):
+        '''
+        fixed_point_gamma in log space, for the oxides taking part in the 
+        equilibrium: 
+
+            log A_pseudo = _stoich . log(A_oxides) + log(K_pseudo)
+            log gamma_new = log(A) - log(sum of the terms of the denominator)
+
+        where the sums of recompute_gamma are taken with the largest term 
+        factored out, so that no activity underflows. The geometric damping
+        is an average of the logs, and the convergence test compares the
+        logs directly. It takes the iterations of fixed_point_gamma, and is
+        meant for melts whose activities underflow, not for speed.
+        Returns the activities, activity coefficients and number of iterations.
+        '''
+        # Oxides taking part in the equilibrium (as in newton_gamma) and the
+        # pseudospecies made of them
+        on = fAb != 0
+        if fAb[self._iFeO] == 0:
+            on[self._iFe2O3] = False
+        pseudoOn = ~self._contains[:,~on].any(axis=1)
+
+        gamma = np.where(on,gamma,0)
+        if not addF2O3:
+            gamma[self._iFe2O3] = 1
+        gamma[on & (gamma <= 0)] = 1
+
+        stoich = self._stoich[np.ix_(pseudoOn,on)]
+        logK = self._logK[pseudoOn]
+        logF = np.log(fAb[on])
+        # Log coefficients of the terms of each denominator (the oxides, then
+        # the pseudospecies), -inf for the terms left out
+        with np.errstate(divide='ignore'):
+            logCoef = np.log(np.hstack((self._oxBal[np.ix_(on,on)],\
+                                        self._massBal[np.ix_(pseudoOn,on)].T)))
+        tol = 1e-5 * np.log(10)
+
+        x = np.log(gamma[on])
+        iit = 0
+        while iit < 1e8:
+
+            logAct = logF + x
+            logPseudo = stoich @ logAct + logK
+            terms = logCoef + np.concatenate((logAct,logPseudo))
+            top = terms.max(axis=1)
+            x_new = logAct - top - \
+                    np.log(np.exp(terms - top[:,None]).sum(axis=1))
+
+            if np.all(np.abs(x_new - x) < tol):
+                break
+
+            if iit > 500:
+                x = (x_new + 4 * x) / 5
+            elif iit > 30:
+                x = (x_new + 2 * x) / 3
+            else:
+                x = (x_new + x) / 2
+
+            iit += 1 # updating counter
+
+            if iit >= 1e8:
+                raise RuntimeError('Max recursion limit reached while calculating activities.')
+
+        act = np.zeros_like(fAb)
+        act[on] = np.exp(logAct)
+        gamma[on] = np.exp(x)
+        self._act_pseudo = np.zeros_like(self._logK)
+        self._act_pseudo[pseudoOn] = np.exp(logPseudo)
+        return act, gamma, iit
+
+    def anderson_gamma(self,fAb,gamma,addF2O3,maxIter=10000):
+        '''
+        Anderson accelerated fixed point iteration (self.anderson, see 
+        solvers.anderson) of log(gamma) -> log(gamma_new) for the oxides 
+        taking part in the equilibrium, with the convergence test of
+        fixed_point_gamma. The damping adapts to oscillation and stagnation
+        instead of following the fixed schedule of fixed_point_gamma.
+        Returns the activities, activity coefficients and number of 
+        iterations, or None if the iteration fails.
+        '''
+        # Oxides taking part in the equilibrium (as in newton_gamma)
+        on = fAb != 0
+        if fAb[self._iFeO] == 0:
+            on[self._iFe2O3] = False
+
+        gamma = np.where(on,gamma,0)
+        if not addF2O3:
+            gamma[self._iFe2O3] = 1
+        gamma[on & (gamma <= 0)] = 1
+
+        self.anderson.start()
+        with np.errstate(over='ignore',divide='ignore',invalid='ignore'):
+            for iit in range(maxIter):
+
+                act = fAb * gamma
+                self.activities_melt_pseudo(act)
+                gamma_new = self.recompute_gamma(act,addF2O3)
+                if not np.all(np.isfinite(gamma_new[on]) & (gamma_new[on] > 0)):
+                    return self._failed(iit)
+                if np.all(self.gamma_change(gamma_new,gamma) < 1e-5):
+                    return act, gamma, iit
+
+                gamma[on] = np.exp(self.anderson.step(np.log(gamma[on]),\
+                                                      np.log(gamma_new[on])))
+
+        return self._failed(maxIter)
+
+    def melt_activity_calculation(self,sim,addF2O3=False,method='fixed_point'):
+        '''
+        Solves for the activity coefficients (sim.gamma) and activities 
+        (sim.act_ox) of the oxides in the melt.
+
+        method: 'fixed_point' (damped geometric averaging), 'newton' (damped
+        Newton with analytic Jacobian) or 'anderson' (Anderson accelerated 
+        fixed point), the latter two falling back to fixed_point if they 
+        fail, or 'log' (fixed_point in log space)
+
+        Returns the number of iterations (with those of a failed solver), 
+        which is also kept in self.iterations
+        '''
+        if method not in ('fixed_point','newton','anderson','log'):
+            raise ValueError(f'Unknown melt activity solver: {method}')
+        if self.stats is not None:
+            start = self.stats.clock()
+
+        # Oxide mole fractions, the activity of Fe2O3 is estimated using gas
+        # chemistry (presLiq starts with the oxides), then all activities are
+        # recomputed
+        fAb = sim._fAbOx[sim._oxEl]
+        self.select_active(fAb == 0)
+        fAb[self._iFe2O3] = sim._presLiq[self._iFe2O3] if addF2O3 else 0
+        gamma = sim._gamma.copy()
+
+        solution = None
+        fallback = None # Iterations of a failed solver
+        if method == 'newton':
+            solution = self.newton_gamma(fAb,gamma.copy(),addF2O3)
+        elif method == 'anderson':
+            solution = self.anderson_gamma(fAb,gamma,addF2O3)
+        elif method == 'log':
+            solution = self.log_fixed_point_gamma(fAb,gamma,addF2O3)
+        if solution is None:
+            if method != 'fixed_point':
+                fallback, method = self._tried, 'fixed_point'
+            solution = self.fixed_point_gamma(fAb,gamma,addF2O3)
+        act, gamma, iterations = solution
+        self.iterations = iterations + (fallback or 0)
+
+        sim._act_ox[:] = act
+        sim._gamma[:] = gamma
+
+        if self.stats is not None:
+            seconds = self.stats.clock() - start
+            self.stats.record('melt_F2O3' if addF2O3 else 'melt',method,\
+                              iterations,self.residual(fAb,gamma,addF2O3),\
+                              seconds,fallback)
+
+        self.prune_pseudo(fAb,gamma,addF2O3)
+
+        return self.iterations
@@ -1,34 +1,213 @@
 # Standard libraries
+import os
+import ast
+import operator
+import functools
+from types import MappingProxyType
+from collections.abc import Mapping
 import numpy as np
 
+from library import reactions
+
+'''
+Data and input files are parsed once per process and shared (read only) by
+every system. Relative paths of the data files are taken from the package 
+root, so that the scripts can be run from any directory. 
+'''
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_avog = 6.023e23 # Avogadro's number
+
+_operators = {ast.Add : operator.add, ast.Sub : operator.sub, 
+              ast.Mult : operator.mul, ast.Div : operator.truediv,
+              ast.Pow : operator.pow, ast.USub : operator.neg, 
+              ast.UAdd : operator.pos}
+
+def _evaluate(expr):
+    '''
+    Value of an arithmetic expression such as '0.5*1.4071e2', which may only
+    contain numbers, + - * / ** and brackets (instead of eval)
+    '''
+    def value(node):
+        if isinstance(node,ast.Constant) and isinstance(node.value,(int,float)):
+            return node.value
+        if isinstance(node,ast.BinOp) and type(node.op) in _operators:
+            return _operators[type(node.op)](value(node.left),value(node.right))
+        if isinstance(node,ast.UnaryOp) and type(node.op) in _operators:
+            return _operators[type(node.op)](value(node.operand))
+        raise ValueError(f'Invalid value {expr!r}')
+    return float(value(ast.parse(expr.strip(),mode='eval').body))
+
+def _path(fname):
+    ''' fname as given if it exists, else relative to the package root '''
+    if os.path.isabs(fname) or os.path.exists(fname):
+        return os.path.abspath(fname)
+    return os.path.join(_root,fname)
+
+def read_table(fname,skip_header=0,divisor=1):
+    '''
+    Table of 'name, value' lines of fname after skip_header lines, with the
+    values divided by divisor, as a read only mapping. Comments (#) and empty
+    lines are ignored. Tables are parsed once and cached until the file 
+    changes.
+    '''
+    path = _path(fname)
+    return _read_table(path,os.stat(path).st_mtime_ns,skip_header,divisor)
+
+@functools.lru_cache(maxsize=None)
+def _read_table(path,mtime,skip_header,divisor):
+    table = {}
+    with open(path,encoding='UTF-8') as file:
+        for lineNo, line in enumerate(file,1):
+            line = line.split('#')[0].strip()
+            if lineNo <= skip_header or not line:
+                continue
+            name, value = line.split(',',1)
+            table[name.strip()] = _evaluate(value)/divisor
+    return MappingProxyType(table)
+
+def read_compositions(fname,oxideNames):
+    '''
+    Melt compositions of a CSV file with a header line and one composition
+    per line: a column of weight % per oxide of oxideNames (all required),
+    and optionally 'name' and 'T' columns. Comments (#) and empty lines are
+    ignored. Returns the names (the line numbers if there is no name
+    column), the temperatures (None if there is no T column) and the
+    weight % as an array with one row per composition, ordered as
+    oxideNames.
+    '''
+    names = []
+    T = []
+    wt = []
+    with open(_path(fname),encoding='UTF-8') as file:
+        header = None
+        for lineNo, line in enumerate(file,1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            if header is None:
+                header = {col : i for i, col in enumerate(fields)}
+                missing = [ox for ox in oxideNames if ox not in header]
+                if missing:
+                    raise ValueError(f'{fname}: no column for {missing}')
+                continue
+            names.append(fields[header['name']] if 'name' in header \
+                         else str(lineNo))
+            if 'T' in header:
+                T.append(_evaluate(fields[header['T']]))
+            wt.append([_evaluate(fields[header[ox]]) for ox in oxideNames])
+
+    return names, np.array(T) if 'T' in header else None, \
+           np.array(wt,dtype=float).reshape(-1,len(oxideNames))
+
+def oxide_weights():
+    ''' Molecular weights of the oxides (mol wt. in g/mole) '''
+    return read_table('data/weights_oxides.csv',skip_header=2)
+
+def metal_weights():
+    ''' Weights of the metal atoms in the magma molecules (g) '''
+    # Dividing the molecular weights (mol wt. in g/mole) by _avog 
+    return read_table('data/weights_metals.csv',skip_header=2,divisor=_avog)
+
+class state_view(Mapping):
+    '''
+    Read only dict-like view of one of the state arrays of system, by name.
+    The values are read from the array on access, so a view stays valid 
+    while the solvers update the array in place.
+    '''
+    __slots__ = '_index', '_values'
+
+    def __init__(self,index,values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self,key):
+        return self._values.item(self._index[key])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def copy(self):
+        ''' The current values as a dict '''
+        return dict(zip(self._index,self._values.tolist()))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.copy()})'
+
+def _state_property(name,doc):
+    return property(lambda self: self._views[name],doc=doc)
+
 class system():
     '''
     Class containing all relevant information for the melt_vapor system.
+
+    The state that the solvers update (act_ox, gamma, presLiq, presGas, abEl,
+    fAbOx, fAbAtom) is kept in preallocated float arrays (_act_ox, ...) 
+    ordered as the name tuples below, and is read by name through read only
+    views. The solvers write the arrays in place.
     '''
+    __slots__ = 'T', 'comp_init', 'totWt', 'molOx', 'totMol', 'molOx_perc', \
+                'totPerc', 'mass', 'abETot', 'abETot_ox', 'totPres', \
+                'gasMoleFrac', 'massFrac', '_mwOxides', '_wMetals', '_wEl', \
+                '_views', '_act_ox', '_gamma', '_presLiq', '_presGas', '_abEl', \
+                '_fAbOx', '_fAbAtom'
 
-    def __init__(self,input_fname,T):
+    '''Constants'''
+    _avog = _avog # Avogadro's number
 
-        '''Constants'''
-        self._avog = 6.023e23 # Avogadro's number
-        self.T = T
-        ''' 
-        Defining variables
-        '''
-        self._oxideNames = 'SiO2','MgO','Al2O3','TiO2','Fe2O3','FeO','CaO',\
-                           'Na2O','K2O'
-        self._metalNames = 'Si','Mg','Al','Ti','Fe3','Fe','Ca','Na','K'
+    ''' 
+    Defining variables
+    '''
+    _oxideNames = 'SiO2','MgO','Al2O3','TiO2','Fe2O3','FeO','CaO','Na2O','K2O'
+    _metalNames = 'Si','Mg','Al','Ti','Fe3','Fe','Ca','Na','K'
+    _elNames = 'Si','Mg','Al','Ti','Fe','Ca','Na','K'
+
+    # Metal to oxide dictionary
+    _metal2oxide = dict(zip(_metalNames,_oxideNames))
+
+    # Oxides per metal atom of each element, and the abundance below which
+    # an element is removed from the melt
+    _halfOx = np.array([0.5 if el in ['Al','Na','K'] else 1 for el in _elNames])
+    _abFloor = np.array([2e-20 if el == 'Fe' else 0 for el in _elNames])
+
+    # Element of each oxide (Fe for Fe2O3)
+    _oxEl = np.array([*map(_elNames.index,('Si','Mg','Al','Ti','Fe','Fe',\
+                                           'Ca','Na','K'))])
+
+    # Key gases first, then the gases computed from them, and the liquid
+    # species, the oxides first (see data/vapor_species.csv)
+    _gasNames = 'SiO','O2','MgO','Fe','Ca','Al','Ti','Na','K'
+    _presGasNames = _gasNames + reactions.gasNames
+    _presLiqNames = tuple(dict.fromkeys(_oxideNames + reactions.liqNames))
 
-        # Metal to oxide dictionary
-        self._metal2oxide = {self._metalNames[i] : self._oxideNames[i] \
-                             for i in range(len(self._metalNames))}
+    # State arrays and the names of their entries
+    _stateNames = {'act_ox' : _oxideNames, 'gamma' : _oxideNames,
+                   'presLiq' : _presLiqNames, 'presGas' : _presGasNames,
+                   'abEl' : _elNames, 'fAbOx' : _elNames, 'fAbAtom' : _elNames}
+    _stateIndex = {name : {key : i for i, key in enumerate(keys)} \
+                   for name, keys in _stateNames.items()}
 
-        self._gasNames = 'SiO','O2','MgO','Fe','Ca','Al','Ti','Na','K'
+    act_ox = _state_property('act_ox','Oxide activities')
+    gamma = _state_property('gamma','Activity coefficients of the oxides')
+    presLiq = _state_property('presLiq','Liquid pressures')
+    presGas = _state_property('presGas','Gas pressures')
+    abEl = _state_property('abEl','Elemental abundances')
+    fAbOx = _state_property('fAbOx','Relative abundances of the metals per oxide')
+    fAbAtom = _state_property('fAbAtom','Relative abundances of the metals per atom')
+
+    def __init__(self,input_fname,T):
+
+        self.T = T
 
         # Initialising variables for future use 
-        self.act_ox = {ox : 0 for ox in self._oxideNames} # Oxide activities
-        self.gamma = {ox : 1 for ox in self._oxideNames} # Gamma 
-        self.presLiq = {ox  : 1 for ox in self._oxideNames}  # liquid pressures
-        self.presGas = {gas  : 1 for gas in self._gasNames}  # gas pressures         
+        self._act_ox = np.zeros(len(self._oxideNames)) # Oxide activities
+        self._gamma = np.ones(len(self._oxideNames)) # Gamma 
+        self._presLiq = np.ones(len(self._presLiqNames)) # liquid pressures
+        self._presGas = np.zeros(len(self._presGasNames)) # gas pressures
+        self._presGas[:len(self._gasNames)] = 1 
         self.totPres = 0
         self.gasMoleFrac = {}
         self.massFrac = 0
@@ -37,23 +216,9 @@ class system():
         Import standard data values
         '''
 
-        # File names
-        mwOxides_fname = 'data/weights_oxides.csv'
-        wMetals_fname = 'data/weights_metals.csv'
-
-        # Importing molecular oxide and metal weights
-        self._mwOxides = dict(np.genfromtxt(mwOxides_fname,delimiter= ',',\
-                              names=True,skip_header=1,dtype=None,\
-                              encoding = 'UTF-8'))
-        self._wMetals = dict(np.genfromtxt(wMetals_fname,delimiter= ',',\
-                             names=True,skip_header=1,dtype=None,\
-                             encoding = 'UTF-8',autostrip=True))
-
-        # Evaluating the multiplications and dividing by _avog 
-        # (mol wt. in g/mole)
-        self._wMetals.update((x, eval(y)/self._avog) \
-                              for x, y in self._wMetals.items())
-        
+        # Molecular oxide and metal weights (shared, read only)
+        self._mwOxides = oxide_weights()
+        self._wMetals = metal_weights()
 
         '''
         Importing composition
@@ -62,9 +227,13 @@ class system():
 
         TODO: Build check input data and put in other function
 
+        input_fname is the composition file, or the composition itself as a
+        mapping {oxide : weight %} (see coupling.py)
         '''        
-        self.comp_init = dict(np.genfromtxt(input_fname,encoding='UTF-8',
-                                       skip_header=2,dtype=None,delimiter=','))
+        if isinstance(input_fname,Mapping):
+            self.comp_init = dict(input_fname)
+        else:
+            self.comp_init = dict(read_table(input_fname,skip_header=2))
         self.totWt = sum(self.comp_init.values())
 
 
@@ -87,51 +256,87 @@ class system():
         - Equation: 
             abundance = # of metal atoms in oxide * moles * 1e6/moles of SiO2
         '''
-        self.abEl = {}
+        abEl = {}
         if self.molOx['SiO2'] != 0:            
-            self.abEl['Si'] = 1e6
-            self.abEl['Mg'] = self.molOx['MgO']  * 1e6 / self.molOx['SiO2']
-            self.abEl['Al'] = self.molOx['Al2O3'] * 2 * 1e6 / self.molOx['SiO2']
-            self.abEl['Ti'] = self.molOx['TiO2'] * 1e6 / self.molOx['SiO2']
-            self.abEl['Fe'] = (self.molOx['FeO'] + 2 * self.molOx['Fe2O3'])\
-                              * 1e6 / self.molOx['SiO2']
-            self.abEl['Ca'] = self.molOx['CaO']  * 1e6 / self.molOx['SiO2']
-            self.abEl['Na'] = self.molOx['Na2O'] * 2 * 1e6 / self.molOx['SiO2']
-            self.abEl['K']  = self.molOx['K2O']  * 2 * 1e6 / self.molOx['SiO2']
+            abEl['Si'] = 1e6
+            abEl['Mg'] = self.molOx['MgO']  * 1e6 / self.molOx['SiO2']
+            abEl['Al'] = self.molOx['Al2O3'] * 2 * 1e6 / self.molOx['SiO2']
+            abEl['Ti'] = self.molOx['TiO2'] * 1e6 / self.molOx['SiO2']
+            abEl['Fe'] = (self.molOx['FeO'] + 2 * self.molOx['Fe2O3'])\
+                         * 1e6 / self.molOx['SiO2']
+            abEl['Ca'] = self.molOx['CaO']  * 1e6 / self.molOx['SiO2']
+            abEl['Na'] = self.molOx['Na2O'] * 2 * 1e6 / self.molOx['SiO2']
+            abEl['K']  = self.molOx['K2O']  * 2 * 1e6 / self.molOx['SiO2']
 
         else:
-            self.abEl['Si'] = self.molOx['SiO2'] * self._avog
-            self.abEl['Mg'] = self.molOx['MgO']  * self._avog
-            self.abEl['Al'] = self.molOx['Al2O3'] * 2 * self._avog
-            self.abEl['Ti'] = self.molOx['TiO2'] * self._avog
-            self.abEl['Fe'] = (self.molOx['FeO'] + 2 * self.molOx['Fe2O3']) \
-                              * self._avog
-            self.abEl['Ca'] = self.molOx['CaO']  * self._avog
-            self.abEl['Na'] = self.molOx['Na2O'] * 2 * self._avog
-            self.abEl['K']  = self.molOx['K2O']  * 2 * self._avog 
+            abEl['Si'] = self.molOx['SiO2'] * self._avog
+            abEl['Mg'] = self.molOx['MgO']  * self._avog
+            abEl['Al'] = self.molOx['Al2O3'] * 2 * self._avog
+            abEl['Ti'] = self.molOx['TiO2'] * self._avog
+            abEl['Fe'] = (self.molOx['FeO'] + 2 * self.molOx['Fe2O3']) \
+                         * self._avog
+            abEl['Ca'] = self.molOx['CaO']  * self._avog
+            abEl['Na'] = self.molOx['Na2O'] * 2 * self._avog
+            abEl['K']  = self.molOx['K2O']  * 2 * self._avog 
 
         ''' Initial weight of melt so that weight% vaporized can be calculated later '''
-        self.mass = 0
-        for element in self.abEl:
+        # Weight of the oxides per atom of each element
+        self._wEl = np.zeros(len(self._elNames))
+        for i, element in enumerate(self._elNames):
             for oxide in self._mwOxides:
                 if element in oxide:
                     if element in ['Al','Na','K']:
-                        self.mass += 0.5 * self.abEl[element] * self._mwOxides[oxide]
+                        self._wEl[i] += 0.5 * self._mwOxides[oxide]
                     elif oxide != 'Fe2O3':
-                        self.mass += self.abEl[element] * self._mwOxides[oxide]
+                        self._wEl[i] += self._mwOxides[oxide]
+        self.mass = sum(abEl[el] * w for el, w in zip(self._elNames,\
+                                                     self._wEl.tolist()))
 
         ''' Renomarlizing the abundances ''' 
         # Total atomic abundance of all the elements (except 0)
-        self.abETot = sum(self.abEl.values())
+        self.abETot = sum(abEl.values())
         # Molecular abundance of all the oxides
-        self.abETot_ox = self.abEl['Si'] + self.abEl['Mg'] + self.abEl['Fe'] + \
-                  self.abEl['Ca'] + self.abEl['Ti'] + \
-                  0.5 * (self.abEl['Al'] + self.abEl['Na'] + self.abEl['K']) 
+        self.abETot_ox = abEl['Si'] + abEl['Mg'] + abEl['Fe'] + \
+                  abEl['Ca'] + abEl['Ti'] + \
+                  0.5 * (abEl['Al'] + abEl['Na'] + abEl['K']) 
 
         # Relative abundance of the metals per oxide
-        self.fAbOx = {el : 0.5 * self.abEl[el] / self.abETot_ox if \
-                            el in ['Al','Na','K'] else self.abEl[el] /\
-                            self.abETot_ox for el in self.abEl} 
+        fAbOx = {el : 0.5 * abEl[el] / self.abETot_ox if \
+                      el in ['Al','Na','K'] else abEl[el] /\
+                      self.abETot_ox for el in abEl} 
         
         # Relative abundance of the metals per atom                         
-        self.fAbAtom = {el : self.abEl[el] / self.abETot for el in self.abEl} 
+        fAbAtom = {el : abEl[el] / self.abETot for el in abEl} 
+
+        self._abEl = np.array([abEl[el] for el in self._elNames])
+        self._fAbOx = np.array([fAbOx[el] for el in self._elNames])
+        self._fAbAtom = np.array([fAbAtom[el] for el in self._elNames])
+        self._bind()
+
+    def _bind(self):
+        ''' Views of the state arrays '''
+        self._views = {name : state_view(self._stateIndex[name],\
+                                         getattr(self,'_' + name)) \
+                       for name in self._stateNames}
+
+    def __copy__(self):
+        # A copy of the system has its own state arrays
+        new = object.__new__(type(self))
+        for name in self.__slots__:
+            setattr(new,name,getattr(self,name))
+        for name in self._stateNames:
+            setattr(new,'_' + name,getattr(self,'_' + name).copy())
+        new._bind()
+        return new
+
+    def __getstate__(self):
+        # The shared data tables are not copied or pickled with the system
+        return {name : getattr(self,name) for name in self.__slots__ \
+                if name not in ['_mwOxides','_wMetals','_views']}
+
+    def __setstate__(self,state):
+        for name, val in state.items():
+            setattr(self,name,val)
+        self._mwOxides = oxide_weights()
+        self._wMetals = metal_weights()
+        self._bind()
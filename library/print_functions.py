@@ -45,8 +45,9 @@ def print_results(sim,melt,vap,output_fname):
     file.write(f'\nActivities (A) of Species in the melt\n \n')
     for ox in sim.act_ox:
         file.write(f'{ox:<12} {sim.act_ox[ox]:.6e}\n')
-    for spec in melt.act_pseudo:
-        file.write(f'{melt.name_pseudo[spec]:<12} {melt.act_pseudo[spec]:.6e}\n') 
+    act_pseudo = melt.pseudo_activities(sim._act_ox)
+    for spec, act in zip(melt._pseudoNames,act_pseudo.tolist()):
+        file.write(f'{melt.name_pseudo[spec]:<12} {act:.6e}\n') 
 
     ''' Gas pressure partial vapor ''' 
     file.write('\nGas partial pressures (P) in vapor \n\n')
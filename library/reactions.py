@@ -0,0 +1,248 @@
+# Standard libraries
+import os
+import re
+import numpy as np
+
+from library.thermo_tables import coefficient_table
+
+'''
+Reaction database of the melt and gas chemistry. The reactions are declared
+once, in the data files below, and everything the solvers evaluate is built
+from them when the module is imported:
+- data/melt_reactions.csv: the oxide pseudospecies of the melt (IMCC),
+  their stoichiometry, mass balance weights and equilibrium constants
+- data/vapor_reactions.csv: the equilibrium constants of the gas chemistry
+- data/vapor_species.csv: the gas and liquid species, as a combination of
+  those constants times powers of the key gas pressures
+
+The pressures of all the species are evaluated by a kernel generated from
+data/vapor_species.csv (see pressure_plan), so adding a species to the data
+files needs no new code in the solvers.
+'''
+_data = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(\
+                     __file__))),'data')
+
+# One term of a sum: sign, coefficient and name
+_term = re.compile(r'\s*([+-]?)\s*(\d*\.?\d*(?:[eE][+-]?\d+)?)\s*'
+                   r'([A-Za-z]\w*)\s*')
+
+def _terms(expr):
+    '''
+    Coefficients of the names in a sum such as '2 E + B - A - C' or
+    '0.5 Na2O + SiO2', as {name : coefficient}
+    '''
+    terms = {}
+    expr = expr.strip()
+    pos = 0
+    while pos < len(expr):
+        match = _term.match(expr,pos)
+        if match is None or (pos and not match.group(1)):
+            raise ValueError(f'Invalid sum {expr!r}')
+        sign, coef, name = match.groups()
+        terms[name] = terms.get(name,0) + \
+                      (-1 if sign == '-' else 1) * float(coef or 1)
+        pos = match.end()
+    return terms
+
+def _read_rows(fname):
+    '''
+    Rows of the CSV file fname (in data/) as dicts by column, the columns
+    are named by the first line. Comments (#) and empty lines are ignored.
+    '''
+    rows = []
+    with open(os.path.join(_data,fname),encoding='UTF-8') as file:
+        header = None
+        for line in file:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            if header is None:
+                header = [field.strip('"') for field in fields]
+                continue
+            rows.append(dict(zip(header,fields + [''] * (len(header) - \
+                                                        len(fields)))))
+    return rows
+
+'''
+###### Melt ######
+'''
+_meltRows = _read_rows('melt_reactions.csv')
+
+# Formula of each pseudospecies
+pseudoFormulas = {row['name'] : row['formula'] for row in _meltRows}
+# Moles of each oxide in one mole of each pseudospecies
+stoichPseudo = {row['name'] : _terms(row['oxides']) for row in _meltRows}
+# Weights of each pseudospecies in the mass balance of the oxides
+massBalPseudo = {row['name'] : _terms(row['mass balance'] or row['oxides']) \
+                 for row in _meltRows}
+# Equilibrium constants of the formation of the pseudospecies
+KPseudo = coefficient_table({row['name'] : tuple(float(row[col]) for col in \
+                             'ABC') for row in _meltRows})
+
+'''
+###### Gas ######
+'''
+fitsVapor = {row['fit'] : (float(row['A']), float(row['B'])) for row in \
+             _read_rows('vapor_reactions.csv')}
+
+_speciesRows = _read_rows('vapor_species.csv')
+
+def _species(phase):
+    ''' {species : (log10K terms, key pressure powers)} of a phase '''
+    return {row['species'] : (_terms(row['log10K']),_terms(row['pressures']))\
+            for row in _speciesRows if row['phase'] == phase}
+
+gasSpecies = _species('gas')
+liqSpecies = _species('liq')
+ionSpecies = _species('ion')
+electron, = _species('electron')
+
+# Gases after the key gases: the neutral gases, the electron gas and the
+# cations (the order of system._presGasNames)
+gasNames = tuple(gasSpecies) + (electron,) + tuple(ionSpecies)
+liqNames = tuple(liqSpecies)
+
+# Equilibrium constants of all the species by (phase, species)
+KVapor = coefficient_table(fitsVapor,{(phase, name) : log10K for phase, \
+    species in [('gas',gasSpecies),('ion',ionSpecies),('liq',liqSpecies)] \
+    for name, (log10K, _) in species.items()})
+
+class pressure_plan():
+    '''
+    Evaluation of the pressures of the species (data/vapor_species.csv) from
+    the key gas pressures with common subexpressions shared:
+
+    - every power of a key pressure that is needed (O2**0.5, O2**-0.5,
+      Al**2, ...) is computed once, from the lower powers where possible
+      (O2**-0.5 = 1/O2**0.5, Al**2 = Al*Al, O2**1.5 = O2*O2**0.5)
+    - every product of powers (monomial) is computed once, from the
+      monomial of its first keys (Al**2 * O2**0.5 from Al**2), so species
+      sharing a monomial (SiO2(g), SiO2(liq)) cost one multiplication each
+    - the constants of a species are combined into one (KVapor)
+
+    The plan is a list of nodes, each a multiplication, power or inverse of
+    earlier values (the key pressures first), and the node of each species
+    (-1 for a constant). It is evaluated by the generated Python function
+    pressures(P,K,gas,liq) (values of floats, or of arrays for a batch), 
+    which writes the pressures into the preallocated gas and liq (the 
+    entries of sim._presGas after the key gases, and sim._presLiq), or by
+    kernels.melt_pressure_calculation (backend 'numba').
+
+    inactive: key gases of pressure 0 (their element has left the melt). 
+    The species made of them are 0 without being evaluated (zero marks
+    them, their node is -1 and their constant must be taken as 0).
+    '''
+    _mul, _pow, _inv = 0, 1, 2
+
+    def __init__(self,keyNames,gasNames,liqNames,inactive=()):
+
+        self.keyNames = keyNames
+        self.inactive = tuple(inactive)
+        self._index = {}
+        self.ops = []
+        self.pows = []
+
+        # The neutral gases, the cations and the liquid species
+        if len(gasNames) != len(gasSpecies) + len(ionSpecies) + 1 or \
+           sorted(liqNames) != sorted(liqSpecies):
+            raise ValueError('The species do not match data/vapor_species.csv')
+        keys = [('gas',name) for name in gasNames if name in gasSpecies] + \
+               [('ion',name) for name in ionSpecies] + \
+               [('liq',name) for name in liqNames]
+        phases = {'gas' : gasSpecies, 'ion' : ionSpecies, 'liq' : liqSpecies}
+        species = [phases[phase][name] for phase, name in keys]
+        self.zero = np.array([any(powers.get(key,0) > 0 for key in inactive) \
+                              for _, powers in species],dtype=bool)
+        self.nodes = np.array([-1 if zero else self._monomial(powers) for \
+                               (_, powers), zero in zip(species,self.zero)],\
+                              dtype=int)
+        self.nGas = len(gasSpecies)
+        self.nIon = len(ionSpecies)
+
+        # Constants ordered as the species (of KVapor)
+        self.order = np.array([KVapor.names.index(key) for key in keys])
+
+        # Powers of the key pressures of each species (log form)
+        self.powers = np.zeros((len(species),len(keyNames)))
+        for j, (_, powers) in enumerate(species):
+            for key, nu in powers.items():
+                self.powers[j,keyNames.index(key)] = nu
+
+        self.ops = np.array(self.ops,dtype=int).reshape(-1,3)
+        self.pows = np.array(self.pows,dtype=float)
+        self.source = self._source()
+        namespace = {'_ratio' : _ratio}
+        exec(self.source,namespace)
+        self.pressures = namespace['pressures']
+
+    def _node(self,op,a,b=-1,power=0.):
+        ''' Index of the value of op(a,b), added unless already computed '''
+        key = op, a, b, power
+        if key not in self._index:
+            self._index[key] = len(self.keyNames) + len(self.ops)
+            self.ops.append((op,a,b))
+            self.pows.append(power)
+        return self._index[key]
+
+    def _power(self,key,nu):
+        ''' Node of the key pressure key**nu '''
+        i = self.keyNames.index(key)
+        if nu == 1:
+            return i
+        if nu < 0:
+            return self._node(self._inv,self._power(key,-nu))
+        if nu > 1:
+            return self._node(self._mul,self._power(key,nu-1),i)
+        return self._node(self._pow,i,power=nu)
+
+    def _monomial(self,powers):
+        ''' Node of the product of the key pressures to the given powers '''
+        factors = sorted((self.keyNames.index(key), nu) for key, nu in \
+                         powers.items() if nu != 0)
+        node = -1
+        for i, nu in factors:
+            factor = self._power(self.keyNames[i],nu)
+            node = factor if node < 0 else self._node(self._mul,node,factor)
+        return node
+
+    def _source(self):
+        ''' Source of the function pressures(P,K,gas,liq) of the plan '''
+        nKey = len(self.keyNames)
+        def value(i):
+            return f'P{i}' if i < nKey else f'x{i}'
+        lines = ['def pressures(P,K,gas,liq):',
+                 f'    {", ".join(value(i) for i in range(nKey))} = P']
+        for n, (op, a, b) in enumerate(self.ops):
+            if op == self._mul:
+                expr = f'{value(a)}*{value(b)}'
+            elif op == self._pow:
+                expr = f'{value(a)}**{float(self.pows[n])!r}'
+            else:
+                expr = f'1/{value(a)}'
+            lines.append(f'    {value(nKey + n)} = {expr}')
+
+        def species(j):
+            node = self.nodes[j]
+            if self.zero[j]:
+                return '0.'
+            return f'K[{j}]' if node < 0 else f'K[{j}]*{value(node)}'
+        ions = [j for j in range(self.nGas,self.nGas + self.nIon) \
+                if not self.zero[j]]
+        lines += [f'    c{j} = {species(j)}' for j in ions]
+        lines.append(f'    e = ({" + ".join(f"c{j}" for j in ions) or "0."})'
+                     '**0.5')
+        gas = [species(j) for j in range(self.nGas)] + ['e'] + \
+              [f'_ratio(c{j},e)' if j in ions else '0.' for j in \
+               range(self.nGas,self.nGas + self.nIon)]
+        liq = [species(j) for j in range(self.nGas + self.nIon,\
+                                         len(self.nodes))]
+        lines += [f'    gas[{i}] = {expr}' for i, expr in enumerate(gas)]
+        lines += [f'    liq[{i}] = {expr}' for i, expr in enumerate(liq)]
+        return '\n'.join(lines) + '\n'
+
+def _ratio(num,den):
+    ''' num/den, or 0 where den is 0 (for scalars and arrays alike) '''
+    if isinstance(den,np.ndarray):
+        return np.divide(num,den,out=np.zeros(den.shape),where=den != 0)
+    return num/den if den != 0 else 0
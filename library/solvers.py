@@ -0,0 +1,110 @@
+# Standard libraries
+import numpy as np
+
+class anderson():
+    '''
+    Anderson acceleration of a fixed point iteration x = g(x) (Walker & Ni
+    2011): the next iterate combines the last depth+1 iterates so that the
+    linearised residual f = g(x) - x is smallest,
+
+        x_next = x + beta f - (dX + beta dF) c,   c = argmin |f - dF c|
+
+    where dX, dF hold the differences of the last iterates and residuals.
+    With depth 0 this is the damped fixed point iteration x + beta (g(x) - x).
+
+    Safeguards: the least squares problem is regularised and the step is
+    limited to maxStep in every component (non finite steps fall back to the
+    damped step). If the residual oscillates (grows, or reverses its
+    direction, on two consecutive iterations) or stagnates (falls by less
+    than 10% over window iterations) the history is dropped and beta halved,
+    down to betaMin.
+
+    Call start() before each solve and step(x,gx) for every iterate.
+    '''
+    def __init__(self,depth=5,damping=1.,betaMin=0.05,maxStep=2.,window=10,\
+                 regularization=1e-10):
+        self.depth = depth
+        self.damping = damping
+        self.betaMin = betaMin
+        self.maxStep = maxStep
+        self.window = window
+        self.regularization = regularization
+        self.restarts = 0 # Oscillations and stagnations of the last solve
+        self.start()
+
+    def start(self):
+        ''' Forgets the previous solve '''
+        self.beta = self.damping
+        self.restarts = 0
+        self._restart()
+        self._norms = []
+
+    def _restart(self):
+        self._x = None # Last iterate and its residual
+        self._f = None
+        self._m = 0 # Number of differences held in _dX, _dF
+        self._rising = 0
+
+    def _heavier(self):
+        ''' Drops the history and damps more '''
+        self.beta = max(0.5 * self.beta,self.betaMin)
+        self.restarts += 1
+        self._restart()
+
+    def _monitor(self,f,norm):
+        ''' Oscillation and stagnation tests on the new residual f '''
+        if self._f is not None:
+            fPrev = self._f
+            flipped = f @ fPrev < -0.5 * np.sqrt((f @ f) * (fPrev @ fPrev))
+            self._rising = self._rising + 1 \
+                           if flipped or norm > self._norms[-1] else 0
+            if self._rising >= 2:
+                self._heavier()
+                self._norms = [norm]
+                return
+
+        self._norms.append(norm)
+        if len(self._norms) > self.window:
+            if norm > 0.9 * self._norms[-1-self.window]:
+                self._heavier()
+                self._norms = [norm]
+
+    def step(self,x,gx):
+        ''' The next iterate after x, whose image is gx '''
+        f = gx - x
+        self._monitor(f,np.abs(f).max())
+
+        # Differences of the last depth iterates (newest first)
+        if self._x is None:
+            self._dX = np.empty((self.depth,x.size))
+            self._dF = np.empty((self.depth,x.size))
+        elif self.depth:
+            self._dX[1:] = self._dX[:-1]
+            self._dF[1:] = self._dF[:-1]
+            np.subtract(x,self._x,out=self._dX[0])
+            np.subtract(f,self._f,out=self._dF[0])
+            self._m = min(self._m + 1,self.depth)
+        self._x, self._f = x, f
+
+        dx = self.beta * f
+        m = self._m
+        if m:
+            dX = self._dX[:m]
+            dF = self._dF[:m]
+            # Regularised least squares (normal equations)
+            A = dF @ dF.T
+            A.flat[::m+1] += self.regularization * A.trace()
+            try:
+                c = np.linalg.solve(A,dF @ f)
+                dxAA = dx - c @ (dX + self.beta * dF)
+                if np.all(np.isfinite(dxAA)):
+                    dx = dxAA
+                else:
+                    self._restart()
+            except np.linalg.LinAlgError:
+                self._restart()
+
+        big = np.abs(dx).max()
+        if big > self.maxStep:
+            dx *= self.maxStep / big
+        return x + dx
@@ -0,0 +1,101 @@
+# Standard libraries
+import json
+import time
+
+class solver_stats():
+    '''
+    Opt-in statistics of the equilibrium solvers: every melt_activity and
+    vapor_pressure calculation of the attached objects is recorded with its
+    stage, solver, number of iterations, final residual, wall time and the
+    vaporisation step it belongs to, and vaporiser.vaporisation (given
+    stats=) counts the steps and times the vapor removal. The stages are
+    'melt' and 'vapor', and 'melt_F2O3' and 'vapor_F2O3' with F2O3 added.
+
+    The solver is the one that gave the solution: when the requested solver
+    fails and falls back to fixed_point, the call records fixed_point and 
+    its iterations, and fallback holds the iterations of the failed attempt
+    (None without a fallback).
+
+    The residual is max |log10(gamma_new/gamma)| of the converged melt
+    activity coefficients, and max |ln(adjFact)| of the adjustment factors
+    still different from 0 for the vapor pressures (stage 'global', of
+    vaporiser.global_equilibrium: the largest of both, in ln). The checks
+    of the fast chemistry (stage 'prune', see melt.prune_pseudo) record the
+    number of pruned pseudospecies as iterations and the error of the 
+    pruning as residual.
+
+    Without a collector (melt.stats and vapor.stats None, the default) no
+    time is taken and nothing is recorded.
+
+        stats = solver_stats(T=2500,comp='BSE')
+        stats.attach(melt,vapor)
+        for snapshot in vaporisation(...,stats=stats): ...
+        stats.dump('output/magpy_stats.json')
+    '''
+    fields = 'stage', 'method', 'iterations', 'residual', 'time', 'step', \
+             'fallback'
+
+    def __init__(self,**context):
+        self.context = context # What was solved (T, composition, ...)
+        self.calls = []
+        self.steps = 0
+        self.vaporiseTime = 0.
+
+    def attach(self,*solvers):
+        ''' Records the calculations of the melt_activity/vapor_pressure '''
+        for solver in solvers:
+            solver.stats = self
+        return self
+
+    @staticmethod
+    def clock():
+        return time.perf_counter()
+
+    def record(self,stage,method,iterations,residual,seconds,fallback=None):
+        self.calls.append((stage,method,int(iterations),float(residual),\
+                           seconds,self.steps,\
+                           None if fallback is None else int(fallback)))
+
+    def step(self,seconds):
+        ''' One vaporisation step, the vapor removal took seconds '''
+        self.steps += 1
+        self.vaporiseTime += seconds
+
+    def stages(self):
+        ''' Totals per stage (in order of the first call) '''
+        stages = {}
+        for stage, _, iterations, residual, seconds, _, fallback in self.calls:
+            if stage not in stages:
+                stages[stage] = {'calls' : 0, 'iterations' : 0, \
+                                 'max_iterations' : 0, 'time' : 0., \
+                                 'max_time' : 0., 'max_residual' : 0., \
+                                 'fallbacks' : 0, 'fallback_iterations' : 0}
+            total = stages[stage]
+            total['calls'] += 1
+            if fallback is not None:
+                total['fallbacks'] += 1
+                total['fallback_iterations'] += fallback
+            total['iterations'] += iterations
+            total['max_iterations'] = max(total['max_iterations'],iterations)
+            total['time'] += seconds
+            total['max_time'] = max(total['max_time'],seconds)
+            total['max_residual'] = max(total['max_residual'],residual)
+        for total in stages.values():
+            total['mean_iterations'] = total['iterations'] / total['calls']
+        return stages
+
+    def summary(self,calls=True):
+        ''' The run summary as a dict, with every call if calls '''
+        summary = {'context' : self.context, 'steps' : self.steps, \
+                   'vaporise_time' : self.vaporiseTime, \
+                   'solve_time' : sum(call[4] for call in self.calls), \
+                   'stages' : self.stages()}
+        if calls:
+            summary['calls'] = [dict(zip(self.fields,call)) \
+                                for call in self.calls]
+        return summary
+
+    def dump(self,fname,calls=True):
+        ''' Writes the summary to the JSON file fname '''
+        with open(fname,'w') as file:
+            json.dump(self.summary(calls),file,indent=1)
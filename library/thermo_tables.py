@@ -0,0 +1,79 @@
+import functools
+import numpy as np
+
+class coefficient_table():
+    '''
+    Table of equilibrium constants given by fits of the form
+
+        log10(K) = A + B/T + C/T**2
+
+    fits maps the name of each constant to its coefficients (A, B) or
+    (A, B, C). combos optionally defines the constants that are returned as
+    products of powers of the fitted ones, name : {fit : power}, so that
+    e.g. 10**(2E + B - A - C) is {'E' : 2, 'B' : 1, 'A' : -1, 'C' : -1}.
+
+    The table evaluates all its constants at once for a scalar temperature
+    or an array of temperatures. The results for the last maxsize
+    temperatures are kept in a cache shared by every user of the table, so
+    building solver objects again at the same temperature costs nothing.
+    '''
+    def __init__(self,fits,combos=None,maxsize=4096):
+
+        coef = np.zeros((len(fits),3))
+        for i, fit in enumerate(fits.values()):
+            coef[i,:len(fit)] = fit
+
+        if combos is not None:
+            fitNames = tuple(fits)
+            powers = np.zeros((len(combos),len(fits)))
+            for j, combo in enumerate(combos.values()):
+                for fit, power in combo.items():
+                    powers[j,fitNames.index(fit)] = power
+            coef = powers @ coef
+            fits = combos
+
+        self.names = tuple(fits)
+        self._coef = coef
+        self._evaluate = functools.lru_cache(maxsize=maxsize)(self._evaluate)
+
+    def _evaluate(self,key):
+        '''
+        log10(K), K and, for a scalar temperature, K by name for the 
+        temperature(s) encoded in key (see _key)
+        '''
+        if isinstance(key,float):
+            T = np.array(key)
+        else:
+            T = np.frombuffer(key[0]).reshape(key[1])
+        invT = 1/T[...,None]
+        log10K = self._coef[:,0] + self._coef[:,1]*invT + self._coef[:,2]*invT**2
+        K = 10**log10K
+        log10K.flags.writeable = False
+        K.flags.writeable = False
+        named = dict(zip(self.names,K.tolist())) if K.ndim == 1 else None
+        return log10K, K, named
+
+    @staticmethod
+    def _key(T):
+        ''' Hashable cache key of a scalar or an array of temperatures '''
+        if np.ndim(T) == 0:
+            return float(T)
+        T = np.asarray(T,dtype=float)
+        return T.tobytes(), T.shape
+
+    def log10(self,T):
+        '''
+        log10 of the constants, an array with the constants along the last
+        axis (read only)
+        '''
+        return self._evaluate(self._key(T))[0]
+
+    def __call__(self,T):
+        ''' The constants by name, as floats or as arrays over T '''
+        _, K, named = self._evaluate(self._key(T))
+        if named is not None:
+            return dict(named)
+        return {name : K[...,j] for j, name in enumerate(self.names)}
+
+    def cache_info(self):
+        return self._evaluate.cache_info()
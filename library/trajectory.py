@@ -0,0 +1,120 @@
+# Standard libraries
+import numpy as np
+
+class csv_sink():
+    '''
+    Writes the per-step snapshots of vaporiser.vaporisation to a CSV file:
+    one row per step and one column per quantity, dicts such as gasMoleFrac
+    giving a column per entry (gasMoleFrac_SiO, ...). Rows are buffered and
+    written bufferSize at a time.
+
+    Downsampling keeps long runs small: with every, every Nth step is kept;
+    with rtol, a step is kept when a quantity (larger than floor) changed by
+    more than rtol relative to the last kept step. Without either, every 
+    step is kept. The last step is always written when the sink is closed.
+
+    Any object with write(snapshot) and close() can be used as a sink.
+
+    resume is a state() of a sink on the same file, from which it continues
+    (the rows written after that state are dropped).
+    '''
+    def __init__(self,fname,every=None,rtol=None,floor=1e-12,bufferSize=1000,\
+                 resume=None):
+        self.fname = fname
+        self.every = every
+        self.rtol = rtol
+        self.floor = floor
+        self.bufferSize = bufferSize
+        self.columns = None
+        self.rows = 0 # Rows written to the file
+        self._buffer = []
+        self._kept = None # Values of the last kept step
+        self._last = None # Values of the last step if it was not kept
+        self._skipped = 0
+        if resume is None:
+            self._file = open(fname,'w')
+            return
+
+        state, arrays = resume
+        self._file = open(fname,'r+')
+        self._file.seek(state['offset'])
+        self._file.truncate()
+        self.columns = state['columns']
+        self.rows = state['rows']
+        self._skipped = state['skipped']
+        self._kept = arrays.get('kept')
+        self._last = arrays.get('last')
+
+    @staticmethod
+    def _flatten(snapshot):
+        ''' Column names and values of a snapshot '''
+        names = []
+        values = []
+        for key, val in snapshot.items():
+            if isinstance(val,dict):
+                names.extend(f'{key}_{sub}' for sub in val)
+                values.extend(val.values())
+            else:
+                names.append(key)
+                values.append(val)
+        return names, np.array(values,dtype=float)
+
+    def _keep(self,values):
+        if self._kept is None or (self.every is None and self.rtol is None):
+            return True
+        if self.every is not None and self._skipped + 1 >= self.every:
+            return True
+        if self.rtol is not None:
+            big = np.maximum(np.abs(values),np.abs(self._kept)) > self.floor
+            change = np.abs(values - self._kept) > self.rtol * np.abs(self._kept)
+            return bool(np.any(big & change))
+        return False
+
+    def write(self,snapshot):
+        names, values = self._flatten(snapshot)
+        if self.columns is None:
+            self.columns = names
+            self._file.write(','.join(names) + '\n')
+
+        if self._keep(values):
+            self._append(values)
+        else:
+            self._last = values
+            self._skipped += 1
+
+    def _append(self,values):
+        self._buffer.append(','.join(f'{val:.10g}' for val in values) + '\n')
+        self._kept = values
+        self._last = None
+        self._skipped = 0
+        if len(self._buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        self._file.writelines(self._buffer)
+        self.rows += len(self._buffer)
+        self._buffer = []
+
+    def state(self):
+        '''
+        The state of the sink after flush (JSON types, and arrays), to 
+        continue it with csv_sink(...,resume=state)
+        '''
+        arrays = {key : val for key, val in [('kept',self._kept),\
+                                             ('last',self._last)] \
+                  if val is not None}
+        self._file.flush()
+        return {'offset' : self._file.tell(), 'columns' : self.columns, \
+                'rows' : self.rows, 'skipped' : self._skipped}, arrays
+
+    def close(self):
+        if self._last is not None:
+            self._append(self._last)
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
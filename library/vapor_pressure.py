@@ -1,507 +1,156 @@
+import re
+import functools
 import numpy as np
 
+from library import kernels
+from library import solvers
+from library import reactions
+from library.melt_vapor_system import system
+
+'''
+Gas chemistry thermodynamic data: the equilibrium constants of the gas and
+liquid species and their key gas pressures are declared in
+data/vapor_reactions.csv and data/vapor_species.csv (see reactions.py), and
+melt_pressure_calculation evaluates the pressure_plan built from them.
+'''
+_nKey = len(system._gasNames)
+
+@functools.lru_cache(maxsize=16) # the last active sets
+def _active_plan(inactive):
+    ''' The pressure_plan without the species of the key gases inactive '''
+    return reactions.pressure_plan(system._gasNames,\
+        system._presGasNames[_nKey:],system._presLiqNames,inactive)
+
+_plan = _active_plan(())
+
+def _gas_atoms(gasNames,elNames):
+    '''
+    Number of atoms of each element (elNames, then O) in each gas, and the 
+    number of O atoms per metal atom in the oxide of each element. The ions 
+    count towards their metal, the electrons towards nothing.
+    '''
+    ions = {reactions.electron : '', **{ion : ''.join(keys) for ion, (_, keys)\
+                                        in reactions.ionSpecies.items()}}
+    atoms = np.zeros((len(elNames) + 1,len(gasNames)))
+    for j, gas in enumerate(gasNames):
+        for el, count in re.findall(r'([A-Z][a-z]?)(\d*)',ions.get(gas,gas)):
+            atoms[(elNames + ('O',)).index(el),j] += int(count or 1)
+    oxideO = np.array([{'Si' : 2, 'Ti' : 2, 'Al' : 1.5, 'Na' : 0.5, 'K' : 0.5}\
+                       .get(el,1) for el in elNames])
+    return atoms, oxideO
+
+_gasAtoms, _oxideO = _gas_atoms(system._presGasNames,system._elNames)
+
+'''
+Log form of melt_pressure_calculation (solver 'log'): every species is a
+constant times powers of the key pressures, so its log pressure is linear in
+the log key pressures,
+
+    log P = log K + sum(nu * log P_key)
+
+with the species ordered as the constants of _plan: the neutral gases, the
+cations and the liquid species.
+'''
+_gas = slice(0,_plan.nGas)
+_ion = slice(_plan.nGas,_plan.nGas + _plan.nIon)
+_liq = slice(_plan.nGas + _plan.nIon,None)
+
+# Stands in for log(0): exp of it (and of its multiples) is exactly 0
+_logZero = -1e5
+
+def _unpack(values):
+    ''' The entries of a state array as floats, or its rows for a batch '''
+    return values.tolist() if values.ndim == 1 else values
+
 class vapor_pressure():
 
-    def __init__(self,sim):
+    def __init__(self,sim,backend='numpy',anderson=None):
 
-        ''' Setting initial values of key pressures and adjustment factors for gases '''
+        ''' 
+        Setting initial values of key pressures and adjustment factors for 
+        gases. anderson: options of solvers.anderson for the 'anderson' 
+        solver.
+        '''
         # self.presGas = {gas : 1 for gas in sim._gasNames}  # gas pressures
         self.adjFact = {gas : 1 for gas in sim._gasNames}  # adjustment factors
+        self.dif_range = 2.30359e-6 # Max amount that the adjFact can difer from 1
+        self._jac = None # Broyden Jacobian kept between calls 
+        self._jacGases = None
+        self._jacGlobal = None # see vaporiser.global_equilibrium
+        self._jacGlobalKeys = None
         self._pConv = 1.01325e6/1.38046e-16 # _pConv converts the pressures into number         densities
                                             # dyn/cm**2=>atm) / Boltzmann's constant (R/avog)
-        '''
-        Gas chemistry thermodynamic data
-        - This has been taken almost directly from the Fortran code due to lack of insight
-          into the variable naming. Maybe derserves another look in the future.
-        '''
-
-        ''' 
-        ###### Silicon and oxygen ######
-        SiO2(liq) = Si(g) + 2O(g)
-        JANAF 2nd ed. & supplements 2000-4500 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99989
-        AK1 = 10.0**A = P(SIG)*P(OG)**2/P(SIO2L)
-        '''    
-        A = 22.13 - 94311.0 /sim.T
-         
-        '''
-        0.5O2 (g) = O(g)
-        JANAF 2nd ed. 
-        correlation coefficient for linear fit = 
-        AK2 = 10.0**E = P(OG)/P(02G)**0.5
-
-        HENCE 10.0**A = P(SIG)*(P(O2G)*10.0**2E)/P(SIO2L)
-        HENCE P(SIO2L) = 10.0**(2.0*E-A)*P(SIG)*P(O2G)
-        HENCE P(O2G) = 10.0**(-2.0*E) * P(OG)**2
-        '''
-        E = 3.47 - 13282 /sim.T
-        self.EOG = 10.0**E
-        # print(self.EOG)
-        
-        '''    
-        Si(liq) = Si(g)
-        AK3 = 10.0**B = P(SIG)/P(SIL)
-        HENCE P(SIG) = 10.0**B*P(SIL)
-        '''
-        B = 6.00 - 20919 /sim.T
-        self.ESIG = 10.0**B
-
-        '''
-        Si(liq) + 0.5 O2(g) = SiO(g)
-        FOR P(SIG) INSTEAD OF P(SIL)    C2 = - 3.67 + 29760 /sim.T
-        AK4 = 10.0**C = P(SIOG)/(P(SIL)*P(O2G)**0.5)
-        HENCE P(SIL) = 10.0**-C*P(SIOG)/P(O2G)**0.5
-        HENCE P(SIO2L) = 10.0**(2.0*E+B-A)*10.0**(-C)*P(SIOG)*P(O2G)**0.5
-        HENCE P(SIO2L) = 10.0**(2.0*E+B-A-C)*P(SIOG)*P(O2G)**0.5
-        '''
-        C = 2.51 + 8207 /sim.T
-        self.ESIL = 10.0**(-C)
-        self.ESIO2L = 10.0**(2.0*E + B - A - C)
-
-        '''
-        Si(liq) + O2(g) = SiO2(g)
-        FOR P(SIG) INSTEAD OF P(SIL)    D2 = - 7.57 + 39595 /sim.T
-        AK5 = 10.0**D = P(SIO2G)/(P(SIL)*P(O2G))
-        HENCE P(SIO2G) = 10.0**D*P(SIL)*P(O2G)
-        HENCE P(SIO2G) = 10.0**D*10.0**-B*P(SIG)*P(O2G)
-        HENCE P(SIO2G) = 10.0**(D-B) * P(SIG) * P(O2G)
-        '''
-        D = -1.44 + 18326 /sim.T
-        self.ESIO2G = 10.0**D
-
-        '''
-        ###### Magnesium ######
-        MgO(liq) = Mg(g) + O(g)
-        JANAF 2nd ed. & supplements 1500-5000 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99994
-        AK6 = 10.0**F = P(MGG)*P(OG)/P(MGOL)
-        HENCE P(MGOL) = 10.0**(-F) * P(MGG) * P(OG)
-        '''
-        F = 12.56 - 46992 /sim.T
-        self.EMGOL = 10.0**(-F)
-    
-        '''
-        Mg(g) + 0.5 O2(g) = MgO(g)
-        AK8 = 10.0**G = P(MGOG)/(P(MGG)*P(O2G)**0.5)
-        HENCE P(MGOG) = 10.0**G * P(MGG) * P(O2G)**0.5
-        '''
-        G = -1.19 + 3794 /sim.T
-        self.EMGG = 10.0**(-G)
-
-        '''
-        ###### Iron ######
-        FeO(liq) = Fe(g) + O(g)
-        JANAF 2nd ed. & supplements 2000-5000 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99995
-        AK9 = 10.0**AA = P(FEG)*P(OG)/P(FEOL)
-        HENCE P(FEOL) = 10.0**(-AA) * P(FEG) * P(OG)
-        '''
-        AA = 12.06 - 44992 /sim.T
-        self.EFEOL = 10.0**(-AA)
-        
-        '''
-        Fe(liq) = Fe(g)
-        AK10 = 10.0**AB = P(FEG)/P(FEL)
-        Fe(liq) + 0.5 O2(g) = FeO(g)
-        FOR P(FEG) INSTEAD OF P(FEL)    AC2 = - 2.93 + 9945 /sim.T
-        AK11 = 10.0**AC = P(FEOG)/(P(FEL)*P(O2G)**0.5)
-        HENCE P(FEOG) = 10.0**(AC-AB) * P(FEG) * P(O2G)**0.5
-        '''
-        AB = 6.35 -19704 /sim.T
-        self.EFEL = 10.0**(-AB)
-        AC = 3.39 - 9951 /sim.T
-        self.EFEOG = 10.0**(AC-AB)
-
-        '''
-        2Fe (g) + 1.5 O2 (g) = Fe2O3 (liq)
-        Fe2O3 (liq) cp data from IVTANTHERMO database (estimated)
-        hematite enthalpy of fusion calculated from Sugawara & Akaogi 2004
-        K = PFE2O3L / (PFEG**2 * PO2G**0.5)
-        HENCE P(FE2O3L) = 10**AD * PFEG**2 * PO2G**0.5
-        '''
-        AD = -2.26722053113e1 + 7.56430936141329e4 /sim.T
-        self.EFE2O3L = 10**AD
-        
-        '''
-        3Fe (g) + 2 O2 (g) = Fe3O4 (liq)
-        Fe3O4 (liq) cp data from Barin 95
-        magnetite enthalpy of fusion from JANAF 4th ed.
-        K = PFE3O4L / (PFEG**3 * PO2G**0.5)
-        HENCE P(FE3O4L) = 10**AE * PFEG**3 * PO2G**0.5
-        '''
-        AE = -3.19907301154e1 + 1.110526206139634e5 /sim.T
-        self.EFE3O4L = 10**AE
-
-        '''
-        ###### Calcium ######
-        CaO(liq) = Ca(g) + O(g)
-        JANAF 2nd ed. & supplements 2000-4500 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99998
-        AK12 = 10.0**BA = P(CAG)*P(OG)/P(CAOL)
-        HENCE P(CAOL) = 10.0**(-BA) * P(CAG) * P(OG)
-        '''
-        BA = 11.88 - 49586 /sim.T
-        self.ECAOL = 10.0**(-BA)
-        
-        '''
-        Ca(g) + 0.5 O2(g) = CaO(g)
-        AK14 = 10.0**BC = P(CAOG)/(P(CAG)*P(O2G)**0.5)
-        HENCE P(CAOG) = 10.0**BC * P(CAG) * P(O2G)**0.5
-        '''
-        BC = -1.61 + 6128 /sim.T
-        self.ECAOG = 10.0**BC
-
-        '''
-        ###### Aluminum ###### 
+        self._elGasNames = sim._elNames + ('O',)
+        self._n_el = np.zeros(len(self._elGasNames)) # see number_density
 
-        Al2O3(liq) = 2Al(g) + 3O(g)
-        JANAF supplements 1500-4000 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99995
-        AK15 = 10.0**CA = P(ALG)**2*P(OG)**3/P(AL2O3L)
-        HENCE P(AL2O3L) = 10.0**(-CA) * P(ALG)**2 * P(OG)**3
         '''
-        CA = 35.83 - 153255 /sim.T
-        self.EAL2O3L = 10.0**(-CA)
-    
-        '''
-        Al(liq) = Al(g)
-        AK16 = 10.0**CB = P(ALG)/P(ALL)
-        '''
-        CB = 5.70 - 15862 /sim.T
-        self.EALL = 10.0**(-CB)
-
-        '''
-        Al(liq) + 0.5 O2(g) = AlO(g)
-        FOR P(ALG) INSTEAD OF P(ALL)    CC2 = - 2.43 + 13067 /sim.T
-        AK17 = 10.0**CC = P(ALOG)/(P(ALL)*P(O2G)**0.5)
-        HENCE P(ALOG) = 10.0**(CC-CB) * P(ALG) * P(O2G)**0.5
-        '''
-        CC = 3.04 - 2143 /sim.T
-        self.EALOG = 10.0**(CC-CB)
-
-        '''
-        Al(liq) + O2(g) = AlO2(g)
-        FOR P(ALG) INSTEAD OF P(ALL)    CD2 = - 5.70 + 21159 /sim.T
-        AK18 = 10.0**CD = P(ALO2G)/(P(ALL)*P(O2G))
-        HENCE P(ALO2G) = 10.0**(CD-CB) * P(ALG) * P(O2G)
-        '''
-        CD = - 0.09 + 5.523 /sim.T
-        self.EALO2G = 10.0**(CD-CB)
-
-        '''
-        2Al(liq) + 0.5 O2(g) = Al2O(g)
-        FOR P(ALG) INSTEAD OF P(ALL)    CE2 = - 9.32 + 41897 /sim.T
-        AK19 = 10.0**CE = P(AL2OG)/P(ALL)**2 * P(O2G)**0.5
-        HENCE P(AL2OG) = 10.0**(CE-2.0D0*CB) * P(ALG)**2 * P(O2G)**0.5
-        '''
-        CE = 2.04 + 10232 /sim.T
-        self.EAL2OG = 10.0**(CE - 2.0 * CB)
-
-        '''
-        2Al(liq) + O2(g) = Al2O2(g)
-        FOR P(ALG) INSTEAD OF P(ALL)    CF2 = - 12.86 + 54600 /sim.T
-        AK20 = 10.0**CF = P(AL2O2G)/(P(ALL)**2 * P(O2G))
-        HENCE P(AL2O2G) = 10.0**(CF-2.0D0*CB) * P(ALG)**2 * PO2G
-        '''
-        CF = - 1.53 + 23021 /sim.T
-        self.EAL2O2G = 10.0**(CF - 2.0 * CB)
-
-        '''
-        ######sim.Titanium ######
-       sim.Ti(liq) + 0.5 O2(g) =sim.TiO(g)
-        FOR P(TIG) INSTEAD OF P(TIL)    DC2 = - 3.33 + 23747 /sim.T
-        AK22 = 10.0**DC = P(TIOG)/(P(TIL)*P(O2G)**0.5)
-        HENCE P(TIL) = 10.0**(-DC) * P(TIOG) / P(O2G)**0.5
-        '''
-        DC = 4.31 - 2101 /sim.T
-        self.ETIOG = 10.0**DC
-        
-        '''
-       sim.Ti(liq) =sim.Ti(g)
-        AK21 = 10.0**DB = P(TIG)/P(TIL)
-        '''
-        DB = 6.46 - 23025 /sim.T
-        self.ETIL = 10.0**(-DB)
-        
-        '''
-       sim.TiO2(liq) =sim.Ti(g) + 2O(g)
-        JANAF 2nd ed. & supplements 1500-4000 K every 500 degrees 
-        correlation coefficient for linear fit = -0.99998
-        AK20 = 10.0**DA = P(TIG)*P(OG)**2/P(TIO2L)
-        HENCE P(TIO2L) = 10.0**(-DA) * P(TIG) * P(OG)**2
-        '''
-        DA = 21.07 - 95362 /sim.T
-        self.ETIO2L = 10.0**(-DA)
-    
-        '''
-        Ti(liq) + O2(g) = TiO2(g)
-        FOR P(TIG) INSTEAD OF P(TIL)    DD2 = - 7.44 + 43028 /sim.T
-        AK23 = 10.0**DD = P(TIO2G)/(P(TIL)*P(O2G))
-        HENCE P(TIO2G) = 10.0**DD * P(TIL) * P(O2G)
+        Gas chemistry thermodynamic data: the equilibrium constants of the 
+        species ordered as the constants of _plan (see reactions.py), with
+        the temperatures along the first axis for an array of temperatures
         '''
-        DD = - 0.41 + 17926 /sim.T
-        self.ETIO2G = 10.0**DD
+        log10K = reactions.KVapor.log10(sim.T)[...,_plan.order]
+        self._K = 10**log10K
+        self._logK = np.log(10) * log10K
+        self._KValues = _unpack(self._K.T) # see melt_pressure_calculation
 
-        '''
-        ###### Sodium ###### 
-        2Na(g) + O(g) = Na2O(liq)
-        JANAF 2nd ed. & supplements
-        correlation coefficient for linear fit = 
-        '''
-        EA = - 15.56 + 40286/sim.T
-        self.ENA2OL = 10.0**EA
+        # Active set (see select_active): all the species
+        self._plan = _plan
+        self._KPlan = self._K
 
-        '''
-        Na(g) + O(g) = NaO(g)
-        '''
-        EB = - 1.43 + 1287/sim.T
-        self.ENAOG = 10.0**(EB-E)
+        # 'numpy' or 'numba' (fixed point iteration compiled, see kernels.py)
+        self.backend = kernels.resolve(backend)
+        self.stats = None # Optional stats.solver_stats collector
+        self.anderson = solvers.anderson(**(anderson or {}))
+        self._tried = 0 # Passes of the last failed solver
 
+    def select_active(self,sim):
         '''
-        2Na(g) = Na2(g)
+        Active set of the gas chemistry: the key gases of pressure 0 (their
+        element has left the melt, so that their adjustment factor is 0 and
+        their pressure stays 0) and the species made of them are left out of
+        melt_pressure_calculation (see reactions.pressure_plan), which gives
+        the same pressures as the full set for less work as the melt
+        simplifies.
         '''
-        EC = - 4.31 + 4281/sim.T
-        self.ENA2G = 10.0**EC
+        inactive = tuple(gas for gas, P in zip(sim._gasNames,\
+                         sim._presGas[:_nKey].tolist()) if P == 0)
+        if inactive != self._plan.inactive:
+            self._plan = _active_plan(inactive)
+            self._KPlan = np.where(self._plan.zero,0.,self._K)
 
-        '''
-        2Na(g) + O(g) = Na2O(g)
-        '''
-        ED = - 7.00 + 11898/sim.T
-        self.ENA2OG = 10.0**(ED-E)
-
-        '''
-        Na(g) = Na+(g) + e-(g)
-        '''
-        EE = 2.80 - 27851/sim.T
-        self.ENACAT = 10**EE
-        
-        '''
-        ####### Potassium ######
-        2K(g) + O(g) = K2O(liq)
-        '''
-        FA = - 15.33 + 36735/sim.T
-        self.EK2OL = 10.0**FA
-
-        '''
-        K(g) + O(g) = KO(g)
-        '''
-        FB = - 1.28 + 959/sim.T
-        self.EKOG = 10.0**(FB-E)
-
-        '''        
-        2K(g) = K2(g)
-        '''
-        FC = - 3.94 + 2852/sim.T
-        self.EK2G = 10.0**FC
-
-        '''
-        2K(g) + O(g) = K2O(g)
-        '''
-        FD = - 10.734 + 30817/sim.T
-        self.EK2OG = 10.0**(FD-E)
-
-        '''
-        K(g) = K+(g) + e-(g)
-        '''
-        FE = 2.76 - 23760/sim.T
-        self.EKCAT = 10**FE  
-
-        '''
-        ###### Thorium ######
-        Th(liq) + O2(g) = ThO2(liq)
-        '''
-        GA = - 9.55 + 63948/sim.T
-        self.ETHO2L = 10.0**GA
-
-        '''
-        Th(g) = Th(liq)
-        '''
-        GB = - 5.96 + 29600/sim.T
-        self.ETHL = 10.0**GB
-        
-        '''
-        Th(liq) + 0.5 O2(g) = ThO(g)
-        '''
-        GC = 2.75 + 3497/sim.T
-        self.ETHOG = 10.0**GC
-        
-        '''
-        Th(liq) + O2(g) = ThO2(g)
-        '''
-        GD = - 1.58 + 28875/sim.T
-        self.ETHO2G = 10.0**GD
-
-        '''
-        ###### Uranium ######
-        U(liq) + O2(g) = UO2(liq)
-        '''
-        HA = - 26.91 + 204359/sim.T
-        self.EUO2L = 10.0**HA
-        
-        '''
-        U(g) = U(liq)
-        '''
-        HB = - 5.75 + 25470/sim.T
-        self.EUL = 10.0**HB
-       
-        '''
-        U(liq) + 0.5 O2(g) = UO(g)
-        '''
-        HC = 3.02 + 1705/sim.T
-        self.EUOG = 10.0**HC
-
-        '''
-        U(liq) + O2(g) = UO2(g)
-        '''
-        HD = - 1.19 + 26554/sim.T
-        self.EUO2G = 10.0**HD
-
-        '''
-        U(liq) + 1.5 O2(g) = UO3(g)
-        '''
-        HE = - 4.24 +43710/sim.T
-        self.EUO3G = 10.0**HE
-
-        '''
-        ###### Plutonium #####
-        Pu(liq) + O2(g) = PuO2(liq)
-        '''
-        QA = - 29.86 + 200903/sim.T
-        self.EPUO2L = 10.0**QA
-       
-        '''
-        Pu(g) = Pu(liq)
-        '''
-        QB = - 4.79 + 17316/sim.T
-        self.EPUL = 10.0**QB
-       
-        '''
-        Pu(liq) + 0.5 O2(g) = PuO(g)
-        '''
-        QC = 2.40 + 6875/sim.T
-        self.EPUOG = 10.0**QC
-        
-        '''
-        Pu(liq) + O2(g) = PuO2(g)
-        '''
-        QD = - 1.76 + 25984/sim.T
-        self.EPUO2G = 10.0**QD
+    @property
+    def n_el(self):
+        ''' Number densities of the elements in the gas by name (read only) '''
+        return dict(zip(self._elGasNames,self._n_el.tolist()))
 
     def melt_pressure_calculation(self,sim):
         '''
         Here the partial pressures of the oxides in the melt are calculated
         using the partial pressure of of the component gases and the melt
-        vapor reaction. 
-        '''
-        ''' Si '''
-        sim.presLiq['SiO2'] = self.ESIO2L * sim.presGas['SiO'] * sim.presGas['O2']**0.5
-        sim.presLiq['Si']   = self.ESIL * sim.presGas['SiO'] * sim.presGas['O2']**(-0.5) 
-        sim.presGas['Si']   = self.ESIG * sim.presLiq['Si'] 
-        sim.presGas['O']    = self.EOG * sim.presGas['O2']**0.5
-        # print(sim.presGas['O'])
-        sim.presGas['SiO2'] = self.ESIO2G * sim.presLiq['Si'] * sim.presGas['O2']
-      
-        ''' Mg '''
-        sim.presGas['Mg'] = self.EMGG * sim.presGas['MgO'] * sim.presGas['O2']**(-0.5)
-        sim.presLiq['MgO'] = self.EMGOL *sim.presGas['Mg'] * sim.presGas['O']
-
-        ''' Fe '''
-        sim.presLiq['FeO'] = self.EFEOL * sim.presGas['Fe'] * sim.presGas['O']
-        sim.presLiq['Fe']  = self.EFEL * sim.presGas['Fe']
-        sim.presGas['FeO'] = self.EFEOG * sim.presGas['Fe'] * sim.presGas['O2']**0.5
-        sim.presLiq['Fe2O3'] = self.EFE2O3L * sim.presGas['Fe']**2 * sim.presGas['O2']**1.5
-        sim.presLiq['Fe3O4'] = self.EFE3O4L * sim.presGas['Fe']**3 * sim.presGas['O2']**2
-
-        ''' Ca '''
-        sim.presLiq['CaO'] = self.ECAOL * sim.presGas['Ca'] * sim.presGas['O']
-        sim.presGas['CaO'] = self.ECAOG * sim.presGas['Ca'] * sim.presGas['O2']**0.5
-
-        ''' Al '''
-        sim.presLiq['Al2O3'] = self.EAL2O3L * sim.presGas['Al']**2 * sim.presGas['O']**3
-        sim.presLiq['Al']    = self.EALL * sim.presGas['Al'] 
-        sim.presGas['AlO']   = self.EALOG * sim.presGas['Al'] * sim.presGas['O2']**0.5
-        sim.presGas['AlO2']  = self.EALO2G * sim.presGas['Al'] * sim.presGas['O2']
-        sim.presGas['Al2O']  = self.EAL2OG * sim.presGas['Al']**2 * sim.presGas['O2']**0.5
-        sim.presGas['Al2O2'] = self.EAL2O2G * sim.presGas['Al']**2 * sim.presGas['O2']
-
-        ''' Ti ''' 
-        sim.presLiq['Ti']   = self.ETIL * sim.presGas['Ti']
-        sim.presGas['TiO']  = self.ETIOG * sim.presLiq['Ti'] * sim.presGas['O2']**0.5
-        sim.presLiq['TiO2'] = self.ETIO2L * sim.presGas['Ti'] * sim.presGas['O']**2
-        sim.presGas['TiO2'] = self.ETIO2G * sim.presLiq['Ti'] * sim.presGas['O2'] 
-
-        ''' Na '''
-        sim.presLiq['Na2O'] = self.ENA2OL * sim.presGas['Na']**2 * sim.presGas['O']
-        sim.presGas['NaO']  = self.ENAOG * sim.presGas['Na'] * sim.presGas['O']
-        sim.presGas['Na2']  = self.ENA2G * sim.presGas['Na']**2
-        sim.presGas['Na2O'] = self.ENA2OG * sim.presGas['Na']**2 * sim.presGas['O']
-
-        ''' K '''
-        sim.presLiq['K2O'] = self.EK2OL * sim.presGas['K']**2 * sim.presGas['O']
-        sim.presGas['KO'] = self.EKOG * sim.presGas['K'] * sim.presGas['O']
-        sim.presGas['K2'] = self.EK2G * sim.presGas['K']**2
-        sim.presGas['K2O'] = self.EK2OG * sim.presGas['K']**2 * sim.presGas['O']
-
-        '''
-        Ion chemistry:
-        PENEG = P(e-,g), sim.presGas['NaCat'] = P(Na+,g), sim.presGas['KCat'] = P(K+,g)
-        PENEG = sim.presGas['NaCat'] + sim.presGas['KCat']; 
-        HENCE PENEG = DSQRT((sim.presGas['NaCat'] + PKCAT)*PENEG)
-        '''
-        # Energetic electron gas (???)
-        sim.presGas['EnE'] = np.sqrt(self.ENACAT*sim.presGas['Na'] + self.EKCAT*sim.presGas['K'])
-
-        if sim.presGas['Na'] != 0:
-            sim.presGas['NaCat'] = self.ENACAT * sim.presGas['Na']/sim.presGas['EnE']
-        else:
-            sim.presGas['NaCat'] = 0
-
-        if sim.presGas['K'] != 0:
-            sim.presGas['KCat'] = self.EKCAT * sim.presGas['K']/sim.presGas['EnE']
-        else: 
-            sim.presGas['KCat'] = 0
+        vapor reaction: every gas and liquid species is a constant times 
+        powers of the key gas pressures (see data/vapor_species.csv), 
+        evaluated by the function generated for the plan of the active set
+        (see select_active). The pressure of the
+        electron gas balances the cations, P(e-) = sqrt(sum of the cations).
+        '''
+        # Ordered as sim._presGasNames and sim._presLiqNames (the constants
+        # of a batch restricted to some members are taken from _K)
+        K = self._KValues if self._K.ndim == 1 else self._K.T
+        self._plan.pressures(_unpack(sim._presGas[:_nKey]),K,\
+                             sim._presGas[_nKey:],sim._presLiq)
 
     def number_density(self,sim):
-
-        ''' Calculating for each species ''' 
-        self.n = {}
-        for gas in sim.presGas:
-            self.n[gas] = self._pConv * sim.presGas[gas] / sim.T
-
-        # # TODO find suitable names for these species
-        # self.CENEG  = self._pConv * sim.presGas['EnE']  / sim.T
-        # self.CNACAT = self._pConv * sim.presGas['NaCat'] / sim.T
-        # self.CKCAT  = self._pConv * sim.presGas['KCat']  / sim.T
-
-        ''' Calculating for each element ''' 
-        self.n_el = {}
-        self.n_el['Si'] = self.n['Si'] + self.n['SiO'] + self.n['SiO2']
-        self.n_el['O']  = 2 * (self.n['O2'] + self.n['SiO2'] + self.n['AlO2'] + \
-                                 self.n['Al2O2'] + self.n['TiO2']) + \
-                            self.n['SiO'] + self.n['O'] + self.n['MgO'] + \
-                            self.n['FeO'] + self.n['CaO'] + self.n['AlO'] + \
-                            self.n['Al2O'] + self.n['TiO'] + self.n['NaO'] + \
-                            self.n['Na2O'] + self.n['KO'] + self.n['K2O'] 
-        self.n_el['Mg'] = self.n['MgO'] + self.n['Mg']
-        self.n_el['Fe'] = self.n['FeO'] + self.n['Fe']
-        self.n_el['Ca'] = self.n['CaO'] + self.n['Ca']
-        self.n_el['Al'] = self.n['AlO'] + self.n['Al'] + self.n['AlO2'] + \
-                            2 * (self.n['Al2O'] + self.n['Al2O2'])
-        self.n_el['Ti'] = self.n['TiO'] + self.n['Ti'] + self.n['TiO2']
-        self.n_el['Na'] = self.n['NaO'] + self.n['Na'] + self.n['NaCat'] + \
-                            2 * (self.n['Na2'] + self.n['Na2O'])
-        self.n_el['K']  = self.n['KO'] + self.n['K'] + self.n['KCat'] + \
-                            2 * (self.n['K2O'] + self.n['K2'])
+        '''
+        Number densities of the elements in the gas (_n_el, ordered as 
+        sim._elNames followed by O), summed over the gases with _gasAtoms
+        '''
+        self._n_el = _gasAtoms @ sim._presGas * (self._pConv / sim.T)
 
         ''' 
         Calculating the ratio of the number density of O in oxide gases to tot O
         number density
         '''
-        self.oxideO_ratio = (self.n_el['Mg'] + self.n_el['Fe'] + self.n_el['Ca'] + \
-                            2 * (self.n_el['Si'] + self.n_el['Ti']) + \
-                            1.5 * (self.n_el['Al']) +  \
-                            0.5 * (self.n_el['Na'] + self.n_el['K'])) / self.n_el['O']
-        # print(self.n_el)
+        self.oxideO_ratio = _oxideO @ self._n_el[:-1] / self._n_el[-1]
 
     def recompute_adjFact(self,sim):
         '''
@@ -516,132 +165,202 @@ class vapor_pressure():
         normally SiO2.  Once SiO2 is completely vaporized, AO2G is computed 
         from the remaining species in the melt, in order of volatility.
         '''
+        # Activities (ordered as sim._oxideNames) and liquid pressures of the
+        # oxides
+        SiO2, MgO, Al2O3, TiO2, Fe2O3, FeO, CaO, Na2O, K2O = sim._act_ox.tolist()
+        SiO2L, MgOL, Al2O3L, TiO2L, Fe2O3L, FeOL, CaOL, Na2OL, K2OL = \
+            sim._presLiq[:len(sim._oxideNames)].tolist()
+        adjFact = self.adjFact
 
         # SiO
-        if all(val != 0 for val in [sim.presLiq['SiO2'],sim.act_ox['SiO2']]):
-            self.adjFact['SiO'] = 1 / (self.oxideO_ratio * (sim.presLiq['SiO2']\
-                             / sim.act_ox['SiO2'])**0.5)
-        elif sim.act_ox['SiO2'] == 0:
-            self.adjFact['SiO'] = 0
+        if SiO2L != 0 and SiO2 != 0:
+            adjFact['SiO'] = 1 / (self.oxideO_ratio * (SiO2L / SiO2)**0.5)
+        elif SiO2 == 0:
+            adjFact['SiO'] = 0
         else:
-            self.adjFact['SiO'] = 1
+            adjFact['SiO'] = 1
 
         # MgO
-        if sim.presLiq['MgO'] != 0:
-            self.adjFact['MgO'] = sim.act_ox['MgO'] / sim.presLiq['MgO'] 
+        if MgOL != 0:
+            adjFact['MgO'] = MgO / MgOL 
 
         # Fe
-        if sim.presLiq['FeO'] != 0 or sim.presLiq['Fe2O3'] != 0:
-            self.adjFact['Fe'] = (sim.act_ox['FeO'] + sim.act_ox['Fe2O3'])\
-                            / (sim.presLiq['FeO'] + sim.presLiq['Fe2O3'])
-        elif sim.act_ox['FeO'] == 0:
-            self.adjFact['Fe'] = 0
+        if FeOL != 0 or Fe2O3L != 0:
+            adjFact['Fe'] = (FeO + Fe2O3) / (FeOL + Fe2O3L)
+        elif FeO == 0:
+            adjFact['Fe'] = 0
         else:
-            self.adjFact['Fe'] = 1
+            adjFact['Fe'] = 1
 
         # Ca 
-        if all(val != 0 for val in [sim.presLiq['CaO'],sim.act_ox['CaO']]):
-            self.adjFact['Ca'] = (sim.act_ox['CaO'] / sim.presLiq['CaO'])**0.5
-        elif sim.act_ox['CaO'] == 0:
-            self.adjFact['Ca'] = 0
+        if CaOL != 0 and CaO != 0:
+            adjFact['Ca'] = (CaO / CaOL)**0.5
+        elif CaO == 0:
+            adjFact['Ca'] = 0
         else:
-            self.adjFact['Ca'] = 1
+            adjFact['Ca'] = 1
 
         # Al
-        if all(val != 0 for val in [sim.presLiq['Al2O3'],sim.act_ox['Al2O3']]):
-            self.adjFact['Al'] = (sim.act_ox['Al2O3'] / sim.presLiq['Al2O3'])**0.5
-        elif sim.act_ox['Al2O3'] == 0:
-            self.adjFact['Al'] = 0
+        if Al2O3L != 0 and Al2O3 != 0:
+            adjFact['Al'] = (Al2O3 / Al2O3L)**0.5
+        elif Al2O3 == 0:
+            adjFact['Al'] = 0
         else:
-            self.adjFact['Al'] = 1
+            adjFact['Al'] = 1
 
         # Ti
-        if all(val != 0 for val in [sim.presLiq['TiO2'],sim.act_ox['TiO2']]):
-            self.adjFact['Ti'] = (sim.act_ox['TiO2'] / sim.presLiq['TiO2'])**0.5
-        elif sim.act_ox['TiO2'] == 0:
-            self.adjFact['Ti'] = 0
+        if TiO2L != 0 and TiO2 != 0:
+            adjFact['Ti'] = (TiO2 / TiO2L)**0.5
+        elif TiO2 == 0:
+            adjFact['Ti'] = 0
         else:
-            self.adjFact['Ti'] = 1
+            adjFact['Ti'] = 1
 
         # Na
-        if all(val != 0 for val in [sim.presLiq['Na2O'],sim.act_ox['Na2O']]):
-            self.adjFact['Na'] = (sim.act_ox['Na2O'] / sim.presLiq['Na2O'])**0.5
-        elif sim.act_ox['Na2O'] == 0:
-            self.adjFact['Na'] = 0
+        if Na2OL != 0 and Na2O != 0:
+            adjFact['Na'] = (Na2O / Na2OL)**0.5
+        elif Na2O == 0:
+            adjFact['Na'] = 0
         else:
-            self.adjFact['Na'] = 1
+            adjFact['Na'] = 1
 
         # K
-        if all(val != 0 for val in [sim.presLiq['K2O'],sim.act_ox['K2O']]):
-            self.adjFact['K'] = (sim.act_ox['K2O']/sim.presLiq['K2O'])**0.5
-        elif sim.act_ox['K2O'] == 0:
-            self.adjFact['K'] = 0
+        if K2OL != 0 and K2O != 0:
+            adjFact['K'] = (K2O / K2OL)**0.5
+        elif K2O == 0:
+            adjFact['K'] = 0
         else:
-            self.adjFact['K'] = 1
+            adjFact['K'] = 1
 
         '''
         Adjustment factor for oxygen is governed by the most abundant volatile
         metal oxide present in the melt.
         TODO: THIS ASSUMES THAT THE ABUNDANCES ARE ALWAYS ORDEREDAS IN THIS IF STATEMENT
         '''
-        if sim.presLiq['SiO2'] != 0 and sim.act_ox['SiO2'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['SiO2']\
-                            / sim.presLiq['SiO2']
+        if SiO2L != 0 and SiO2 != 0:
+            adjFact['O2'] = self.oxideO_ratio * SiO2 / SiO2L
 
-        elif sim.act_ox['MgO'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['MgO']\
-                            / sim.presLiq['MgO']
+        elif MgO != 0:
+            adjFact['O2'] = self.oxideO_ratio * MgO / MgOL
 
-        elif sim.act_ox['FeO'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * (sim.act_ox['FeO']\
-                            + sim.act_ox['Fe2O3'])\
-                            / (sim.presLiq['FeO'] + sim.presLiq['Fe2O3'])
+        elif FeO != 0:
+            adjFact['O2'] = self.oxideO_ratio * (FeO + Fe2O3) / (FeOL + Fe2O3L)
 
-        elif sim.act_ox['CaO'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['CaO']\
-                            / sim.presLiq['CaO']
+        elif CaO != 0:
+            adjFact['O2'] = self.oxideO_ratio * CaO / CaOL
 
-        elif sim.act_ox['Al2O3'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['Al2O3']\
-                            / sim.presLiq['Al2O3']
+        elif Al2O3 != 0:
+            adjFact['O2'] = self.oxideO_ratio * Al2O3 / Al2O3L
 
-        elif sim.act_ox['TiO2'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['TiO2']\
-                            / sim.presLiq['TiO2']
+        elif TiO2 != 0:
+            adjFact['O2'] = self.oxideO_ratio * TiO2 / TiO2L
 
-        elif sim.act_ox['Na2O'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['Na2O']\
-                            / sim.presLiq['Na2O']
+        elif Na2O != 0:
+            adjFact['O2'] = self.oxideO_ratio * Na2O / Na2OL
 
-        elif sim.act_ox['K2O'] != 0:
-            self.adjFact['O2'] = self.oxideO_ratio * sim.act_ox['K2O']\
-                            / sim.presLiq['K2O']
+        elif K2O != 0:
+            adjFact['O2'] = self.oxideO_ratio * K2O / K2OL
         else:
-            self.adjFact['O2'] = 1             
+            adjFact['O2'] = 1             
+
+
+    def recompute_adjFact_array(self,sim):
+        '''
+        Same as recompute_adjFact for a batch of systems, where the pressures
+        and activities in sim have one column per system (see batch.py). 
+        '''
+        L = dict(zip(sim._presLiqNames,sim._presLiq))
+        A = dict(zip(sim._oxideNames,sim._act_ox))
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            def present(ox):
+                return (L[ox] != 0) & (A[ox] != 0)
 
+            def absent(ox):
+                return np.where(A[ox] == 0,0.,1.)
+
+            # SiO
+            self.adjFact['SiO'] = np.where(present('SiO2'),\
+                        1 / (self.oxideO_ratio * (L['SiO2'] / A['SiO2'])**0.5),\
+                        absent('SiO2'))
+
+            # MgO
+            self.adjFact['MgO'] = np.where(L['MgO'] != 0,A['MgO'] / L['MgO'],\
+                                           self.adjFact['MgO'])
+
+            # Fe
+            actFe = A['FeO'] + A['Fe2O3']
+            liqFe = L['FeO'] + L['Fe2O3']
+            self.adjFact['Fe'] = np.where((L['FeO'] != 0) | (L['Fe2O3'] != 0),\
+                                          actFe / liqFe,absent('FeO'))
+
+            # Ca, Al, Ti, Na, K
+            for gas, ox in (('Ca','CaO'),('Al','Al2O3'),('Ti','TiO2'),\
+                            ('Na','Na2O'),('K','K2O')):
+                self.adjFact[gas] = np.where(present(ox),(A[ox] / L[ox])**0.5,\
+                                             absent(ox))
+
+            # O2, governed by the most abundant volatile metal oxide
+            self.adjFact['O2'] = np.select(
+                [present('SiO2'), A['MgO'] != 0, A['FeO'] != 0, A['CaO'] != 0,\
+                 A['Al2O3'] != 0, A['TiO2'] != 0, A['Na2O'] != 0, A['K2O'] != 0],
+                [self.oxideO_ratio * A[ox] / L[ox] if ox != 'FeO' else \
+                 self.oxideO_ratio * actFe / liqFe for ox in \
+                 ('SiO2','MgO','FeO','CaO','Al2O3','TiO2','Na2O','K2O')],
+                1.)
 
     # end number_density()
 
-    def vapor_pressure_calculation(self,sim):
+    def adjFact_converged(self):
+        ''' True if all adjustment factors are within dif_range of 1 (or 0) '''
+        return all(1-self.dif_range < fact < 1+self.dif_range or fact == 0 \
+                   for fact in self.adjFact.values())
 
-        iit = 0
-        self.dif_range = 2.30359e-6 # Max amount that the adjFact can difer from 1
+    def residual(self):
+        ''' Largest |ln(adjFact)| of the adjustment factors other than 0 '''
+        return max((abs(np.log(fact)) for fact in self.adjFact.values() \
+                    if fact != 0),default=0.)
 
-        while not all( 1-self.dif_range < fact < 1+self.dif_range or fact == 0 \
-                   for fact in list(self.adjFact.values())) or iit == 0:
+    def pressure_pass(self,sim):
+        '''
+        One pass of the gas chemistry: adjusts the key gas pressures by their
+        adjustment factors and recomputes all pressures, number densities and 
+        the new adjustment factors.
+        '''
+        # Adjust gas pressure according to adjustment factor (adjFact is 
+        # ordered as sim._gasNames)
+        sim._presGas[:len(self.adjFact)] *= list(self.adjFact.values())
 
-            # Adjust gas pressure according to adjustment factor
-            sim.presGas = {gas : sim.presGas[gas]*self.adjFact[gas]\
-                            for gas in sim._gasNames}
+        # Calculate melt pressure using gas pressures
+        self.melt_pressure_calculation(sim)
 
-            # Calculate melt pressure using gas pressures
-            self.melt_pressure_calculation(sim)
+        # Calculate the number densities (TODO: this could go into vapor removal (?))
+        self.number_density(sim)
 
-            # Calculate the number densities (TODO: this could go into vapor removal (?))
-            self.number_density(sim)
+        # Recompute the adjustment factors using the new partial pressures
+        self.recompute_adjFact(sim)
 
-            # Recompute the adjustment factors using the new partial pressures
-            self.recompute_adjFact(sim)
+    def fixed_point_pressures(self,sim):
+        ''' 
+        Multiplies the key pressures by their adjustment factors until all of
+        them are ~1. Returns the number of passes.
+        '''
+        if self.backend == 'numba':
+            adjFact = np.array(list(self.adjFact.values()),dtype=float)
+            iit, self._n_el, self.oxideO_ratio = kernels.vapor_fixed_point(\
+                sim._presGas,sim._presLiq,sim._act_ox,self._KPlan,\
+                self._plan.ops,self._plan.pows,self._plan.nodes,_plan.nGas,\
+                _plan.nIon,adjFact,_gasAtoms,_oxideO,self._pConv / sim.T,\
+                self.dif_range,int(1e8))
+            self.adjFact = dict(zip(sim._gasNames,adjFact.tolist()))
+            if iit >= 1e8:
+                raise RuntimeError('Max recursion limit reached while calculating adjustment factors.')
+            return iit
+
+        iit = 0
+        while not self.adjFact_converged() or iit == 0:
+
+            self.pressure_pass(sim)
             
             ''' While loop break '''
             iit += 1 # updating counter
@@ -649,5 +368,313 @@ class vapor_pressure():
                 raise RuntimeError('Max recursion limit reached while calculating adjustment factors.')
 
         # end while loop
+        return iit
+
+    def key_residual(self,sim,gases,logP):
+        '''
+        Residual of the gas chemistry for the key pressures exp(logP) of the 
+        given gases: log(adjFact) of those gases.
+        '''
+        sim._presGas[[sim._gasNames.index(gas) for gas in gases]] = np.exp(logP)
+        self.melt_pressure_calculation(sim)
+        self.number_density(sim)
+        self.recompute_adjFact(sim)
+        return np.log([self.adjFact[gas] for gas in gases])
+
+    def key_jacobian(self,sim,gases,logP,res,h=1e-6):
+        ''' Forward difference Jacobian of key_residual in log pressure '''
+        jac = np.empty((len(gases),len(gases)))
+        for k in range(len(gases)):
+            logP_h = logP.copy()
+            logP_h[k] += h
+            jac[:,k] = (self.key_residual(sim,gases,logP_h) - res) / h
+        return jac
+
+    def _save(self,sim):
+        ''' Copy of the pressures and adjustment factors of sim and self '''
+        return sim._presGas.copy(), sim._presLiq.copy(), dict(self.adjFact), \
+               self._n_el.copy(), getattr(self,'oxideO_ratio',None)
+
+    def _load(self,sim,state):
+        ''' Restores the pressures and adjustment factors saved by _save '''
+        presGas, presLiq, adjFact, n_el, oxideO_ratio = state
+        sim._presGas[:] = presGas
+        sim._presLiq[:] = presLiq
+        self.adjFact = adjFact
+        self._n_el = n_el
+        if oxideO_ratio is not None:
+            self.oxideO_ratio = oxideO_ratio
+
+    def _failed(self,passes):
+        ''' Keeps the passes of a failed solver (see _tried) '''
+        self._tried = passes
+        return None
+
+    def quasi_newton_pressures(self,sim,method,maxPass=200,maxStep=2.):
+        '''
+        Solves log(adjFact) = 0 for the log key pressures of the gases present
+        in the vapor. 'newton' takes chord steps with a finite difference 
+        Jacobian, recomputed only when the residual falls by less than a 
+        factor 10 in a step, 'broyden' updates it with rank one (Broyden) updates. Both
+        keep the Jacobian between calls, so a warm start usually needs 1-3 
+        passes. The first pass and the convergence test are those of the 
+        fixed point.
+        Returns the number of passes, or None if the iteration fails.
+        '''
+        self.pressure_pass(sim)
+        passes = 1
+        if self.adjFact_converged():
+            return passes
+
+        gases = tuple(gas for gas in sim._gasNames \
+                      if sim.presGas[gas] != 0 and self.adjFact[gas] != 0)
+        with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+            logP = np.log([sim.presGas[gas] for gas in gases])
+            res = np.log([self.adjFact[gas] for gas in gases])
+
+            if self._jacGases == gases:
+                jac = self._jac
+            else:
+                jac = self.key_jacobian(sim,gases,logP,res)
+                passes += len(gases)
+            fresh = method == 'newton' or jac is not self._jac
+
+            while passes < maxPass:
+                try:
+                    step = np.linalg.solve(jac,-res)
+                except np.linalg.LinAlgError:
+                    return self._failed(passes)
+                if not np.all(np.isfinite(step)):
+                    return self._failed(passes)
+                step *= min(1.,maxStep/np.abs(step).max())
+
+                resNew = self.key_residual(sim,gases,logP + step)
+                passes += 1
+                if self.adjFact_converged():
+                    break
+                if not np.all(np.isfinite(resNew)):
+                    return self._failed(passes)
+
+                if method == 'newton':
+                    # Chord steps while the residual falls tenfold
+                    if np.abs(resNew).max() > 0.1 * np.abs(res).max():
+                        jac = self.key_jacobian(sim,gases,logP + step,resNew)
+                        passes += len(gases)
+                elif np.abs(resNew).max() > np.abs(res).max() and not fresh:
+                    # Restart from a finite difference Jacobian
+                    jac = self.key_jacobian(sim,gases,logP + step,resNew)
+                    passes += len(gases)
+                    fresh = True
+                else:
+                    # Broyden's (good) update
+                    jac = jac + np.outer(resNew - res - jac @ step,step)\
+                                / (step @ step)
+                    fresh = False
+                logP += step
+                res = resNew
+            else:
+                return self._failed(passes)
+
+        self._jac, self._jacGases = jac, gases
+        return passes
+
+    def anderson_pressures(self,sim,maxPass=10000):
+        '''
+        Anderson accelerated fixed point iteration (self.anderson, see
+        solvers.anderson) of log P -> log(P adjFact) for the key pressures of
+        the gases present in the vapor, with the convergence test of 
+        fixed_point_pressures. Returns the number of passes, or None if the
+        iteration fails.
+        '''
+        self.pressure_pass(sim)
+        passes = 1
+        if self.adjFact_converged():
+            return passes
+
+        # Key gases present in the vapor (adjFact is ordered as sim._gasNames)
+        adjFact = np.array(list(self.adjFact.values()),dtype=float)
+        key = np.flatnonzero((sim._presGas[:adjFact.size] != 0) & (adjFact != 0))
+        self.anderson.start()
+        with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+            logP = np.log(sim._presGas[key])
+            res = np.log(adjFact[key])
+            while passes < maxPass:
+                logP = self.anderson.step(logP,logP + res)
+                sim._presGas[key] = np.exp(logP)
+                self.melt_pressure_calculation(sim)
+                self.number_density(sim)
+                self.recompute_adjFact(sim)
+                passes += 1
+                if self.adjFact_converged():
+                    return passes
+                res = np.log(np.array(list(self.adjFact.values()))[key])
+                if not np.all(np.isfinite(res)):
+                    return self._failed(passes)
+
+        return self._failed(passes)
+
+    def log_pressures(self,logKey):
+        '''
+        melt_pressure_calculation in log space: the log pressures of the 
+        gases after the key gases (ordered as sim._presGasNames) and of the
+        liquid species for the log key pressures logKey
+        '''
+        logKey = np.maximum(logKey,_logZero)
+        logP = self._logK + _plan.powers @ logKey
+
+        # Ions, P(e-) = sqrt(sum of the cations)
+        logIon = logP[_ion]
+        logEnE = 0.5 * np.logaddexp.reduce(logIon)
+        return np.concatenate((logP[_gas],[logEnE],logIon - logEnE)), \
+               logP[_liq]
+
+    def log_adjFact(self,logLiq,logAct,logRatio,logAdj):
+        '''
+        recompute_adjFact in log space: the log adjustment factors (-inf for
+        a factor 0, ordered as sim._gasNames) from the log liquid pressures,
+        log oxide activities and log oxideO_ratio. logAdj holds the previous
+        factors.
+        '''
+        SiO2, MgO, Al2O3, TiO2, Fe2O3, FeO, CaO, Na2O, K2O = logAct.tolist()
+        SiO2L, MgOL, Al2O3L, TiO2L, Fe2O3L, FeOL, CaOL, Na2OL, K2OL = \
+            logLiq[:9].tolist()
+
+        def present(logVal):
+            return logVal > 0.5 * _logZero
+
+        def adjust(act,liq):
+            if present(liq) and present(act):
+                return 0.5 * (act - liq)
+            elif not present(act):
+                return -np.inf
+            return 0.
+
+        # SiO
+        if present(SiO2L) and present(SiO2):
+            SiO = -logRatio - 0.5 * (SiO2L - SiO2)
+        elif not present(SiO2):
+            SiO = -np.inf
+        else:
+            SiO = 0.
+
+        # MgO (unchanged without MgO in the melt)
+        MgOAdj = MgO - MgOL if present(MgOL) else float(logAdj[2])
+
+        # Fe
+        FeTot, FeTotL = np.logaddexp(FeO,Fe2O3), np.logaddexp(FeOL,Fe2O3L)
+        if present(FeOL) or present(Fe2O3L):
+            Fe = FeTot - FeTotL
+        elif not present(FeO):
+            Fe = -np.inf
+        else:
+            Fe = 0.
+
+        # O2, governed by the most abundant volatile metal oxide
+        if present(SiO2L) and present(SiO2):
+            O2 = logRatio + SiO2 - SiO2L
+        else:
+            O2 = logRatio
+            for ox, act, liq in [(MgO,MgO,MgOL),(FeO,FeTot,FeTotL),\
+                                 (CaO,CaO,CaOL),(Al2O3,Al2O3,Al2O3L),\
+                                 (TiO2,TiO2,TiO2L),(Na2O,Na2O,Na2OL),\
+                                 (K2O,K2O,K2OL)]:
+                if present(ox):
+                    O2 += act - liq
+                    break
+            else:
+                O2 = 0.
+
+        return np.array([SiO,O2,MgOAdj,Fe,adjust(CaO,CaOL),\
+                         adjust(Al2O3,Al2O3L),adjust(TiO2,TiO2L),\
+                         adjust(Na2O,Na2OL),adjust(K2O,K2OL)])
+
+    def log_fixed_point_pressures(self,sim):
+        '''
+        fixed_point_pressures in log space: adds the log adjustment factors
+        to the log key pressures until all of them are ~0, with the pressures
+        computed by log_pressures and the factors by log_adjFact. Pressures
+        too small for a float stay finite during the iteration; it takes the
+        passes of fixed_point_pressures, each costing more.
+        Returns the number of passes.
+        '''
+        nKey = len(sim._gasNames)
+        nConv = self._pConv / sim.T
+        lo, hi = np.log(1-self.dif_range), np.log(1+self.dif_range)
+        with np.errstate(divide='ignore'):
+            logKey = np.log(sim._presGas[:nKey])
+            logAct = np.log(sim._act_ox)
+            logAdj = np.log(np.array(list(self.adjFact.values()),dtype=float))
+
+        iit = 0
+        while True:
+
+            logKey = logKey + logAdj
+            logGas, logLiq = self.log_pressures(logKey)
+            P = np.exp(np.concatenate((np.maximum(logKey,_logZero),logGas)))
+            self._n_el = _gasAtoms @ P * nConv
+            self.oxideO_ratio = _oxideO @ self._n_el[:-1] / self._n_el[-1]
+            logAdj = self.log_adjFact(logLiq,logAct,np.log(self.oxideO_ratio),\
+                                      logAdj)
+
+            iit += 1 # updating counter
+            if np.all(((lo < logAdj) & (logAdj < hi)) | (logAdj == -np.inf)):
+                break
+            if iit >= 1e8:
+                raise RuntimeError('Max recursion limit reached while calculating adjustment factors.')
+
+        sim._presGas[:] = P
+        sim._presLiq[:] = np.exp(logLiq)
+        self.adjFact = dict(zip(sim._gasNames,np.exp(logAdj).tolist()))
+        return iit
+
+    def vapor_pressure_calculation(self,sim,method='fixed_point',addF2O3=False):
+        '''
+        Solves for the key gas pressures for which the gas chemistry agrees
+        with the oxide activities in the melt (all adjustment factors ~1).
+
+        method: 'fixed_point' (multiply by the adjustment factors), 'newton' 
+        or 'broyden' (quasi-Newton in log key pressure), 'anderson' 
+        (Anderson accelerated fixed point), the three falling back to 
+        fixed_point if they fail, or 'log' (fixed_point in log space)
+
+        addF2O3: the melt has F2O3 added (only names the stats stage)
+
+        Returns the number of pressure passes (melt_pressure_calculation + 
+        number_density, with those of a failed solver), which is also kept 
+        in self.iterations
+        '''
+        if method not in ('fixed_point','newton','broyden','anderson','log'):
+            raise ValueError(f'Unknown vapor pressure solver: {method}')
+        if self.stats is not None:
+            start = self.stats.clock()
+        self.select_active(sim)
+
+        passes = None
+        fallback = None # Passes of a failed solver
+        if method == 'log':
+            passes = self.log_fixed_point_pressures(sim)
+        elif method != 'fixed_point':
+            before = self._save(sim)
+            if method == 'anderson':
+                passes = self.anderson_pressures(sim)
+            else:
+                passes = self.quasi_newton_pressures(sim,method)
+                if passes is None:
+                    self._jacGases = None
+            if passes is None:
+                # The fixed point starts again from the pressures before 
+                # the failed iteration
+                self._load(sim,before)
+                fallback, method = self._tried, 'fixed_point'
+        if passes is None:
+            passes = self.fixed_point_pressures(sim)
+        self.iterations = passes + (fallback or 0)
+
+        if self.stats is not None:
+            self.stats.record('vapor_F2O3' if addF2O3 else 'vapor',method,\
+                              passes,self.residual(),\
+                              self.stats.clock() - start,fallback)
+
+        return self.iterations
     
-    # end vapor_pressure_calculation()
\ No newline at end of file
+    # end vapor_pressure_calculation()
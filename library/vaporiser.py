@@ -1,89 +1,524 @@
+# Standard libraries
+import copy
+import functools
+import numpy as np
 
-def vaporise(sim,vapor):
+def equilibrium(sim,melt,vapor,meltSolver='fixed_point',vaporSolver='fixed_point',\
+                coupled=False,tol=1e-3,maxRounds=50):
+    '''
+    Solves the melt-vapor equilibrium of the current composition: the oxide
+    activities and partial pressures, repeated with F2O3 added.
 
-    # Calculate gas pressure for each element
-    tot_gasPres = {}
-    for name_el in sim.abEl:
-        tot_gasPres[name_el] = 0
-        # Selects al gasses that contain the relevant element
-        for name_gas in sim.presGas:
-            if name_el in name_gas:
-                tot_gasPres[name_el] += sim.presGas[name_gas]
+    coupled: instead of the two passes, solve with F2O3 from the start, its
+    activity (presLiq['Fe2O3'], estimated by the gas chemistry) being one
+    more unknown: the activities and pressures are solved again until the 
+    estimate changes by less than tol (relative). The estimate of the last
+    equilibrium seeds the next one, so that one round usually suffices
+    (the first equilibrium of a run is seeded by the pass without F2O3).
+    The coupled state agrees with the two passes to the tolerances of the
+    solvers.
 
-    # Added seperatly due to absence from original abundance list
-    tot_gasPres['O'] = sim.presGas['O'] + sim.presGas['O2']  
-    tot_gasPres['EnE'] = sim.presGas['EnE'].copy() 
-    sim.totPres = sum(tot_gasPres.values()) 
+    coupled='global': the activity coefficients and key pressures are solved
+    at once (see global_equilibrium), falling back to coupled=True if that
+    fails.
+
+    Returns the numbers of melt activity iterations and vapor pressure passes.
+    '''
+    meltIt = 0
+    vaporIt = 0
+
+    # Calculating activities and partial pressures
+    if not coupled or not sim._act_ox.any():
+        meltIt += melt.melt_activity_calculation(sim,method=meltSolver)
+        vaporIt += vapor.vapor_pressure_calculation(sim,method=vaporSolver)
+
+    if coupled == 'global':
+        its = global_equilibrium(sim,melt,vapor)
+        if its is not None:
+            return meltIt + its, vaporIt + its
+
+    # Reapeating calculations by adding F2O3 (presLiq starts with the oxides)
+    iFe2O3 = sim._oxideNames.index('Fe2O3')
+    for _ in range(maxRounds if coupled else 1):
+        Fe2O3 = sim._presLiq[iFe2O3]
+        meltIt += melt.melt_activity_calculation(sim,addF2O3=True,\
+                                                 method=meltSolver)
+        vaporIt += vapor.vapor_pressure_calculation(sim,method=vaporSolver,\
+                                                    addF2O3=True)
+        if abs(sim._presLiq[iFe2O3] - Fe2O3) <= tol * sim._presLiq[iFe2O3]:
+            break
+
+    return meltIt, vaporIt
+
+def global_equilibrium(sim,melt,vapor,maxPass=200,maxStep=2.,h=1e-6):
+    '''
+    Solves the melt-vapor equilibrium with F2O3 as one nonlinear system 
+    instead of alternating the melt and vapor solvers: the unknowns are the
+    log activity coefficients of the oxides taking part in the equilibrium 
+    and the log key pressures of the gases present, and the residual stacks
+    the IMCC mass balance of the melt (log(SUM_i / F_i), see 
+    melt.newton_gamma, with F_Fe2O3 = presLiq['Fe2O3'] of the current
+    pressures) and log(adjFact) of the gases. 
+
+    Quasi-Newton iteration from the current state (the last equilibrium): a
+    forward difference Jacobian, Broyden updates and a fresh Jacobian when 
+    the residual grows, steps limited to maxStep in every component. The 
+    Jacobian is kept between calls (in vapor) while the oxides and gases 
+    stay the same, so that a warm start usually needs 2-3 evaluations.
+    Converged when the melt meets the tolerance of fixed_point_gamma and the
+    adjustment factors that of the fixed point pressures.
+
+    Every evaluation of the residual is one melt iteration and one pressure
+    pass, their number is returned (or None, the state being left as it was,
+    if the iteration fails).
+    '''
+    if vapor.stats is not None:
+        clock = vapor.stats.clock()
+    start = _state(sim,melt,vapor)
+    iFeO = sim._oxideNames.index('FeO')
+    iFe2O3 = sim._oxideNames.index('Fe2O3')
+    tol = 1e-5 * np.log(10)
+
+    # Oxides taking part in the equilibrium (Fe2O3 with FeO)
+    fAb = sim._fAbOx[sim._oxEl]
+    fAb[iFe2O3] = sim._presLiq[iFe2O3]
+    on = fAb != 0
+    on[iFe2O3] = on[iFeO]
+    melt.select_active(~on)
+    nOn = int(on.sum())
+    gamma = np.where(on,sim._gamma,0)
+
+    # Gases present: those of an element that has left the melt since the
+    # last equilibrium (adjustment factor 0) are removed, as by the fixed 
+    # point
+    sim._act_ox[:] = np.where(on,fAb,0) * gamma
+    vapor.number_density(sim)
+    vapor.recompute_adjFact(sim)
+    adjFact = np.array(list(vapor.adjFact.values()))
+    sim._presGas[:len(adjFact)][adjFact == 0] = 0
+    gases = np.flatnonzero(sim._presGas[:len(adjFact)]).tolist()
+    vapor.select_active(sim)
+    names = [sim._gasNames[j] for j in gases]
+
+    def residual(x):
+        gamma[on] = np.exp(x[:nOn])
+        sim._presGas[gases] = np.exp(x[nOn:])
+        vapor.melt_pressure_calculation(sim)
+        vapor.number_density(sim)
+        fAb[iFe2O3] = sim._presLiq[iFe2O3] if on[iFe2O3] else 0
+        act = fAb * gamma
+        sim._act_ox[:] = act
+        pseudo = melt.activities_melt_pseudo(act)
+        denom = (act @ melt._oxBal.T + pseudo @ melt._massBal)[on]
+        vapor.recompute_adjFact(sim)
+        return np.concatenate((np.log(denom / fAb[on]),\
+                               np.log([vapor.adjFact[gas] for gas in names])))
+
+    def converged(res):
+        return np.abs(res[:nOn]).max(initial=0) < tol and \
+               vapor.adjFact_converged()
+
+    def jacobian(x,res):
+        jac = np.empty((x.size,x.size))
+        for k in range(x.size):
+            x_h = x.copy()
+            x_h[k] += h
+            jac[:,k] = (residual(x_h) - res) / h
+        return jac
+
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+        x = np.log(np.concatenate((gamma[on],sim._presGas[gases])))
+        res = residual(x)
+        evals = 1
+        keys = tuple(on), tuple(names)
+        jac = vapor._jacGlobal if vapor._jacGlobalKeys == keys else None
+        fresh = False
+        while not converged(res):
+            if evals > maxPass or not np.all(np.isfinite(res)):
+                return _fail(sim,melt,vapor,start)
+            if jac is None:
+                jac = jacobian(x,res)
+                evals += x.size
+                fresh = True
+            try:
+                step = np.linalg.solve(jac,-res)
+            except np.linalg.LinAlgError:
+                return _fail(sim,melt,vapor,start)
+            if not np.all(np.isfinite(step)):
+                return _fail(sim,melt,vapor,start)
+            step *= min(1.,maxStep/np.abs(step).max())
+
+            resNew = residual(x + step)
+            evals += 1
+            if np.abs(resNew).max() > np.abs(res).max() and not fresh:
+                # Restart from a finite difference Jacobian
+                jac = None
+            else:
+                # Broyden's (good) update
+                jac = jac + np.outer(resNew - res - jac @ step,step) \
+                            / (step @ step)
+                fresh = False
+            x += step
+            res = resNew
+
+    sim._gamma[:] = gamma
+    melt.prune_pseudo(fAb,gamma,True)
+    vapor._jacGlobal, vapor._jacGlobalKeys = jac, keys
+    if vapor.stats is not None:
+        vapor.stats.record('global','broyden',evals,np.abs(res).max(),\
+                           vapor.stats.clock() - clock)
+    return evals
+
+def _fail(sim,melt,vapor,start):
+    ''' Restores the state before a failed global_equilibrium '''
+    _restore(sim,melt,vapor,start)
+    vapor._jacGlobalKeys = None
+    return None
+
+def vaporisation(sim,melt,vapor,V,meltSolver='fixed_point',\
+                 vaporSolver='fixed_point',step=None,events=None,\
+                 depletion=1e-20,maxSteps=1e5,stats=None,it=0,vap=0,\
+                 coupled=False):
+    '''
+    The vaporisation loop: solves the equilibrium and removes vapor (with 
+    the adaptive_step step if given, else vaporise) until a fraction V is 
+    vaporised or after maxSteps steps. The last step ends exactly at V.
+
+    Yields a snapshot after every step: the vapor removed in the step 
+    (totPres, gasMoleFrac of the equilibrium at its start), the melt left 
+    after it (vap, massFrac, abEl) and the solver iterations it took. The 
+    dicts are not modified by later steps.
+
+    stats is an optional stats.solver_stats collector that counts the steps
+    and times the vapor removal (with step, including its trial equilibria).
+    Attach it to melt and vapor to record the equilibrium solves as well.
+
+    it and vap are the number of steps and the vaporised fraction to start
+    from, for a run resumed from a checkpoint.
+
+    coupled: solve each equilibrium with F2O3 as one more unknown instead of
+    the two passes (see equilibrium).
+    '''
+    while vap < V and it <= maxSteps or it == 0:
+
+        # Calculating activities and partial pressures (twice, the second 
+        # time adding F2O3, or coupled)
+        meltIt, vaporIt = equilibrium(sim,melt,vapor,meltSolver,vaporSolver,\
+                                      coupled)
+
+        # Remove vapor
+        if stats is not None:
+            start = stats.clock()
+        if step is not None:
+            vap = step.vaporise(sim,melt,vapor,meltSolver,vaporSolver,V,\
+                                events,depletion,coupled)
+            meltIt += step.iterations[0]
+            vaporIt += step.iterations[1]
+        else:
+            vap = vaporise(sim,vapor,V=V,events=events,depletion=depletion)
+        if stats is not None:
+            stats.step(stats.clock() - start)
+
+        it += 1
+        yield {'step' : it, 'vap' : vap, 'massFrac' : sim.massFrac, \
+               'totPres' : sim.totPres, 'gasMoleFrac' : sim.gasMoleFrac, \
+               'abEl' : sim.abEl.copy(), 'meltIterations' : meltIt, \
+               'vaporIterations' : vaporIt}
+
+def vaporise(sim,vapor,frac=0.05,V=None,events=None,depletion=1e-20):
+    '''
+    Removes vapor from the melt: a fraction frac of the most volatile element
+    (a forward Euler step along the vaporisation trajectory).
+
+    If V is given, the step is shortened to end exactly at the vaporised 
+    fraction V. If events is a list, the step is shortened to end exactly 
+    where an element is exhausted (its relative abundance falls to 
+    depletion), the element is removed and the event is appended to events.
+    Returns the vaporised fraction of the melt.
+    '''
+    n_frac = gas_fractions(sim,vapor)
+    return _step(sim,n_frac,n_frac,frac,V,events,depletion)
+
+def _step(sim,n_step,n_frac,frac,V,events,depletion):
+    '''
+    Removes vapor of composition n_frac in the amount that takes a fraction
+    frac of the most volatile element for composition n_step, shortened to
+    the first event (see vaporise)
+    '''
+    deplete = ()
+    if V is not None or events is not None:
+        frac, event = limit_step(sim,n_step,n_frac,frac,V,\
+                                 depletion if events is not None else None)
+        if event not in [None,'V']:
+            deplete = (event,)
+
+    vapoFrac, vapoFrac1 = step_sizes(sim,n_step,frac)
+    vap = remove_vapor(sim,n_frac,vapoFrac,vapoFrac1,deplete)
+
+    for element in deplete:
+        events.append({'element' : element, 'vap' : vap, \
+                       'massFrac' : sim.massFrac})
+    return vap
+
+def limit_step(sim,n_step,n_frac,frac,V=None,depletion=None):
+    '''
+    Shortens the step frac (see _step) so that it ends exactly where the
+    vaporised fraction reaches V or, if depletion is given, where the first
+    element still present falls to a relative abundance of depletion. 
+    The end point is found by bisection (Illinois regula falsi) on trial 
+    steps, which do not require solving the equilibrium again.
+    Returns the step and the event that ends it: 'V', an element or None.
+    '''
+    def trial(f):
+        test = copy.copy(sim)
+        vapoFrac, vapoFrac1 = step_sizes(test,n_step,f)
+        return test, remove_vapor(test,n_frac,vapoFrac,vapoFrac1)
+
+    # Functions that change sign (from negative) at each event, and their
+    # scale
+    events = {}
+    if V is not None:
+        events['V'] = (lambda test, vap: vap - V), V
+    if depletion is not None:
+        for element in sim.fAbAtom:
+            if sim.fAbAtom[element] > depletion:
+                events[element] = (lambda test, vap, el=element: \
+                                   depletion - test.fAbAtom[el]), depletion
+
+    full = frac
+    test, vap = trial(full)
+    first = None
+    for event, (g, scale) in events.items():
+        ghi = g(test,vap)
+        if ghi < 0:
+            continue
+        hi = _crossing(lambda f: g(*trial(f)),full,ghi,1e-12*scale)
+        if first is None or hi < frac:
+            frac, first = hi, event
+    return frac, first
+
+def _crossing(g,hi,ghi,tol):
+    '''
+    Smallest step (to rounding) in [0, hi] where g changes sign from negative,
+    given g(hi) = ghi >= 0 (Illinois regula falsi)
+    '''
+    lo, glo = 0, g(0)
+    if glo >= 0:
+        return 0
+    side = 0
+    gEnd = ghi # g(hi), ghi is scaled down by the Illinois steps
+    while hi - lo > 1e-15 * hi and gEnd > tol:
+        f = (lo*ghi - hi*glo) / (ghi - glo)
+        if not lo < f < hi:
+            f = 0.5 * (lo + hi)
+        gf = g(f)
+        if gf < 0:
+            lo, glo = f, gf
+            if side == -1:
+                ghi *= 0.5
+            side = -1
+        else:
+            hi, ghi, gEnd = f, gf, gf
+            if side == 1:
+                glo *= 0.5
+            side = 1
+    return hi
+
+@functools.lru_cache()
+def _pressure_weights(gasNames,elNames):
+    '''
+    Weight of each gas pressure in the total pressure: once for every 
+    element whose name is part of the gas name, and once for O, O2 and the
+    electrons
+    '''
+    return np.array([sum(el in gas for el in elNames) + \
+                     (gas in ['O','O2','EnE']) for gas in gasNames],dtype=float)
+
+def element_fractions(vapor):
+    '''
+    Mole fractions of each element (ordered as sim._elNames) in the gas, 
+    from the number densities of the last pressure pass
+    '''
+    return vapor._n_el[:-1] / vapor._n_el.sum()
+
+def gas_fractions(sim,vapor):
+    '''
+    Sets the total gas pressure and the gas mole fractions of sim, and returns
+    the mole fractions of each element in the gas (see element_fractions).
+    '''
+
+    # Total gas pressure, summed over the gases of each element
+    P = sim._presGas
+    sim.totPres = float(_pressure_weights(sim._presGasNames,sim._elNames) @ P)
 
     # Gas mole fraction (P/Ptot)
-    sim.gasMoleFrac = {gas : sim.presGas[gas]/sim.totPres for gas in sim.presGas}
+    sim.gasMoleFrac = dict(zip(sim._presGasNames,(P/sim.totPres).tolist()))
     
-    # Calculating total mole fractions of each element in the gas
-    n_tot = sum(vapor.n_el.values())
-    n_frac = {element : vapor.n_el[element]/n_tot for element in vapor.n_el}
+    return element_fractions(vapor)
+
+def step_sizes(sim,n_frac,frac):
+    '''
+    Amounts of vapor (per unit of gas composition n_frac) that remove a 
+    fraction frac of the most volatile element, in the relative (fAbAtom) 
+    and absolute (abEl) abundances
+    '''
+    present = sim._fAbAtom > 1e-20
 
     # Calculating volatilities using mole fraction and atomic abundance
-    volatilities = {element: n_frac[element]/sim.fAbAtom[element] \
-                    if sim.fAbAtom[element] > 1e-20 else 0 for element in sim.fAbAtom}
+    volatilities = np.divide(n_frac,sim._fAbAtom,out=np.zeros_like(n_frac),\
+                             where=present)
 
     # Calculating vaporisation fraction using most volatile element
-    vapoFrac = 0.05/max(volatilities.values())
+    vapoFrac = frac/volatilities.max()
 
     # Calculating volatilities using mole fraction and elemental abundance
-    volatilities1 = {element: n_frac[element]/sim.abEl[element] \
-                     if sim.fAbAtom[element] > 1e-20 else 0 for element in sim.abEl}
+    volatilities1 = np.divide(n_frac,sim._abEl,out=np.zeros_like(n_frac),\
+                              where=present)
     
     # Calculating vaporisation fraction using most volatile element
-    vapoFrac1 = 0.05/max(volatilities1.values())        
+    vapoFrac1 = frac/volatilities1.max()
+
+    return float(vapoFrac), float(vapoFrac1)
+
+def remove_vapor(sim,n_frac,vapoFrac,vapoFrac1,deplete=()):
+    '''
+    Removes vapor of composition n_frac from the melt in the amounts given by
+    step_sizes, removes the elements deplete entirely and renormalises the 
+    abundances.
+    Returns the vaporised fraction of the melt.
+    '''
+    fAbAtom = sim._fAbAtom
+    abEl = sim._abEl
 
     # Calculate new abundances for each element 
-    sim.fAbAtom = {element: sim.fAbAtom[element] - vapoFrac * n_frac[element] \
-                        for element in sim.fAbAtom}
-
-    sim.abEl = {element: sim.abEl[element] - vapoFrac1 * n_frac[element]\
-                     for element in sim.abEl}
-
-    # Ensuring that no abundance values are negative
-    for element in sim.abEl:
-        if element == 'Fe':
-            if sim.abEl[element] <= 2e-20:
-                sim.abEl[element] = 0
-                sim.fAbAtom[element] = 0    
-        else:
-            if sim.abEl[element] <= 0:
-                sim.abEl[element] = 0
-                sim.fAbAtom[element] = 0
+    fAbAtom -= vapoFrac * n_frac
+    abEl -= vapoFrac1 * n_frac
+
+    # Ensuring that no abundance values are negative (Fe is removed below 
+    # 2e-20)
+    empty = abEl <= sim._abFloor
+    for element in deplete:
+        empty[sim._elNames.index(element)] = True
+    abEl[empty] = 0
+    fAbAtom[empty] = 0
 
     # Fraction of vaporised magma (new_totAbundance/old_totAbundance)
-    vap = 1 - sum(sim.abEl.values())/sim.abETot 
+    vap = 1 - abEl.sum()/sim.abETot 
 
     # Calculate weight percent vaporized 
-    massVapo = 0
-    for element in sim.abEl:
-        for oxide in sim._mwOxides:
-            if element in oxide:
-                if element in ['Al','Na','K']:
-                    massVapo += 0.5 * sim.abEl[element] * sim._mwOxides[oxide]
-                elif oxide != 'Fe2O3':
-                    massVapo += sim.abEl[element] * sim._mwOxides[oxide]
-    sim.massFrac = (sim.mass-massVapo)/sim.mass
+    massVapo = abEl @ sim._wEl
+    sim.massFrac = float((sim.mass-massVapo)/sim.mass)
 
     # Renormalize the abundances 
-    fAbAtom_tot = sum(sim.fAbAtom.values()) # Mole fraction of elemens
-    fAbOx_tot = 0  # Mole fraction of oxides
-    for el in sim.fAbAtom:
-        if el in ['Al','Na','K']:
-            fAbOx_tot += 0.5 * sim.fAbAtom[el]
-        else:
-            fAbOx_tot += sim.fAbAtom[el] 
-
-    for el in sim.fAbOx: # Relative abundnaces of metals by moleculre
-        if el in ['Al','Na','K']:
-             sim.fAbOx[el] = 0.5 * sim.fAbAtom[el]/fAbOx_tot
-        else:
-             sim.fAbOx[el] = sim.fAbAtom[el]/fAbOx_tot 
+    fAbAtom_tot = fAbAtom.sum() # Mole fraction of elemens
+    fAbOx = sim._halfOx * fAbAtom # Relative abundnaces of metals by moleculre
+    sim._fAbOx[:] = fAbOx / fAbOx.sum()
 
     # Relative abundances of metals by atom
-    sim.fAbAtom = {el : sim.fAbAtom[el]/fAbAtom_tot for el in sim.fAbAtom}
+    fAbAtom /= fAbAtom_tot
 
-    return vap
+    return float(vap)
+
+class adaptive_step():
+    '''
+    Error controlled vaporisation steps. Each step is an embedded pair of a 
+    forward Euler and a Heun (trapezoidal) step: the equilibrium is solved at
+    the Euler end point, the difference between the two estimates the error
+    of the step, and the Heun step is taken if the error is below tol. The 
+    error is the largest change of an element abundance relative to that 
+    abundance, so steps grow where the vapor composition changes slowly and
+    shrink near the depletion of an element.
+
+    frac is the fraction of the most volatile element removed per step, as in 
+    vaporise. Costs two equilibrium solves per step (one in the main loop).
+    '''
+    def __init__(self,tol=1e-2,frac=0.05,fracMin=1e-6,fracMax=0.5):
+        self.tol = tol
+        self.frac = frac
+        self.fracMin = fracMin
+        self.fracMax = fracMax
+        self.accepted = 0
+        self.rejected = 0
+        self.iterations = 0, 0
+
+    def vaporise(self,sim,melt,vapor,meltSolver='fixed_point',\
+                 vaporSolver='fixed_point',V=None,events=None,depletion=1e-20,\
+                 coupled=False):
+        '''
+        Same as vaporise(sim,vapor,V=V,...) for the equilibrium of the 
+        current composition, with the step size chosen by the error control
+        (equilibria coupled as in vaporisation). Returns the vaporised 
+        fraction of the melt.
+        '''
+        meltIt = 0
+        vaporIt = 0
+
+        # Composition and equilibrium at the start of the step
+        n0 = gas_fractions(sim,vapor)
+        start = _state(sim,melt,vapor)
+
+        while True:
+
+            # Step fraction, ending at the next event if there is one
+            frac = self.frac
+            if V is not None or events is not None:
+                frac, _ = limit_step(sim,n0,n0,frac,V,\
+                                     depletion if events is not None else None)
+            vapoFrac, vapoFrac1 = step_sizes(sim,n0,frac)
+            if frac == 0:
+                n1 = n0
+                break
+
+            # Euler step and equilibrium at its end
+            remove_vapor(sim,n0,vapoFrac,vapoFrac1)
+            its = equilibrium(sim,melt,vapor,meltSolver,vaporSolver,coupled)
+            meltIt += its[0]
+            vaporIt += its[1]
+            n1 = element_fractions(vapor)
+
+            # Error estimate (Heun - Euler) relative to each abundance, down
+            # to the depletion abundance (the events depend on the small
+            # abundances of the elements about to be exhausted)
+            abEl = start['abEl']
+            floor = depletion * abEl.sum()
+            on = abEl > 0
+            err = float(np.max(0.5 * vapoFrac1 * np.abs(n1[on] - n0[on]) \
+                               / (abEl[on] + floor)))
+
+            # New step fraction, bounded growth and shrinking
+            factor = 0.9 * (self.tol/err)**0.5 if err > 0 else 5
+            self.frac = min(max(frac * min(max(factor,0.2),5),\
+                                self.fracMin),self.fracMax)
+
+            _restore(sim,melt,vapor,start)
+            if err <= self.tol or frac <= self.fracMin:
+                break
+            self.rejected += 1
+
+        # Heun step, leaving the equilibrium of the start of the step in sim
+        # like vaporise
+        self.accepted += 1
+        self.iterations = meltIt, vaporIt
+        n_heun = 0.5 * (n0 + n1)
+        return _step(sim,n0,n_heun,frac,V,events,depletion)
+
+def _state(sim,melt,vapor):
+    ''' Copy of the composition and equilibrium of sim '''
+    state = {name : getattr(sim,'_' + name).copy() for name in sim._stateNames}
+    state.update(totPres=sim.totPres,gasMoleFrac=sim.gasMoleFrac,\
+                 massFrac=sim.massFrac)
+    state['n_el'] = vapor._n_el.copy()
+    state['adjFact'] = dict(vapor.adjFact)
+    state['act_pseudo'] = melt.pseudo_activities(sim._act_ox)
+    return state
+
+def _restore(sim,melt,vapor,state):
+    for name in sim._stateNames:
+        getattr(sim,'_' + name)[:] = state[name]
+    sim.totPres = state['totPres']
+    sim.gasMoleFrac = state['gasMoleFrac']
+    sim.massFrac = state['massFrac']
+    vapor._n_el = state['n_el'].copy()
+    vapor.adjFact = dict(state['adjFact'])
+    vapor.select_active(sim)
+    melt.set_pseudo_activities(state['act_pseudo'])
@@ -4,3 +4,66 @@
 magmaT = 2500
 vaporFrac = 1e-20
 comp = 'Komatiite'
+
+# Solver for the oxide activities in the melt: 'fixed_point', 'newton',
+# 'anderson' or 'log' (fixed_point on log activities, the same iterations,
+# for melts whose activities underflow; with vaporSolver = 'log', a run is
+# no faster than with fixed_point)
+meltSolver = 'fixed_point'
+
+# Solver for the key gas pressures: 'fixed_point', 'newton', 'broyden',
+# 'anderson' or 'log' (fixed_point on log pressures, for pressures too small
+# for a float; each pass is slower than a fixed_point one). 'newton' and
+# 'broyden' take 3-4 times fewer pressure passes than fixed_point, but each
+# pass costs more, so that the run time is about that of fixed_point
+vaporSolver = 'fixed_point'
+
+# Equilibrium with F2O3: False (solved twice, the second time adding F2O3
+# estimated by the first), True (one coupled solve with the F2O3 activity
+# as one more unknown, about a third faster, same state to the solver 
+# tolerances) or 'global' (activities and key pressures solved at once as 
+# one nonlinear system, quasi-Newton, several times faster than the two 
+# passes; the solvers above only seed the first equilibrium)
+coupledF2O3 = False
+
+# Fast chemistry: the melt pseudospecies whose share in the mass balance of
+# their oxides is below pruneTol are left out (None: all evaluated). They 
+# are checked against the full set every pruneEvery melt calculations, which
+# also gives the error of the pruning (reported at the end of main.py)
+pruneTol = None
+pruneEvery = 50
+
+# Number of previous iterates combined by the 'anderson' solvers
+andersonDepth = 5
+
+# Backend of the fixed point iterations: 'numpy' or 'numba' (compiled loops,
+# falls back to numpy if numba is not installed)
+backend = 'numpy'
+
+# Vaporisation step: 'fixed' (5% of the most volatile element per step) or 
+# 'adaptive' (error controlled, vaporTol is the tolerance on the relative 
+# change of the element abundances per step, down to the depletion 
+# abundance; the error of the whole trajectory falls about tenfold per 
+# decade of vaporTol)
+vaporStep = 'fixed'
+vaporTol = 1e-2
+
+# Relative atomic abundance at which an element counts as exhausted and is 
+# removed from the melt
+depletion = 1e-20
+
+# Per-step output of the vaporisation (CSV file name, or None): every Nth
+# step, and/or steps where a quantity changed by more than trajectoryRtol
+# (all steps if both are None)
+trajectory = None
+trajectoryEvery = None
+trajectoryRtol = None
+
+# Solver statistics (iterations, residuals and time per equilibrium solve,
+# vaporisation steps), written as a JSON run summary next to the output
+stats = False
+
+# Checkpoints of the full state every checkpointEvery vaporisation steps (or
+# None), from which main.py --resume continues with identical results
+checkpoint = 'output/magpy_checkpoint.npz'
+checkpointEvery = None
@@ -1,16 +1,26 @@
 # Standard libraries
 import sys
+import argparse
 from tqdm import tqdm
 
 # Local modules
 from library.melt_vapor_system import system
 from library.melt_activity import melt_activity
 from library.vapor_pressure import vapor_pressure
-from library.vaporiser import vaporise
+from library.vaporiser import vaporisation, adaptive_step
+from library.trajectory import csv_sink
+from library.stats import solver_stats
+import library.checkpoint as checkpoint
 import library.print_functions as print_functions
 import magpy_cfg
 
-def main():
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Vaporisation of a magma '
+                                     '(settings in magpy_cfg.py)')
+    parser.add_argument('--resume',action='store_true',
+                        help='continue from the checkpoint of an earlier run')
+    args = parser.parse_args(argv)
 
     # Setting initial values 
     T = magpy_cfg.magmaT # Temperature of magma in Kelvin
@@ -25,41 +35,99 @@ def main():
         
     output_fname = 'output/magpy.out'
     outputEle_fname = 'output/magpyVapor.out'
+    stats_fname = 'output/magpy_stats.json'
 
     # Initialising classes and trackers
     sim = system(input_fname,T)
-    melt = melt_activity(sim)
-    vapor = vapor_pressure(sim)
+    anderson = {'depth' : magpy_cfg.andersonDepth}
+    melt = melt_activity(sim,backend=magpy_cfg.backend,anderson=anderson,\
+                         prune=magpy_cfg.pruneTol,\
+                         pruneEvery=magpy_cfg.pruneEvery)
+    vapor = vapor_pressure(sim,backend=magpy_cfg.backend,anderson=anderson)
     vap = 0
     it = 0
+    meltIt = 0
+    vaporIt = 0
+    events = [] # Elements exhausted during the vaporisation
+    step = None
+    if magpy_cfg.vaporStep == 'adaptive':
+        step = adaptive_step(tol=magpy_cfg.vaporTol)
 
     # Printing initial parameters
     print_functions.print_init(sim,output_fname)
 
+    # Continuing from the last checkpoint
+    sinkState = None
+    if args.resume:
+        loop, sinkState = checkpoint.load(magpy_cfg.checkpoint,sim,melt,vapor,\
+                                          step)
+        it, vap, meltIt, vaporIt, events = loop['step'], loop['vap'], \
+            loop['meltIt'], loop['vaporIt'], loop['events']
+        print(f'Resuming at step {it} (vaporised fraction {vap:.6g}) from '
+              f'{magpy_cfg.checkpoint}')
+
+    # Per-step output
+    sink = None
+    if magpy_cfg.trajectory is not None:
+        sink = csv_sink(magpy_cfg.trajectory,every=magpy_cfg.trajectoryEvery,\
+                        rtol=magpy_cfg.trajectoryRtol,resume=sinkState)
+
+    # Solver statistics
+    stats = None
+    if magpy_cfg.stats:
+        stats = solver_stats(T=T,comp=magpy_cfg.comp,V=V,\
+                             meltSolver=magpy_cfg.meltSolver,\
+                             vaporSolver=magpy_cfg.vaporSolver,\
+                             backend=melt.backend).attach(melt,vapor)
+
     # tqdm progres bar
-    with tqdm(total=1) as pbar:
+    with tqdm(total=1,initial=vap) as pbar:
         pbar.set_description(f'Vaporization percentage (stops at {int(V*100)}%)')
 
-        while vap < V and it <= 1e5 or it == 0:
-
-            # Calculating activities and partial pressures
-            melt.melt_activity_calculation(sim)
-            vapor.vapor_pressure_calculation(sim)
-
-            # Reapeating calculations by adding F2O3
-            melt.melt_activity_calculation(sim,addF2O3=True)
-            vapor.vapor_pressure_calculation(sim)
-
-            # TODO: Output first equilibrium before removal of vapor
-
-            # Remove vapor
-            vap = vaporise(sim,vapor)
+        # TODO: Output first equilibrium before removal of vapor
+        for snapshot in vaporisation(sim,melt,vapor,V,magpy_cfg.meltSolver,\
+                                     magpy_cfg.vaporSolver,step,events,\
+                                     magpy_cfg.depletion,stats=stats,\
+                                     it=it,vap=vap,\
+                                     coupled=magpy_cfg.coupledF2O3):
+            if sink is not None:
+                sink.write(snapshot)
 
             # Update counters
-            it += 1
+            vap = snapshot['vap']
+            it = snapshot['step']
+            meltIt += snapshot['meltIterations']
+            vaporIt += snapshot['vaporIterations']
             pbar.update(vap - pbar.n)
-
+            pbar.set_postfix(melt_it=meltIt,vapor_it=vaporIt)
+
+            if magpy_cfg.checkpointEvery is not None and \
+               it % magpy_cfg.checkpointEvery == 0:
+                checkpoint.save(magpy_cfg.checkpoint,sim,melt,vapor,\
+                                {'step' : it, 'vap' : vap, 'meltIt' : meltIt,\
+                                 'vaporIt' : vaporIt, 'events' : events},\
+                                step,sink)
+
+    if sink is not None:
+        sink.close()
+        print(f'{sink.rows} of {it} steps written to {sink.fname}')
     pbar.close()
+    print(f'{it} vaporisation steps, {meltIt} melt activity iterations '
+          f'({magpy_cfg.meltSolver}), {vaporIt} vapor pressure passes '
+          f'({magpy_cfg.vaporSolver})')
+    if magpy_cfg.vaporStep == 'adaptive':
+        print(f'Adaptive steps: {step.accepted} accepted, {step.rejected} '
+              f'rejected, last step fraction {step.frac:.3g}')
+    if melt.prune is not None:
+        print(f'Fast chemistry: {len(melt._pruned)} pseudospecies left out at '
+              f'the last check, largest error {melt.pruneError:.3g} '
+              '(log10 of the activity coefficients)')
+    if stats is not None:
+        stats.dump(stats_fname)
+        print(f'Solver statistics written to {stats_fname}')
+    for event in events:
+        print(f"{event['element']} exhausted at vaporised fraction "
+              f"{event['vap']:.10g} (vaporised mass fraction {event['massFrac']:.10g})")
 
     print_functions.print_results(sim,melt,vap,output_fname)
     print_functions.print_resultsEle(sim,melt,vap,outputEle_fname)
@@ -0,0 +1,82 @@
+# Vaporisation of many melt compositions, solved together (library/batch.py).
+# Each member follows the fixed step loop of main.py with the fixed point
+# solvers, and its last step ends exactly at V, but the steps are not 
+# shortened at the exhaustion of an element and no exhaustion events are 
+# recorded (an element leaves the melt when its abundance falls below the
+# floor), so the results may differ slightly from main.py near an exhaustion.
+
+# Standard libraries
+import sys
+import argparse
+import numpy as np
+
+# Local modules
+from library.melt_vapor_system import system, read_compositions
+from library.melt_activity import melt_activity
+from library.vapor_pressure import vapor_pressure
+from library.batch import batch_system, vaporise_all
+import magpy_cfg
+
+def calc_compositions(comp,T,V):
+    '''
+    Vaporises every composition of comp (weight % of the oxides ordered as
+    system._oxideNames, one row each) at the temperatures T (one, or one per
+    composition) until a fraction V is vaporised, all together as a batch
+    (see library/batch.py). Returns the batch_system holding the results.
+    '''
+    # The names and weights of system are shared by every member, the
+    # composition of the template is not used
+    sim = system('input/BSE.dat',np.atleast_1d(T)[0])
+    batch = batch_system(sim,T,comp)
+    melt = melt_activity(batch)
+    vapor = vapor_pressure(batch)
+    vaporise_all(batch,melt,vapor,V)
+
+    return batch
+
+def write_results(fname,names,batch):
+    with open(fname,'w') as file:
+        file.write('name,T,status,steps,vap,massFrac,totPres,' + \
+                   ','.join(batch.gasMoleFrac) + '\n')
+        for i, name in enumerate(names):
+            status = 'failed' if batch.failed[i] else 'ok'
+            file.write(f'{name},{batch.T[i]:g},{status},{batch.steps[i]},'
+                       f'{batch.vap[i]:.10g},{batch.massFrac[i]:.10g},'
+                       f'{batch.totPres[i]:.10g},')
+            file.write(','.join(f'{frac[i]:.10g}' for frac in \
+                                batch.gasMoleFrac.values()) + '\n')
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Vaporisation of many melt '
+                                     'compositions, solved together')
+    parser.add_argument('input',nargs='?',default='input/compositions.csv',
+                        help='CSV file with a column per oxide (weight %%), '
+                        'and optional name and T columns')
+    parser.add_argument('--T',type=float,default=magpy_cfg.magmaT,
+                        help='temperature (K) if the input has no T column')
+    parser.add_argument('--V',type=float,default=magpy_cfg.vaporFrac,
+                        help='vaporised fraction to stop at (< 1)')
+    parser.add_argument('--out',default='output/batch.csv',
+                        help='CSV file for the results')
+    args = parser.parse_args(argv)
+
+    names, T, comp = read_compositions(args.input,system._oxideNames)
+    if T is None:
+        T = args.T
+    print(f'Vaporising {len(names)} compositions to a fraction {args.V} '
+          '(element exhaustion is not recorded, see main.py)')
+
+    batch = calc_compositions(comp,T,args.V)
+    write_results(args.out,names,batch)
+
+    print(f'{int(batch.steps.sum())} vaporisation steps, '
+          f'{int(batch.meltIterations.sum())} melt activity iterations, '
+          f'{int(batch.vaporIterations.sum())} vapor pressure passes')
+    if batch.failed.any():
+        print(f'Failed: {", ".join(np.asarray(names)[batch.failed])}')
+    print(f'Results written to {args.out}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
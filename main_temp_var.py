@@ -1,5 +1,10 @@
 # Standard libraries
 import sys
+import json
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from tqdm import tqdm
 
@@ -7,63 +12,220 @@ from tqdm import tqdm
 from library.melt_vapor_system import system
 from library.melt_activity import melt_activity
 from library.vapor_pressure import vapor_pressure
-from library.vaporiser import vaporise
+from library.vaporiser import vaporisation, adaptive_step
+from library.batch import batch_system, vaporise_all
+from library.stats import solver_stats
 import library.print_functions as print_functions
+import magpy_cfg
 
-def calc(T,V,input_fname,output_fname,file,first=False):
+class continuation():
+    '''
+    Warm start for sweeps: seeds each point with the converged gamma, act_ox
+    and key gas pressures (and the Broyden Jacobian) of the previous point
+    instead of the cold defaults. With extrapolate, log(gamma) and log(P) 
+    are extrapolated linearly in 1/T from the previous two points.
+    '''
+    def __init__(self,extrapolate=False):
+        self.extrapolate = extrapolate
+        self.points = deque(maxlen=2)
+        self.jac = None, None
+
+    def seed(self,sim,vapor):
+        if not self.points:
+            return
+        T1, state = self.points[-1]
+        if self.extrapolate and len(self.points) == 2:
+            T0, prev = self.points[0]
+            w = (1/sim.T - 1/T1) / (1/T1 - 1/T0)
+            with np.errstate(divide='ignore',invalid='ignore'):
+                state = {name : np.where((val > 0) & (prev[name] > 0),\
+                                         val * (val/prev[name])**w,val) \
+                         for name, val in state.items()}
+        sim._gamma[:] = state['gamma']
+        sim._act_ox[:] = state['act_ox']
+        sim._presGas[:len(sim._gasNames)] = state['presGas']
+        vapor._jac, vapor._jacGases = self.jac
+
+    def update(self,sim,vapor):
+        self.points.append((sim.T,{'gamma' : sim._gamma.copy(),
+                                   'act_ox' : sim._act_ox.copy(),
+                                   'presGas' : sim._presGas[:len(sim._gasNames)]\
+                                               .copy()}))
+        self.jac = vapor._jac, vapor._jacGases
+
+def calc(T,V,input_fname,output_fname=None,warm=None,stats=None):
+    '''
+    Vaporises the melt at temperature T until a fraction V is vaporised.
+    warm is an optional continuation that seeds the solvers, stats an
+    optional solver_stats collector.
+    Returns the system and the numbers of melt and vapor iterations.
+    '''
 
     # Initialising classes and trackers
     sim = system(input_fname,T)
-    melt = melt_activity(sim)
-    vapor = vapor_pressure(sim)
-    vap = 0
-    it = 0
+    anderson = {'depth' : magpy_cfg.andersonDepth}
+    melt = melt_activity(sim,backend=magpy_cfg.backend,anderson=anderson,\
+                         prune=magpy_cfg.pruneTol,\
+                         pruneEvery=magpy_cfg.pruneEvery)
+    vapor = vapor_pressure(sim,backend=magpy_cfg.backend,anderson=anderson)
+    meltIt = 0
+    vaporIt = 0
+    step = None
+    if magpy_cfg.vaporStep == 'adaptive':
+        step = adaptive_step(tol=magpy_cfg.vaporTol)
+
+    if warm is not None:
+        warm.seed(sim,vapor)
+    if stats is not None:
+        stats.attach(melt,vapor)
 
     # Printing initial parameters
-    print_functions.print_init(sim,output_fname)
+    if output_fname is not None:
+        print_functions.print_init(sim,output_fname)
 
     # tqdm progres bar
     # with tqdm(total=1) as pbar:
     #     pbar.set_description(f'Vaporization percentage (stops at {int(V*100)}%)')
 
-    while vap < V and it <= 1e5 or it == 0:
+    for snapshot in vaporisation(sim,melt,vapor,V,magpy_cfg.meltSolver,\
+                                 magpy_cfg.vaporSolver,step,stats=stats,\
+                                 coupled=magpy_cfg.coupledF2O3):
 
-        # Calculating activities and partial pressures
-        melt.melt_activity_calculation(sim)
-        vapor.vapor_pressure_calculation(sim)
+        # The first equilibrium (vaporise leaves it in sim) seeds the next T
+        if snapshot['step'] == 1 and warm is not None:
+            warm.update(sim,vapor)
 
-        # Repeating calculations by adding F2O3
-        melt.melt_activity_calculation(sim,addF2O3=True)
-        vapor.vapor_pressure_calculation(sim)
+        # Update counters
+        meltIt += snapshot['meltIterations']
+        vaporIt += snapshot['vaporIterations']
+        # pbar.update(snapshot['vap'] - pbar.n)
 
-        # TODO: Output first equilibrium before removal of vapor
+    # pbar.close()
 
-        # Remove vapor
-        vap = vaporise(sim,vapor)
+    #print_functions.print_results(sim,melt,vap,output_fname)
 
-        # Update counters
-        it += 1
-        # pbar.update(vap - pbar.n)
+    return sim, (meltIt,vaporIt)
 
-    # pbar.close()
+# The settings that calc_batch solves with (see batch_ignored)
+_batchSettings = {'meltSolver' : 'fixed_point', 'vaporSolver' : 'fixed_point',
+                  'coupledF2O3' : False, 'vaporStep' : 'fixed', 
+                  'pruneTol' : None, 'backend' : 'numpy'}
 
-    if first:
-        file.write(f'T,')
-        for ox in sim.gasMoleFrac:
-            file.write(f'{ox},')
-        file.write('\n')
+def batch_ignored():
+    ''' The settings of magpy_cfg that calc_batch does not follow '''
+    return [name for name, value in _batchSettings.items() \
+            if getattr(magpy_cfg,name) != value]
 
-    file.write(f'{T},')
-    for ox in sim.gasMoleFrac:
-        file.write(f'{sim.gasMoleFrac[ox]},')
+def calc_batch(temps,V,input_fname,output_fname=None):
+    '''
+    Same as calc for all the temperatures at once (see library/batch.py), 
+    with the fixed point solvers and fixed steps whatever magpy_cfg sets 
+    (see batch_ignored). Returns the batch_system holding the results.
+    '''
+    sim = system(input_fname,temps[0])
+    if output_fname is not None:
+        print_functions.print_init(sim,output_fname)
+
+    batch = batch_system(sim,temps)
+    melt = melt_activity(batch)
+    vapor = vapor_pressure(batch)
+    vaporise_all(batch,melt,vapor,V)
+
+    return batch
+
+'''
+Parallel sweeps: every worker process solves chunks of consecutive 
+temperatures (the input and data files are parsed once per worker).
+'''
+def _stats(T):
+    ''' A solver_stats collector for temperature T if magpy_cfg.stats '''
+    if not magpy_cfg.stats:
+        return None
+    return solver_stats(T=int(T),meltSolver=magpy_cfg.meltSolver,\
+                        vaporSolver=magpy_cfg.vaporSolver)
+
+def _calc_chunk(temps,V,input_fname,batch,warm):
+    '''
+    Gas mole fractions, iteration counts and solver statistics summaries (or
+    None) for a chunk of temperatures, in order. With warm, the chunk is 
+    solved as a continuation.
+    '''
+    if batch:
+        res = calc_batch(temps,V,input_fname)
+        return [({gas : float(frac[i]) for gas, frac in res.gasMoleFrac.items()},\
+                 (int(res.meltIterations[i]),int(res.vaporIterations[i])),\
+                 None) for i in range(len(temps))]
+    warm = continuation(**warm) if warm is not None else None
+    results = []
+    for t in temps:
+        stats = _stats(t)
+        sim, its = calc(t,V,input_fname,warm=warm,stats=stats)
+        results.append((sim.gasMoleFrac,its,\
+                        stats.summary() if stats is not None else None))
+    return results
+
+def calc_parallel(temps,V,input_fname,workers,chunksize=4,batch=False,\
+                  warm=None):
+    '''
+    Spreads chunks of the temperatures over a pool of worker processes. 
+    Chunks go to whichever worker is free (the iteration counts vary 
+    strongly with T), and at most 4 chunks per worker are in flight, so the
+    results are yielded in temperature order without holding the sweep in
+    memory. warm holds the continuation options within each chunk.
+    Yields (T, gasMoleFrac, iterations, stats summary) for every temperature.
+    '''
+    chunks = (temps[i:i+chunksize] for i in range(0,len(temps),chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def submit(chunk):
+            return chunk, pool.submit(_calc_chunk,chunk,V,input_fname,batch,warm)
+
+        pending = deque(submit(chunk) for chunk in \
+                        itertools.islice(chunks,4*workers))
+        while pending:
+            chunk, future = pending.popleft()
+            results = future.result()
+            pending.extend(submit(chunk) for chunk in itertools.islice(chunks,1))
+            for t, result in zip(chunk,results):
+                yield (t,) + result
+
+def write_header(file,gasNames):
+    file.write(f'T,')
+    for ox in gasNames:
+        file.write(f'{ox},')
     file.write('\n')
 
+def write_iterations(file,T,its):
+    if file.tell() == 0:
+        file.write('T,melt_iterations,vapor_iterations\n')
+    file.write(f'{T},{its[0]},{its[1]}\n')
 
-    #print_functions.print_results(sim,melt,vap,output_fname)
+def write_row(file,T,gasMoleFrac):
+    file.write(f'{T},')
+    for ox in gasMoleFrac:
+        file.write(f'{gasMoleFrac[ox]},')
+    file.write('\n')
 
-def main():
+def main(argv=None):
 
-    # Setting initial values 
+    parser = argparse.ArgumentParser(description='Vapor composition over a '
+                                     'range of magma temperatures')
+    parser.add_argument('--batch',action='store_true',
+                        help='solve all temperatures together as arrays')
+    parser.add_argument('--workers',type=int,default=0,metavar='N',
+                        help='spread the temperatures over N processes')
+    parser.add_argument('--chunk',type=int,default=None,
+                        help='temperatures per task with --workers (default '
+                        '4, or one task per worker with --batch)')
+    parser.add_argument('--continuation',action='store_true',
+                        help='seed each temperature from the previous one')
+    parser.add_argument('--extrapolate',action='store_true',
+                        help='with --continuation, extrapolate the seed in 1/T')
+    args = parser.parse_args(argv)
+    if args.batch and (args.continuation or args.extrapolate):
+        parser.error('--continuation and --extrapolate do not apply to '
+                     '--batch')
+
+    # Setting initial values
     T = [1500,3000] # Temperature range of magma in Kelvin
     V = 0  # Set desired vaporisation fraction (0 <= V < 1)
 
@@ -73,18 +235,65 @@ def main():
     # File names
     input_fname = 'input/BSE-initial.dat'
     output_fname = 'output/MAGMA.OUT'
+    stats_fname = 'output/temp_var_stats.json'
 
-    # Make output file for temp var
+    # Make output files for temp var and the iteration counts per point
     file = open('output/temp_var.csv', 'w')
+    fileIt = open('output/temp_var_iterations.csv', 'w')
+    temps = np.arange(T[0],T[1]+1)
+    warm = {'extrapolate' : args.extrapolate} if args.continuation else None
+    stats = {} # Solver statistics summaries by temperature
+    if magpy_cfg.stats and args.batch:
+        print('No solver statistics for --batch')
+    if args.batch and batch_ignored():
+        print(f'Ignored with --batch: {", ".join(batch_ignored())} (solved '
+              'with the fixed point solvers and fixed steps)')
 
     # Run calculations for entire temperature range
-    for t in tqdm(np.arange(T[0],T[1]+1)):
-        if t == T[0]:
-            calc(t,V,input_fname,output_fname,file,first=True)            
-        calc(t,V,input_fname,output_fname,file)
+    if args.workers > 0:
+        print_functions.print_init(system(input_fname,T[0]),output_fname)
+        # A batch pays off over many temperatures: one chunk per worker
+        chunk = args.chunk
+        if chunk is None:
+            chunk = -(-len(temps) // args.workers) if args.batch else 4
+        results = calc_parallel(temps,V,input_fname,args.workers,chunk,\
+                                args.batch,warm)
+        for t, gasMoleFrac, its, summary in tqdm(results,total=len(temps)):
+            if t == T[0]:
+                write_header(file,gasMoleFrac)
+            write_row(file,t,gasMoleFrac)
+            write_iterations(fileIt,t,its)
+            if summary is not None:
+                stats[int(t)] = summary
+    elif args.batch:
+        batch = calc_batch(temps,V,input_fname,output_fname)
+        write_header(file,batch.gasMoleFrac)
+        for i, t in enumerate(temps):
+            write_row(file,t,{gas : float(frac[i]) for gas, frac in \
+                              batch.gasMoleFrac.items()})
+            write_iterations(fileIt,t,(batch.meltIterations[i],\
+                                       batch.vaporIterations[i]))
+    else:
+        warm = continuation(**warm) if warm is not None else None
+        for t in tqdm(temps):
+            collector = _stats(t)
+            sim, its = calc(t,V,input_fname,output_fname,warm=warm,\
+                            stats=collector)
+            if t == T[0]:
+                write_header(file,sim.gasMoleFrac)
+            write_row(file,t,sim.gasMoleFrac)
+            write_iterations(fileIt,t,its)
+            if collector is not None:
+                stats[int(t)] = collector.summary()
 
     file.close()
-    
+    fileIt.close()
+    print(f'Iteration counts per temperature written to {fileIt.name}')
+    if stats:
+        with open(stats_fname,'w') as fileStats:
+            json.dump(stats,fileStats,indent=1)
+        print(f'Solver statistics per temperature written to {stats_fname}')
+
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
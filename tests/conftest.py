@@ -0,0 +1,39 @@
+'''
+Regression tests against stored outputs (tests/data), run from the
+repository root with
+
+    python -m pytest tests
+
+The scripts read and write relative paths (input/, data/, output/), so
+the tests that run them work in a copy of input/ and data/ in a temporary
+directory and leave output/ untouched.
+'''
+# Standard libraries
+import os
+import re
+import sys
+import shutil
+import numpy as np
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,root)
+stored = os.path.join(root,'tests','data')
+
+@pytest.fixture
+def tree(tmp_path,monkeypatch):
+    ''' Working directory with input/, data/ and an empty output/ '''
+    for name in ['input','data']:
+        shutil.copytree(os.path.join(root,name),tmp_path / name)
+    (tmp_path / 'output').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+_number = re.compile(r'[-+]?\d+\.\d*(?:[eE][-+]?\d+)?|[-+]?\d+[eE][-+]?\d+')
+
+def numbers(fname):
+    ''' The text of fname with the numbers taken out, and the numbers '''
+    with open(fname) as file:
+        text = file.read()
+    return _number.sub('#',text), \
+           np.array([float(x) for x in _number.findall(text)])
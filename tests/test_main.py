@@ -0,0 +1,34 @@
+import os
+import numpy as np
+
+from conftest import stored, numbers
+import main
+import magpy_cfg
+
+def test_default_output(tree):
+    ''' main.py at the settings of magpy_cfg.py gives the stored magpy.out '''
+    main.main([])
+    text, values = numbers('output/magpy.out')
+    refText, refValues = numbers(os.path.join(stored,'magpy.out'))
+    assert text == refText
+    # Printed to 7 digits
+    np.testing.assert_allclose(values,refValues,rtol=1e-5,atol=1e-12)
+
+def test_resume(tree,monkeypatch,capsys):
+    ''' main.py --resume from a checkpoint ends with the same results '''
+    monkeypatch.setattr(magpy_cfg,'vaporFrac',0.01)
+    monkeypatch.setattr(magpy_cfg,'checkpointEvery',10)
+    main.main([])
+    assert os.path.exists(magpy_cfg.checkpoint)
+    results = {}
+    for fname in ['output/magpy.out','output/magpyVapor.out']:
+        with open(fname) as file:
+            results[fname] = file.read()
+        os.remove(fname)
+
+    capsys.readouterr()
+    main.main(['--resume'])
+    assert 'Resuming at step 30' in capsys.readouterr().out
+    for fname, result in results.items():
+        with open(fname) as file:
+            assert file.read() == result
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from library.melt_vapor_system import system
+from library.melt_activity import melt_activity
+from library.vapor_pressure import vapor_pressure
+from library.vaporiser import equilibrium
+
+def _equilibrium(comp,T,meltSolver,vaporSolver):
+    sim = system(comp,T)
+    equilibrium(sim,melt_activity(sim),vapor_pressure(sim),meltSolver,\
+                vaporSolver)
+    return sim
+
+@pytest.mark.parametrize('comp',['input/BSE.dat','input/Komatiite.dat'])
+@pytest.mark.parametrize('T',[1800,2500,3000])
+@pytest.mark.parametrize('method',['newton','anderson'])
+def test_fixed_point(comp,T,method):
+    '''
+    newton and anderson give the fixed point equilibrium to the solver
+    tolerance: fixed_point stops when the activity coefficients change by
+    less than 1e-5 in log10 per iteration, up to ~1e-4 from the solution
+    '''
+    ref = _equilibrium(comp,T,'fixed_point','fixed_point')
+    sim = _equilibrium(comp,T,method,method)
+    np.testing.assert_allclose(sim._act_ox,ref._act_ox,rtol=5e-4)
+    # The pressures that are not negligible
+    gas = ref._presGas > 1e-30 * ref._presGas.max()
+    np.testing.assert_allclose(sim._presGas[gas],ref._presGas[gas],rtol=5e-4)
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pytest
+
+from conftest import stored
+import main_temp_var
+
+input_fname = 'input/BSE-initial.dat'
+temps = [1500,2000,2500,3000]
+V = 0
+
+def _assert_same(gasMoleFrac,reference):
+    ''' Same gases, and mole fractions to rounding '''
+    assert list(gasMoleFrac) == list(reference)
+    np.testing.assert_allclose(list(gasMoleFrac.values()),\
+                               list(reference.values()),rtol=1e-9,atol=1e-30)
+
+@pytest.fixture(scope='module')
+def serial():
+    ''' Gas mole fractions of main_temp_var.calc by temperature '''
+    return {t : main_temp_var.calc(t,V,input_fname)[0].gasMoleFrac \
+            for t in temps}
+
+def test_stored(serial):
+    ''' The serial sweep gives the rows of the stored temp_var.csv '''
+    with open(os.path.join(stored,'temp_var.csv')) as file:
+        gases = file.readline().rstrip(',\n').split(',')[1:]
+        rows = [line.rstrip(',\n').split(',') for line in file]
+    assert [int(row[0]) for row in rows] == temps
+    for row in rows:
+        _assert_same(serial[int(row[0])],\
+                     dict(zip(gases,np.array(row[1:],dtype=float))))
+
+def test_batch(serial):
+    ''' --batch gives the serial sweep '''
+    batch = main_temp_var.calc_batch(temps,V,input_fname)
+    for i, t in enumerate(temps):
+        _assert_same({gas : frac[i] for gas, frac in \
+                      batch.gasMoleFrac.items()},serial[t])
+
+@pytest.mark.parametrize('batch',[False,True])
+def test_workers(serial,batch):
+    ''' --workers, with and without --batch, gives the serial sweep '''
+    results = list(main_temp_var.calc_parallel(temps,V,input_fname,2,\
+                                               chunksize=2,batch=batch))
+    assert [t for t, *_ in results] == temps
+    for t, gasMoleFrac, _, _ in results:
+        _assert_same(gasMoleFrac,serial[t])